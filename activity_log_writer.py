@@ -0,0 +1,219 @@
+"""
+Activity Log Writer - Write-behind batching untuk tabel activity_log
+
+Event log dimasukkan ke antrian terbatas di memori dan ditulis oleh satu
+thread background sebagai multi-row INSERT setiap flush_interval_ms atau
+setiap batch_size event, sehingga INSERT log tidak lagi berada di jalur
+latency absensi.
+
+Backpressure: jika antrian penuh, pemanggil menunggu sebentar (put_timeout)
+lalu menulis event-nya sendiri secara sinkron - event tidak dibuang.
+shutdown() mem-flush semua event yang tersisa. Jika multi-row INSERT gagal,
+batch ditulis ulang per baris sehingga satu baris rusak tidak membuang
+seluruh batch.
+"""
+
+import queue
+import threading
+import time
+import logging
+from datetime import datetime
+from typing import Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityLogWriter:
+    """
+    Writer asynchronous untuk activity log.
+
+    write_batch_fn(events) menulis list event dict (employee_id,
+    activity_type, description, created_at) dan mengembalikan True jika berhasil.
+    """
+
+    def __init__(self, write_batch_fn: Callable[[List[Dict]], bool], max_queue: int = 10000,
+                 batch_size: int = 200, flush_interval_ms: int = 500, put_timeout: float = 0.05):
+        self.write_batch_fn = write_batch_fn
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.put_timeout = put_timeout
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = False
+        self.stats = {
+            'queued': 0,
+            'written': 0,
+            'batches': 0,
+            'sync_writes': 0,  # Backpressure: queue full, caller wrote itself
+            'failed': 0
+        }
+
+    def _enqueue(self, event: Dict) -> bool:
+        """
+        Antrikan event jika writer belum berhenti
+
+        stopped dicek dan event dimasukkan di bawah lock yang sama dengan
+        shutdown(), jadi event selalu berada sebelum marker stop di antrian.
+        """
+        with self.lock:
+            if self.stopped:
+                return False
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='activity-log-writer', daemon=True)
+                self.thread.start()
+            try:
+                self.queue.put_nowait(event)
+            except queue.Full:
+                return False
+            self.stats['queued'] += 1
+            return True
+
+    def submit(self, employee_id, activity_type, description='') -> bool:
+        """Masukkan event ke antrian (atau tulis langsung jika antrian penuh/writer berhenti)"""
+        event = {
+            'employee_id': employee_id,
+            'activity_type': activity_type,
+            'description': description,
+            'created_at': datetime.now()
+        }
+        if self._enqueue(event):
+            return True
+        if not self.stopped:
+            # Queue full: give the writer put_timeout to make room
+            time.sleep(self.put_timeout)
+            if self._enqueue(event):
+                return True
+            logger.warning("Activity log queue penuh - menulis secara sinkron")
+
+        with self.lock:
+            self.stats['sync_writes'] += 1
+        ok = self._write([event])
+        if not ok:
+            with self.lock:
+                self.stats['failed'] += 1
+        return ok
+
+    def _write(self, events: List[Dict], attempts: int = 1) -> bool:
+        ok = False
+        for attempt in range(attempts):
+            if attempt:
+                time.sleep(0.2)
+            try:
+                ok = bool(self.write_batch_fn(events))
+            except Exception as e:
+                logger.error(f"Gagal menulis activity log batch: {e}")
+            if ok:
+                break
+        if ok:
+            with self.lock:
+                self.stats['written'] += len(events)
+                self.stats['batches'] += 1
+        return ok
+
+    def _write_batch(self, batch: List[Dict]):
+        """Multi-row INSERT dengan satu retry; jika tetap gagal, tulis per baris"""
+        # One retry (e.g. a pooled connection that just died)
+        if self._write(batch, attempts=2):
+            return
+        failed = len(batch)
+        if len(batch) > 1:
+            logger.warning(f"Activity log batch ({len(batch)} event) gagal - menulis per baris")
+            failed = sum(1 for event in batch if not self._write([event]))
+        if failed:
+            with self.lock:
+                self.stats['failed'] += failed
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if self.stopped:
+                    return
+                continue
+
+            # Control markers are ('flush' | 'stop', threading.Event)
+            batch = []
+            markers = []
+            deadline = time.time() + self.flush_interval
+            while True:
+                if isinstance(item, tuple):
+                    markers.append(item)
+                    # A flush request writes immediately
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._write_batch(batch)
+
+            if any(kind == 'stop' for kind, _ in markers):
+                # Anything still queued behind the stop marker is written before returning
+                self._drain()
+            for _, done in markers:
+                done.set()
+            if any(kind == 'stop' for kind, _ in markers):
+                return
+
+    def _drain(self):
+        """Tulis semua event yang tersisa di antrian (marker lain langsung diselesaikan)"""
+        batch = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, tuple):
+                item[1].set()
+                continue
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._write_batch(batch)
+                batch = []
+        if batch:
+            self._write_batch(batch)
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Tulis semua event yang sudah diantrikan; True jika selesai dalam timeout"""
+        if self.thread is None or not self.thread.is_alive():
+            return self.queue.empty()
+        done = threading.Event()
+        try:
+            self.queue.put(('flush', done), timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def shutdown(self, timeout: float = 5.0) -> bool:
+        """Flush dan hentikan writer (dipanggil saat aplikasi berhenti)"""
+        with self.lock:
+            if self.stopped:
+                return True
+            self.stopped = True
+            thread = self.thread
+        if thread is None or not thread.is_alive():
+            return True
+        done = threading.Event()
+        try:
+            self.queue.put(('stop', done), timeout=timeout)
+        except queue.Full:
+            return False
+        finished = done.wait(timeout)
+        thread.join(timeout=1)
+        logger.info(f"Activity log writer berhenti: {self.get_stats()}")
+        return finished
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            stats = dict(self.stats)
+        stats['pending'] = self.queue.qsize()
+        return stats
@@ -0,0 +1,250 @@
+"""
+ANN Index - IVF-flat approximate nearest-neighbour search untuk embedding wajah
+
+Embedding (sudah L2-normalized) dikelompokkan dengan spherical k-means ke
+beberapa "list". Saat query hanya nprobe list terdekat yang discan, lalu
+kandidat top-k dikembalikan sebagai nomor baris matrix untuk di-rerank
+secara exact oleh pemanggil.
+
+Index hanya menyimpan centroid dan permutasi baris (bukan salinan vektor);
+vektor tetap dibaca dari matrix embedding store (mmap). File disimpan di
+samping header store (face_embeddings.ivf.npz) dan ditandai dengan checksum
+generasi store, sehingga index basi otomatis dibangun ulang.
+
+Benchmark recall/latency terhadap exact scan:
+    python ann_index.py [static/face_embeddings.json]
+"""
+
+import os
+import time
+import logging
+from typing import Dict, Optional
+
+import numpy as np
+
+from embedding_store import _atomic_write
+
+logger = logging.getLogger(__name__)
+
+ANN_FORMAT_VERSION = 1
+
+
+def _normalize(query: np.ndarray) -> np.ndarray:
+    query = np.asarray(query, dtype=np.float32).ravel()
+    norm = np.linalg.norm(query)
+    return query / norm if norm > 0 else query
+
+
+def _assign(matrix: np.ndarray, centroids: np.ndarray, chunk_size: int = 65536) -> np.ndarray:
+    """Nearest centroid (inner product) per row, in chunks to bound memory"""
+    assignment = np.empty(len(matrix), dtype=np.int32)
+    for start in range(0, len(matrix), chunk_size):
+        block = np.asarray(matrix[start:start + chunk_size], dtype=np.float32)
+        assignment[start:start + chunk_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignment
+
+
+class IVFFlatIndex:
+    """
+    Inverted-file index (flat, tanpa kompresi) di atas matrix embedding.
+
+    List l memiliki baris list_rows[list_offsets[l]:list_offsets[l + 1]].
+    """
+
+    def __init__(self, centroids: np.ndarray, list_rows: np.ndarray, list_offsets: np.ndarray,
+                 checksum: str = ''):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.list_rows = np.asarray(list_rows, dtype=np.int64)
+        self.list_offsets = np.asarray(list_offsets, dtype=np.int64)
+        self.checksum = checksum
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def rows(self) -> int:
+        return len(self.list_rows)
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, n_lists: Optional[int] = None, iterations: int = 10,
+              sample_per_list: int = 256, checksum: str = '', seed: int = 0) -> 'IVFFlatIndex':
+        """
+        Train spherical k-means centroids and assign every row to a list
+
+        Args:
+            matrix: (N, D) float32, rows L2-normalized
+            n_lists: Jumlah list (default ~4 * sqrt(N))
+            iterations: Iterasi k-means
+            sample_per_list: Maksimum baris training per list (subsample)
+            checksum: Checksum generasi store yang diindeks
+        """
+        rows = len(matrix)
+        if rows == 0:
+            raise ValueError("Cannot build ANN index over an empty matrix")
+        if n_lists is None:
+            n_lists = int(4 * np.sqrt(rows))
+        n_lists = max(1, min(n_lists, rows))
+
+        rng = np.random.default_rng(seed)
+        sample_size = min(rows, n_lists * sample_per_list)
+        sample_ids = np.sort(rng.choice(rows, size=sample_size, replace=False))
+        sample = np.asarray(matrix[sample_ids], dtype=np.float32)
+
+        centroids = sample[rng.choice(sample_size, size=n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = _assign(sample, centroids)
+            order = np.argsort(assignment, kind='stable')
+            sizes = np.bincount(assignment, minlength=n_lists)
+            starts = np.zeros(n_lists, dtype=np.int64)
+            starts[1:] = np.cumsum(sizes)[:-1]
+            sums = np.zeros_like(centroids)
+            filled = sizes > 0
+            sums[filled] = np.add.reduceat(sample[order], starts[filled], axis=0)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            empty = norms[:, 0] == 0
+            # Empty lists keep their previous centroid
+            sums[empty] = centroids[empty]
+            norms[empty] = 1.0
+            centroids = sums / norms
+
+        assignment = _assign(matrix, centroids)
+        list_rows = np.argsort(assignment, kind='stable').astype(np.int64)
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        list_offsets[1:] = np.cumsum(np.bincount(assignment, minlength=n_lists))
+
+        return cls(centroids, list_rows, list_offsets, checksum=checksum)
+
+    def search(self, matrix: np.ndarray, query: np.ndarray, k: int = 64, nprobe: int = 8) -> np.ndarray:
+        """
+        Approximate top-k rows by inner product
+
+        Returns:
+            Row numbers into matrix, best first (at most k)
+        """
+        query = _normalize(query)
+        nprobe = max(1, min(nprobe, self.n_lists))
+
+        centroid_scores = self.centroids @ query
+        if nprobe < self.n_lists:
+            probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probe = np.arange(self.n_lists)
+
+        candidates = np.concatenate([
+            self.list_rows[self.list_offsets[l]:self.list_offsets[l + 1]] for l in probe
+        ])
+        if len(candidates) == 0:
+            return candidates
+
+        candidates.sort()  # Sequential access into the mmap
+        similarities = np.asarray(matrix[candidates], dtype=np.float32) @ query
+        if len(candidates) > k:
+            top = np.argpartition(-similarities, k - 1)[:k]
+        else:
+            top = np.arange(len(candidates))
+        return candidates[top[np.argsort(-similarities[top])]]
+
+    def save(self, path: str):
+        """Persist atomically as .npz"""
+        def write(f):
+            np.savez(
+                f,
+                version=np.int64(ANN_FORMAT_VERSION),
+                checksum=np.array(self.checksum),
+                centroids=self.centroids,
+                list_rows=self.list_rows,
+                list_offsets=self.list_offsets
+            )
+        _atomic_write(path, write, suffix='.npz')
+
+    @classmethod
+    def load(cls, path: str, checksum: Optional[str] = None) -> Optional['IVFFlatIndex']:
+        """Load a persisted index; None if missing, outdated or for another store generation"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if int(data['version']) != ANN_FORMAT_VERSION:
+                    return None
+                stored_checksum = str(data['checksum'])
+                if checksum is not None and stored_checksum != checksum:
+                    return None
+                return cls(data['centroids'], data['list_rows'], data['list_offsets'],
+                           checksum=stored_checksum)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable ANN index {path}: {e}")
+            return None
+
+
+def benchmark(index: IVFFlatIndex, matrix: np.ndarray, queries: np.ndarray,
+              owners: Optional[np.ndarray] = None, k: int = 64, nprobe: int = 8) -> Dict:
+    """
+    Recall dan latency ANN dibanding exact scan
+
+    Returns:
+        Dict dengan recall@k (baris), identity_recall (identitas terbaik exact
+        ikut dalam kandidat ANN, jika owners diberikan) dan latency rata-rata (ms)
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    row_hits = 0
+    identity_hits = 0
+    exact_time = 0.0
+    ann_time = 0.0
+
+    for query in queries:
+        q = _normalize(query)
+
+        start = time.perf_counter()
+        similarities = np.asarray(matrix, dtype=np.float32) @ q
+        kk = min(k, len(similarities))
+        exact_top = np.argpartition(-similarities, kk - 1)[:kk]
+        exact_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        ann_top = index.search(matrix, q, k=k, nprobe=nprobe)
+        ann_time += time.perf_counter() - start
+
+        row_hits += len(np.intersect1d(exact_top, ann_top)) / kk
+        if owners is not None:
+            best_identity = owners[int(np.argmax(similarities))]
+            identity_hits += int(best_identity in set(owners[ann_top].tolist()))
+
+    n = max(len(queries), 1)
+    result = {
+        'queries': len(queries),
+        'k': k,
+        'nprobe': nprobe,
+        'n_lists': index.n_lists,
+        'recall_at_k': round(row_hits / n, 4),
+        'exact_ms': round(1000 * exact_time / n, 3),
+        'ann_ms': round(1000 * ann_time / n, 3)
+    }
+    if owners is not None:
+        result['identity_recall'] = round(identity_hits / n, 4)
+    return result
+
+
+if __name__ == '__main__':
+    import sys
+    from embedding_store import EmbeddingStore
+
+    logging.basicConfig(level=logging.INFO)
+    header_path = sys.argv[1] if len(sys.argv) > 1 else 'static/face_embeddings.json'
+    store_index = EmbeddingStore(header_path).load(verify=False)
+    if store_index is None or len(store_index['matrix']) == 0:
+        print(f"No embeddings in {header_path}")
+        sys.exit(1)
+
+    store_matrix = store_index['matrix']
+    rng = np.random.default_rng(1)
+    query_ids = rng.choice(len(store_matrix), size=min(200, len(store_matrix)), replace=False)
+    # Noisy copies of stored rows stand in for fresh captures
+    noisy = np.asarray(store_matrix[np.sort(query_ids)], dtype=np.float32)
+    noisy += rng.normal(scale=0.02, size=noisy.shape).astype(np.float32)
+
+    start = time.perf_counter()
+    ivf = IVFFlatIndex.build(store_matrix)
+    print(f"Built {ivf.n_lists} lists over {ivf.rows} rows in {time.perf_counter() - start:.1f}s")
+    for probes in (1, 4, 8, 16, 32):
+        print(benchmark(ivf, store_matrix, noisy, owners=store_index['owners'], nprobe=probes))
@@ -8,13 +8,12 @@ import base64
 import re
 import json
 from io import BytesIO
-from flask import Flask, request, render_template, jsonify, session, redirect, url_for, flash, make_response
+from PIL import Image
+from flask import (Flask, request, render_template, jsonify, session, redirect, url_for, flash, make_response,
+                   Response, stream_with_context, send_file)
 from werkzeug.utils import secure_filename
 from datetime import date, datetime, timedelta
 import numpy as np
-from sklearn.neighbors import KNeighborsClassifier
-import pandas as pd
-import joblib
 import shutil
 import qrcode
 from functools import wraps
@@ -27,9 +26,20 @@ import atexit
 
 # Import database modules
 from database import get_db_manager
-from models import Employee, Attendance, ActivityLog
-from config import get_app_config
+from models import Employee, Attendance, ActivityLog, activity_log_writer
+from config import get_app_config, FACE_CONFIG, EXPORT_CONFIG, EVENT_BUS_CONFIG
 from qr_sync import qr_sync_manager, start_cleanup_thread
+from training_jobs import TrainingJobManager
+from frame_pipeline import FramePipeline
+from frame_source import open_frame_source
+from employee_directory import employee_directory
+from attendance_rollup import attendance_rollup
+from report_cache import report_cache, EMPLOYEES_TAG
+from event_bus import event_bus, sse_stream
+from state_backend import state_backend, SharedVersion
+from model_warmup import ModelWarmup
+from report_export import (EXPORT_FORMATS, build_export_query, iter_csv, iter_json, iter_ndjson,
+                           write_xlsx, peek_rows, export_file_cache)
 import logging
 
 # Setup logging FIRST (before importing InsightFace)
@@ -47,7 +57,11 @@ try:
         extract_face_embedding,
         detect_faces_insightface,
         get_database_stats,
-        load_face_database
+        load_face_database,
+        warm_up_insightface,
+        resolve_model_profile,
+        recognize_faces_batch,
+        identify_aligned_face
     )
     USE_INSIGHTFACE = True
     logger.info("✅ InsightFace loaded - using ArcFace (99%+ accuracy)")
@@ -63,6 +77,8 @@ app.secret_key = app_config['secret_key']
 # Enable response compression for performance
 try:
     from flask_compress import Compress
+    # Compressing a streamed response would buffer it whole (report exports stream)
+    app.config['COMPRESS_STREAMS'] = False
     Compress(app)
     logger.info("🗜️ Response compression enabled")
 except ImportError:
@@ -98,36 +114,41 @@ def generate_unit_code(force_new=False):
     
     return hashlib.md5(secret_base.encode()).hexdigest()[:8].upper()
 
+def set_current_unit_code(unit_code):
+    """Simpan kode unit di state bersama supaya semua worker menampilkan QR yang sama"""
+    global current_unit_code, qr_code_generated_time
+    current_unit_code = unit_code
+    qr_code_generated_time = datetime.now()
+    state_backend.set('qr:unit_code', {'code': unit_code, 'generated_at': qr_code_generated_time.isoformat()},
+                      ttl=QR_VALIDITY_MINUTES * 60)
+
 def get_current_unit_code():
     """Dapatkan kode unit saat ini, generate baru jika perlu"""
     global current_unit_code, qr_code_generated_time
     
-    current_time = datetime.now()
-    
-    # Jika belum ada kode atau sudah lewat 10 menit, generate baru
-    if (current_unit_code is None or 
-        qr_code_generated_time is None or 
-        (current_time - qr_code_generated_time).total_seconds() >= QR_VALIDITY_MINUTES * 60):
-        
-        current_unit_code = generate_unit_code()
-        qr_code_generated_time = current_time
-        logger.info(f"Generated new unit code: {current_unit_code}")
+    # Kode unit expired di state backend setelah 10 menit
+    state = state_backend.get('qr:unit_code')
+    if state is None:
+        state = {'code': generate_unit_code(), 'generated_at': datetime.now().isoformat()}
+        if state_backend.set_if_absent('qr:unit_code', state, ttl=QR_VALIDITY_MINUTES * 60):
+            logger.info(f"Generated new unit code: {state['code']}")
+        else:
+            # Another worker generated it first
+            state = state_backend.get('qr:unit_code') or state
     
+    current_unit_code = state['code']
+    qr_code_generated_time = datetime.fromisoformat(state['generated_at'])
     return current_unit_code
 
-# QR Code cache for performance
-_qr_cache = {'code': None, 'image': None, 'url': None, 'timestamp': None}
-
 def generate_qr_code():
-    """Generate QR code untuk authentication - with caching"""
-    global _qr_cache
-    
+    """Generate QR code untuk authentication - with caching (state bersama, per kode unit)"""
     unit_code = get_current_unit_code()
     
     # Return cached QR if same code (performance optimization)
-    if _qr_cache['code'] == unit_code and _qr_cache['image']:
+    cached = state_backend.get(f'qr:image:{unit_code}')
+    if cached:
         logger.debug(f"Using cached QR code for: {unit_code}")
-        return _qr_cache['image'], _qr_cache['url']
+        return cached['image'], cached['url']
     
     base_url = request.host_url.rstrip('/')
     qr_url = f"{base_url}/mobile_verify?unit={unit_code}"
@@ -150,12 +171,7 @@ def generate_qr_code():
     img_str = base64.b64encode(buffered.getvalue()).decode()
     
     # Cache the result
-    _qr_cache = {
-        'code': unit_code,
-        'image': img_str,
-        'url': qr_url,
-        'timestamp': datetime.now()
-    }
+    state_backend.set(f'qr:image:{unit_code}', {'image': img_str, 'url': qr_url}, ttl=QR_VALIDITY_MINUTES * 60)
     logger.debug(f"Generated and cached new QR code: {unit_code}")
     
     return img_str, qr_url
@@ -169,6 +185,39 @@ def is_valid_unit_code(provided_code):
 db_manager = get_db_manager()
 if not db_manager.initialize_database():
     logger.error("Gagal inisialisasi database!")
+else:
+    # Warm employee directory so recognition lookups never hit the database
+    employee_directory.warm()
+    # One-time backfill of the report rollups for databases created before they existed
+    # (rollup worker thread, one gunicorn worker at a time via GET_LOCK)
+    attendance_rollup.schedule_backfill()
+
+# ONNX sessions are built in the background so the first kiosk scan doesn't pay for it;
+# /health/ready only answers 200 once inference is hot
+if USE_INSIGHTFACE:
+    model_warmup = ModelWarmup(warm_up_insightface)
+    model_warmup.start()
+else:
+    model_warmup = ModelWarmup(lambda: False)
+    model_warmup.mark_degraded('InsightFace tidak tersedia')
+
+# Report results built from the rollups are dropped once the background refresh lands
+attendance_rollup.add_listener(report_cache.invalidate_attendance)
+
+export_data_versions = SharedVersion('export:data_version')
+
+def export_data_version():
+    """Versi data absensi untuk key cache file export (state backend, dibagi antar worker)"""
+    return export_data_versions.current()
+
+def bump_export_data_version(employee_id=None, dates=None):
+    """Listener rollup: file export yang sudah dirender tidak dipakai lagi setelah data berubah"""
+    export_data_versions.bump()
+
+attendance_rollup.add_listener(bump_export_data_version)
+
+# Buffered activity logs are written out on any normal interpreter exit (also under gunicorn)
+atexit.register(activity_log_writer.shutdown)
 
 nimgs = 10
 selected_camera_id = 0  # Akan dipilih lewat dropdown
@@ -226,11 +275,47 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def current_week_range():
+    """Periode yang dibaca extract_attendance() dan statistik dashboard (termasuk hari ini)"""
+    today = date.today()
+    return min(start_of_week, today), max(end_of_week, today)
+
+def cached_report(date_range_fn):
+    """
+    Decorator: cache response JSON endpoint laporan/statistik di report_cache
+    
+    date_range_fn() mengembalikan periode (start, end) yang dibaca endpoint,
+    dipakai untuk invalidasi per tanggal. Semua hasil juga bergantung pada
+    daftar karyawan (EMPLOYEES_TAG). Response error tidak di-cache.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            try:
+                date_range = date_range_fn()
+                report_cache.date_tags(*date_range)
+            except (TypeError, ValueError):
+                # Unparseable period: let the view report the error itself
+                return f(*args, **kwargs)
+            
+            def compute():
+                response = make_response(f(*args, **kwargs))
+                payload = response.get_json(silent=True) if response.status_code == 200 else None
+                if not isinstance(payload, dict) or payload.get('status') == 'error' or 'error' in payload:
+                    return response
+                return payload
+            
+            key = (request.endpoint, tuple(sorted(request.args.items(multi=True))), date.today().isoformat())
+            result = report_cache.get_or_compute(key, compute, date_range=date_range, tags=[EMPLOYEES_TAG],
+                                                 cache_if=lambda value: isinstance(value, dict))
+            return jsonify(result) if isinstance(result, dict) else result
+        return decorated_function
+    return decorator
+
 def totalreg():
     """Menghitung total karyawan terdaftar dari database"""
     try:
-        employees = Employee.get_all_employees()
-        return len(employees) if employees else 0
+        return employee_directory.count()
     except Exception as e:
         logger.error(f"Error getting total registered employees: {e}")
         # Fallback ke folder jika database error
@@ -239,6 +324,12 @@ def totalreg():
         except:
             return 0
 
+def face_model_exists():
+    """Cek apakah ada model/embedding wajah yang sudah di-training"""
+    static_files = os.listdir('static')
+    model_files = ('face_embeddings.json', 'face_embeddings.pkl', 'face_recognition_model.pkl')
+    return any(model_file in static_files for model_file in model_files)
+
 def extract_faces(img):
     try:
         gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
@@ -247,6 +338,70 @@ def extract_faces(img):
     except:
         return []
 
+def face_present(img):
+    """Gate murah sebelum detector InsightFace: Haar di frame setengah ukuran, hanya ada/tidak ada wajah"""
+    try:
+        small = cv2.resize(img, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return len(face_detector.detectMultiScale(gray, 1.2, 3, minSize=(20, 20))) > 0
+    except Exception:
+        return True  # Never block recognition because the gate failed
+
+def employee_name_for(nik_or_name):
+    """Hasil recognition bisa berupa NIK (angka) - ganti dengan nama karyawan dari database"""
+    if nik_or_name == "Unknown" or not nik_or_name.isdigit():
+        return nik_or_name
+    try:
+        # Directory of this worker first; an employee just enrolled through another
+        # worker may not be in it yet
+        employee = employee_directory.get_by_nik(nik_or_name) or Employee.get_employee_by_nik(nik_or_name)
+        if employee:
+            final_name = employee.get('name', nik_or_name)
+            logger.info(f"📋 NIK {nik_or_name} -> Nama: {final_name}")
+            return final_name
+    except Exception as lookup_err:
+        logger.warning(f"⚠️ NIK lookup failed: {lookup_err}")
+    return nik_or_name
+
+def recognize_frame(frame, endpoint=None, max_faces=None):
+    """
+    Deteksi dan identifikasi wajah di frame penuh dalam satu pass InsightFace
+    (tanpa Haar, tanpa resize/crop dulu)
+    
+    Returns:
+        List dict box (x, y, w, h), landmarks, identity (nama karyawan), confidence;
+        wajah terbesar dulu. Kosong jika tidak ada wajah.
+    """
+    return recognize_frames([frame], endpoint, max_faces)[0]
+
+def recognize_frames(frames, endpoint=None, max_faces=None):
+    """
+    recognize_frame untuk banyak gambar sekaligus: wajah dari semua gambar
+    di-embed per batch dan dicocokkan dalam satu perkalian matriks
+    
+    Returns:
+        List hasil recognize_frame per gambar (gambar None = list kosong)
+    """
+    if not USE_INSIGHTFACE:
+        logger.error("InsightFace tidak tersedia!")
+        return [[] for _ in frames]
+    
+    batches = recognize_faces_batch(frames, threshold=0.45, profile=resolve_model_profile(endpoint=endpoint),
+                                    max_faces=max_faces)
+    results = []
+    for faces in batches:
+        frame_results = []
+        for face in faces:
+            x1, y1, x2, y2 = face['bbox']
+            frame_results.append({
+                'box': (x1, y1, x2 - x1, y2 - y1),
+                'landmarks': face['landmarks'],
+                'identity': employee_name_for(face['identity']),
+                'confidence': face['confidence']
+            })
+        results.append(frame_results)
+    return results
+
 def identify_face(facearray):
     """
     Identify face menggunakan InsightFace/ArcFace (99%+ accuracy)
@@ -282,17 +437,7 @@ def identify_face(facearray):
         nik_or_name, confidence = identify_face_insightface(face_bgr, threshold=0.45)
         
         # NIK to Name lookup - jika hasil adalah NIK (angka), cari nama dari database
-        final_name = nik_or_name
-        if nik_or_name != "Unknown" and nik_or_name.isdigit():
-            # Ini adalah NIK, cari nama karyawan dari database
-            try:
-                employee = Employee.get_employee_by_nik(nik_or_name)
-                if employee:
-                    final_name = employee.get('name', nik_or_name)
-                    logger.info(f"📋 NIK {nik_or_name} -> Nama: {final_name}")
-            except Exception as lookup_err:
-                logger.warning(f"⚠️ NIK lookup failed: {lookup_err}")
-                final_name = nik_or_name
+        final_name = employee_name_for(nik_or_name)
         
         logger.info(f"✅ InsightFace result: {final_name} ({confidence:.1f}%)")
         return [final_name], confidence
@@ -301,12 +446,13 @@ def identify_face(facearray):
         logger.error(f"❌ InsightFace recognition failed: {e}")
         return ['Unknown'], 0.0
 
-def identify_face_insightface_wrapper(face_bgr):
+def identify_face_insightface_wrapper(face_bgr, endpoint=None):
     """
     Wrapper untuk InsightFace recognition yang menerima gambar BGR langsung
     
     Args:
         face_bgr: BGR color image (OpenCV format)
+        endpoint: Nama endpoint untuk memilih model profile (FACE_ENDPOINT_PROFILES)
     
     Returns:
         Tuple of (prediction_list, confidence_score)
@@ -325,18 +471,12 @@ def identify_face_insightface_wrapper(face_bgr):
             sys.path.insert(0, user_packages)
         
         # Call InsightFace directly with BGR image
-        nik_or_name, confidence = identify_face_insightface(face_bgr, threshold=0.45)
+        nik_or_name, confidence = identify_face_insightface(
+            face_bgr, threshold=0.45, profile=resolve_model_profile(endpoint=endpoint)
+        )
         
         # NIK to Name lookup
-        final_name = nik_or_name
-        if nik_or_name != "Unknown" and nik_or_name.isdigit():
-            try:
-                employee = Employee.get_employee_by_nik(nik_or_name)
-                if employee:
-                    final_name = employee.get('name', nik_or_name)
-                    logger.info(f"📋 NIK {nik_or_name} -> Nama: {final_name}")
-            except Exception as lookup_err:
-                logger.warning(f"⚠️ NIK lookup failed: {lookup_err}")
+        final_name = employee_name_for(nik_or_name)
         
         logger.info(f"✅ InsightFace BGR result: {final_name} ({confidence:.1f}%)")
         return [final_name], confidence
@@ -347,10 +487,53 @@ def identify_face_insightface_wrapper(face_bgr):
         traceback.print_exc()
         return ['Unknown'], 0.0
 
-def train_model():
+def recognize_face_crop(face_bgr):
+    """recognize_fn untuk FramePipeline: crop wajah BGR -> (nama, confidence)"""
+    identified_users, confidence = identify_face_insightface_wrapper(face_bgr, endpoint='kiosk')
+    return identified_users[0], confidence
+
+def detect_face_landmarks(frame):
+    """detect_fn FramePipeline: box + 5 keypoint dari detector InsightFace (tanpa embedding)"""
+    faces = detect_faces_insightface(frame, profile=resolve_model_profile(endpoint='kiosk'), with_embeddings=False)
+    return [{
+        'box': (face['bbox'][0], face['bbox'][1], face['bbox'][2] - face['bbox'][0], face['bbox'][3] - face['bbox'][1]),
+        'landmarks': face['landmarks']
+    } for face in faces]
+
+def recognize_face_landmarks(frame, landmarks):
+    """landmark_recognize_fn FramePipeline: align dari keypoint track -> (nama, confidence), tanpa deteksi ulang"""
+    nik_or_name, confidence = identify_aligned_face(frame, landmarks, threshold=0.45,
+                                                    profile=resolve_model_profile(endpoint='kiosk'))
+    return employee_name_for(nik_or_name), confidence
+
+def create_frame_pipeline():
+    """Pipeline kamera: detector InsightFace setiap N frame, tracking, ArcFace hanya untuk track baru/lebih tajam"""
+    if not USE_INSIGHTFACE:
+        return FramePipeline(
+            extract_faces,
+            recognize_face_crop,
+            detect_every=FACE_CONFIG['track_detect_every'],
+            quality_gain=FACE_CONFIG['track_quality_gain']
+        )
+    # Haar only as an optional presence gate: skips the detector while nobody is in front of the camera
+    return FramePipeline(
+        detect_face_landmarks,
+        recognize_face_crop,
+        detect_every=FACE_CONFIG['track_detect_every'],
+        quality_gain=FACE_CONFIG['track_quality_gain'],
+        landmark_recognize_fn=recognize_face_landmarks,
+        presence_fn=face_present if FACE_CONFIG['presence_gate'] else None
+    )
+
+def train_model(full_rebuild=False, progress_callback=None):
     """
     Train face recognition menggunakan InsightFace/ArcFace (99%+ accuracy)
     Hanya butuh 5-10 foto per orang untuk hasil optimal
+    
+    Default incremental: hanya foto baru/berubah yang diproses.
+    full_rebuild=True memproses ulang semua foto di static/faces.
+    
+    Fungsi ini blocking - dari HTTP request gunakan training_job_manager.submit()
     """
     if not USE_INSIGHTFACE:
         logger.error("InsightFace tidak tersedia! Install dengan: pip install insightface onnxruntime")
@@ -371,7 +554,15 @@ def train_model():
         # Update progress
         set_training_status(True, 'Model', 30, 'Memuat model InsightFace...')
         
-        success = train_insightface_model()
+        def report_progress(done, total, image_name):
+            # Embedding per foto: 30-80%
+            progress = 30 + int(50 * done / total) if total else 80
+            set_training_status(True, 'Model', progress, f'Memproses foto {done}/{total} ({image_name})...',
+                                throttle=True)
+            if progress_callback:
+                progress_callback(done, total, image_name)
+        
+        success = train_insightface_model(full_rebuild=full_rebuild, progress_callback=report_progress)
         
         if success:
             # Update progress
@@ -397,6 +588,28 @@ def train_model():
         traceback.print_exc()
         return False
 
+TRAINING_JOB_STATE_TTL = 24 * 3600  # Detik snapshot job disimpan di state bersama
+
+def publish_training_job(job):
+    """Bagikan snapshot job ke worker lain (state backend) dan ke live feed"""
+    state_backend.set(f"training_job:{job['id']}", job, ttl=TRAINING_JOB_STATE_TTL)
+    if job['status'] in ('queued', 'running'):
+        state_backend.set('training_job:active', job['id'], ttl=TRAINING_JOB_STATE_TTL)
+    else:
+        state_backend.compare_and_set('training_job:active', job['id'], None)
+    event_bus.publish('training', job)
+
+def get_shared_training_job(job_id=None):
+    """Snapshot job dari worker ini, atau dari state bersama jika job berjalan di worker lain"""
+    job = training_job_manager.get_job(job_id) if job_id else training_job_manager.get_active_job()
+    if job is None:
+        job_id = job_id or state_backend.get('training_job:active')
+        job = state_backend.get(f'training_job:{job_id}') if job_id else None
+    return job
+
+# Background training: request HTTP hanya mendaftarkan job (lihat /api/training_status/<job_id>)
+training_job_manager = TrainingJobManager(train_model, on_update=publish_training_job)
+
 def capture_employee_face_gui(name, bagian):
     """Capture wajah karyawan menggunakan GUI kamera"""
     try:
@@ -835,14 +1048,11 @@ def refresh_qr():
     """Endpoint untuk refresh QR code via AJAX - dipanggil otomatis setiap 10 menit"""
     try:
         # Force regenerate QR code dengan kode baru
-        global current_unit_code, qr_code_generated_time
-        
         # Generate kode baru dengan force_new=True
-        current_unit_code = generate_unit_code(force_new=True)
-        qr_code_generated_time = datetime.now()
+        unit_code = generate_unit_code(force_new=True)
+        set_current_unit_code(unit_code)
         
         qr_image, qr_url = generate_qr_code()
-        unit_code = current_unit_code
         
         # Reset waktu tersisa ke 10 menit
         remaining_seconds = QR_VALIDITY_MINUTES * 60
@@ -1431,19 +1641,20 @@ def camera_debug():
 def api_train_model():
     """API endpoint untuk training model InsightFace"""
     try:
-        logger.info("🚀 API: Training InsightFace model...")
-        success = train_model()
+        data = request.get_json(silent=True) or request.form
+        full_rebuild = str(data.get('full_rebuild', request.args.get('full_rebuild', ''))).lower() in ('1', 'true', 'yes')
         
-        if success:
-            return jsonify({
-                'status': 'success',
-                'message': '✅ Model InsightFace berhasil ditraining!'
-            }), 200
-        else:
-            return jsonify({
-                'status': 'error',
-                'error': 'Training gagal - tidak ada data wajah yang valid'
-            }), 400
+        logger.info(f"🚀 API: Queue InsightFace training (full_rebuild={full_rebuild})...")
+        job, created = training_job_manager.submit(full_rebuild=full_rebuild, reason='api_train_model')
+        
+        return jsonify({
+            'status': 'success',
+            'message': '✅ Training model dijadwalkan' if created else '✅ Training model sudah dalam antrian',
+            'job_id': job['id'],
+            'coalesced': not created,
+            'status_url': url_for('get_training_job_status', job_id=job['id']),
+            'job': job
+        }), 202
             
     except Exception as e:
         logger.error(f"Error in api_train_model: {e}")
@@ -1491,8 +1702,8 @@ def simulate_training():
     except Exception as e:
         return jsonify({'status': 'error', 'error': str(e)}), 500
 
-# Global training status
-training_status = {
+# Training status awal; status terkini disimpan di state bersama (key training_status)
+TRAINING_STATUS_IDLE = {
     'is_training': False,
     'employee_name': '',
     'progress': 0,
@@ -1503,18 +1714,44 @@ training_status = {
 @app.route('/api/training_status')
 def get_training_status():
     """API untuk mendapatkan status training real-time"""
-    global training_status
-    return jsonify(training_status)
-
-def set_training_status(is_training, employee_name='', progress=0, message=''):
-    """Helper function untuk update training status"""
-    global training_status
-    training_status.update({
+    training_status = state_backend.get('training_status', TRAINING_STATUS_IDLE)
+    return jsonify({**training_status, 'job': get_shared_training_job()})
+
+@app.route('/api/training_status/<job_id>')
+def get_training_job_status(job_id):
+    """Status satu job training: progress, ETA dan throughput (foto/detik)"""
+    job = get_shared_training_job(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'error': 'Job training tidak ditemukan'}), 404
+    return jsonify({'status': 'success', 'job': job})
+
+TRAINING_STATUS_INTERVAL = 0.5  # Detik minimum antar write progress per foto (sama dengan job training)
+training_status_lock = threading.Lock()
+training_status_local = {'start_time': None, 'written_at': 0.0}
+
+def set_training_status(is_training, employee_name='', progress=0, message='', throttle=False):
+    """
+    Helper function untuk update training status
+    
+    throttle=True untuk progress per foto: write ke state bersama paling sering
+    sekali per TRAINING_STATUS_INTERVAL. start_time tetap dari awal training.
+    """
+    now = time.time()
+    with training_status_lock:
+        if throttle and now - training_status_local['written_at'] < TRAINING_STATUS_INTERVAL:
+            return
+        if not is_training:
+            training_status_local['start_time'] = None
+        elif training_status_local['start_time'] is None:
+            training_status_local['start_time'] = datetime.now().isoformat()
+        start_time = training_status_local['start_time']
+        training_status_local['written_at'] = now
+    state_backend.set('training_status', {
         'is_training': is_training,
         'employee_name': employee_name,
         'progress': progress,
         'message': message,
-        'start_time': datetime.now().isoformat() if is_training else None
+        'start_time': start_time
     })
 
 @app.route('/test/auto-training')
@@ -1695,13 +1932,13 @@ def save_photos_simple():
         if saved < 5:
             return jsonify({'success': False, 'message': 'Gagal menyimpan foto'})
         
-        # LANGSUNG TRAINING
-        train_success = train_model()
+        # Training di background
+        job, _ = training_job_manager.submit(employee_name=name, reason='save_photos_simple')
         
         return jsonify({
             'success': True, 
-            'message': f'✅ {name} berhasil! {saved} foto disimpan dan model di-training.',
-            'trained': train_success
+            'message': f'✅ {name} berhasil! {saved} foto disimpan, training model berjalan di background.',
+            'training_job_id': job['id']
         })
         
     except Exception as e:
@@ -1754,7 +1991,8 @@ def save_face_training():
                 
                 # Update progress
                 progress = 5 + (idx / len(photos)) * 20  # 5-25%
-                set_training_status(True, full_name, int(progress), f'Menyimpan foto {idx}/{len(photos)}...')
+                set_training_status(True, full_name, int(progress), f'Menyimpan foto {idx}/{len(photos)}...',
+                                    throttle=True)
                 
             except Exception as e:
                 logger.warning(f"❌ Failed to save photo {idx}: {e}")
@@ -1766,36 +2004,16 @@ def save_face_training():
         
         logger.info(f"✅ SAVED {saved_count} photos for {full_name}")
         
-        # PASTI AUTO TRAINING - dengan loading status
-        train_success = False
-        train_error = ""
-        try:
-            set_training_status(True, full_name, 30, f'Memulai training model untuk {full_name}...')
-            logger.info(f"🚀 STARTING AUTO TRAINING for {full_name}...")
-            
-            train_success = train_model()  # train_model() akan update progress sendiri
-            
-            if train_success:
-                logger.info(f"✅ AUTO TRAINING SUCCESS: {full_name} dengan {saved_count} foto")
-            else:
-                logger.error(f"❌ AUTO TRAINING FAILED: {full_name}")
-                train_error = "Training model gagal"
-        except Exception as e:
-            logger.error(f"❌ AUTO TRAINING ERROR: {e}")
-            train_error = str(e)
-            set_training_status(False, full_name, 0, f'Training error: {str(e)}')
-        
-        # Response dengan status training
-        response_message = f'✅ {full_name} berhasil disimpan dengan {saved_count} foto!'
-        if train_success:
-            response_message += ' Model berhasil di-training dan siap untuk absensi!'
-        else:
-            response_message += f' ⚠️ Training gagal: {train_error}'
+        # AUTO TRAINING di background - progress via /api/training_status/<job_id>
+        set_training_status(True, full_name, 30, f'Training model untuk {full_name} dijadwalkan...')
+        logger.info(f"🚀 QUEUE AUTO TRAINING for {full_name}...")
+        job, _ = training_job_manager.submit(employee_name=full_name, reason='save_face_training')
         
         return jsonify({
             'status': 'success',
-            'message': response_message,
-            'trained': train_success,
+            'message': f'✅ {full_name} berhasil disimpan dengan {saved_count} foto! Training model berjalan di background.',
+            'training_job_id': job['id'],
+            'training_status_url': url_for('get_training_job_status', job_id=job['id']),
             'saved_photos': saved_count,
             'redirect': '/admin/employees'
         }), 201
@@ -1856,32 +2074,15 @@ def save_training_photos():
         
         logger.info(f"✅ SAVED {saved_count} photos for {full_name}")
         
-        # PASTI AUTO TRAINING - dengan detailed logging
-        train_success = False
-        train_error = ""
-        try:
-            logger.info(f"🚀 STARTING AUTO TRAINING for {full_name}...")
-            train_success = train_model()
-            if train_success:
-                logger.info(f"✅ AUTO TRAINING SUCCESS: {full_name} dengan {saved_count} foto")
-            else:
-                logger.error(f"❌ AUTO TRAINING FAILED: {full_name}")
-                train_error = "Training model gagal"
-        except Exception as e:
-            logger.error(f"❌ AUTO TRAINING ERROR: {e}")
-            train_error = str(e)
-        
-        # Response dengan status training
-        response_message = f'✅ {full_name} berhasil disimpan dengan {saved_count} foto!'
-        if train_success:
-            response_message += ' Model berhasil di-training dan siap untuk absensi!'
-        else:
-            response_message += f' ⚠️ Training gagal: {train_error}'
+        # AUTO TRAINING di background - progress via /api/training_status/<job_id>
+        logger.info(f"🚀 QUEUE AUTO TRAINING for {full_name}...")
+        job, _ = training_job_manager.submit(employee_name=full_name, reason='save_training_photos')
         
         return jsonify({
             'status': 'success',
-            'message': response_message,
-            'trained': train_success,
+            'message': f'✅ {full_name} berhasil disimpan dengan {saved_count} foto! Training model berjalan di background.',
+            'training_job_id': job['id'],
+            'training_status_url': url_for('get_training_job_status', job_id=job['id']),
             'saved_photos': saved_count
         }), 201
         
@@ -1919,7 +2120,7 @@ def admin_add_employee_with_face():
         
         if result['status'] == 'success':
             # Retrain model after adding new face
-            train_model()
+            training_job_manager.submit(employee_name=name, reason='add_employee_with_face')
             return jsonify({
                 'status': 'success', 
                 'message': f'Karyawan {name} berhasil ditambahkan dengan face recognition!'
@@ -1975,6 +2176,9 @@ def admin_clear_data():
     try:
         db = get_db_manager()
         result = db.execute_query("DELETE FROM attendance")
+        attendance_rollup.clear()
+        report_cache.clear()
+        event_bus.publish('attendance', {'action': 'cleared'})
         flash('Semua data absensi berhasil dihapus!', 'warning')
     except Exception as e:
         flash(f'Error clearing data: {str(e)}', 'error')
@@ -1983,6 +2187,7 @@ def admin_clear_data():
 
 @app.route('/admin/api/stats')
 @admin_required
+@cached_report(current_week_range)
 def admin_api_stats():
     """API untuk dashboard admin statistics"""
     try:
@@ -2021,6 +2226,7 @@ def admin_api_stats():
     except Exception as e:
         logger.error(f"Error getting admin stats: {e}")
         return jsonify({
+            'error': 'Failed to get statistics',
             'totalEmployees': 0,
             'todayAttendance': 0,
             'weeklyAverage': 0,
@@ -2031,6 +2237,12 @@ def admin_api_stats():
             'selected_camera': selected_camera_id
         })
 
+@app.route('/admin/api/cache_stats')
+@admin_required
+def admin_api_cache_stats():
+    """Statistik cache laporan (hits, misses, evictions, invalidations)"""
+    return jsonify(report_cache.get_stats())
+
 # ======================== ADDITIONAL ADMIN ROUTES ========================
 
 @app.route('/admin/add_employee_form')
@@ -2094,20 +2306,43 @@ def admin_reports():
                          date_range_week=date_range_week,
                          selected_camera=selected_camera_id)
 
+def month_range(month):
+    """Hari pertama dan terakhir bulan 'YYYY-MM'"""
+    first_day = datetime.strptime(month + '-01', '%Y-%m-%d').date()
+    next_month = (first_day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return first_day, next_month - timedelta(days=1)
+
+def get_bagian_summary(db, start_date, end_date):
+    """Ringkasan per bagian untuk periode laporan (dari rollup attendance_daily_bagian)"""
+    rows = db.execute_query("""
+        SELECT bagian,
+               SUM(hadir) as hari_hadir,
+               SUM(terlambat) as hari_terlambat,
+               SUM(tepat_waktu) as hari_tepat_waktu,
+               SUM(work_hours_total) as total_jam_kerja,
+               SUM(overtime_hours_total) as total_jam_lembur
+        FROM attendance_daily_bagian
+        WHERE tanggal BETWEEN %s AND %s
+        GROUP BY bagian
+        ORDER BY bagian
+    """, (start_date, end_date))
+    return list(rows) if rows else []
+
 @app.route('/admin/reports/daily')
 @admin_required
+@cached_report(lambda: (date.today(), date.today()))
 def admin_reports_daily():
     """Generate laporan absensi harian"""
     try:
         db = get_db_manager()
         today = datetime.now().strftime('%Y-%m-%d')
         
-        # Query untuk mendapatkan data absensi hari ini
+        # Query untuk mendapatkan data absensi hari ini (dari rollup harian)
         query = """
-        SELECT e.name, e.bagian, a.jam_masuk, a.jam_pulang, a.status,
-               TIMESTAMPDIFF(HOUR, a.jam_masuk, a.jam_pulang) as total_jam
+        SELECT e.name, e.bagian, r.jam_masuk, r.jam_pulang, r.status,
+               r.work_hours as total_jam
         FROM employees e
-        LEFT JOIN attendance a ON e.id = a.employee_id AND DATE(a.tanggal) = %s
+        LEFT JOIN attendance_daily_employee r ON r.employee_id = e.id AND r.tanggal = %s
         ORDER BY e.name
         """
         
@@ -2150,6 +2385,8 @@ def admin_reports_daily():
 
 @app.route('/admin/reports/weekly')
 @admin_required
+@cached_report(lambda: (date.today() - timedelta(days=date.today().weekday()),
+                        date.today() - timedelta(days=date.today().weekday()) + timedelta(days=6)))
 def admin_reports_weekly():
     """Generate laporan absensi mingguan"""
     try:
@@ -2163,21 +2400,22 @@ def admin_reports_weekly():
         start_date = start_week.strftime('%Y-%m-%d')
         end_date = end_week.strftime('%Y-%m-%d')
         
-        # Query untuk data mingguan
+        # Query untuk data mingguan (dari rollup harian)
         query = """
         SELECT e.name, e.bagian,
-               COUNT(a.id) as total_hari_kerja,
-               COUNT(CASE WHEN a.jam_masuk IS NOT NULL THEN 1 END) as hari_hadir,
-               COUNT(CASE WHEN a.status = 'Terlambat' THEN 1 END) as hari_terlambat,
-               AVG(TIMESTAMPDIFF(HOUR, a.jam_masuk, a.jam_pulang)) as rata_jam_kerja
+               COUNT(r.tanggal) as total_hari_kerja,
+               COALESCE(SUM(r.hadir), 0) as hari_hadir,
+               COALESCE(SUM(r.terlambat), 0) as hari_terlambat,
+               AVG(r.work_hours) as rata_jam_kerja
         FROM employees e
-        LEFT JOIN attendance a ON e.id = a.employee_id 
-                                AND DATE(a.tanggal) BETWEEN %s AND %s
+        LEFT JOIN attendance_daily_employee r ON r.employee_id = e.id
+                                AND r.tanggal BETWEEN %s AND %s
         GROUP BY e.id, e.name, e.bagian
         ORDER BY e.name
         """
         
         result = db.execute_query(query, (start_date, end_date))
+        summary_bagian = get_bagian_summary(db, start_date, end_date)
         
         # Handle case where result is None or empty
         if not result:
@@ -2198,7 +2436,8 @@ def admin_reports_weekly():
             'periode': f"{start_date} s/d {end_date}",
             'total_karyawan': total_karyawan,
             'rata_kehadiran': round(rata_kehadiran, 1),
-            'detail_karyawan': result
+            'detail_karyawan': result,
+            'summary_bagian': summary_bagian
         }
         
         return jsonify({
@@ -2214,6 +2453,7 @@ def admin_reports_weekly():
 
 @app.route('/admin/reports/monthly')
 @admin_required
+@cached_report(lambda: month_range(request.args.get('month', datetime.now().strftime('%Y-%m'))))
 def admin_reports_monthly():
     """Generate laporan absensi bulanan"""
     try:
@@ -2233,22 +2473,23 @@ def admin_reports_monthly():
         start_date = first_day.strftime('%Y-%m-%d')
         end_date = last_day.strftime('%Y-%m-%d')
         
-        # Query untuk data bulanan
+        # Query untuk data bulanan (dari rollup harian)
         query = """
         SELECT e.name, e.bagian,
-               COUNT(DISTINCT DATE(a.tanggal)) as total_hari_kerja,
-               COUNT(CASE WHEN a.jam_masuk IS NOT NULL THEN 1 END) as hari_hadir,
-               COUNT(CASE WHEN a.status = 'Terlambat' THEN 1 END) as hari_terlambat,
-               SUM(TIMESTAMPDIFF(HOUR, a.jam_masuk, a.jam_pulang)) as total_jam_kerja,
-               AVG(TIMESTAMPDIFF(HOUR, a.jam_masuk, a.jam_pulang)) as rata_jam_kerja
+               COUNT(r.tanggal) as total_hari_kerja,
+               COALESCE(SUM(r.hadir), 0) as hari_hadir,
+               COALESCE(SUM(r.terlambat), 0) as hari_terlambat,
+               SUM(r.work_hours) as total_jam_kerja,
+               AVG(r.work_hours) as rata_jam_kerja
         FROM employees e
-        LEFT JOIN attendance a ON e.id = a.employee_id 
-                                AND DATE(a.tanggal) BETWEEN %s AND %s
+        LEFT JOIN attendance_daily_employee r ON r.employee_id = e.id
+                                AND r.tanggal BETWEEN %s AND %s
         GROUP BY e.id, e.name, e.bagian
         ORDER BY e.name
         """
         
         result = db.execute_query(query, (start_date, end_date))
+        summary_bagian = get_bagian_summary(db, start_date, end_date)
         
         # Handle case where result is None or empty
         if not result:
@@ -2267,7 +2508,8 @@ def admin_reports_monthly():
             'bulan': month,
             'total_karyawan': total_karyawan,
             'total_hari_kerja': total_hari_kerja,
-            'detail_karyawan': result
+            'detail_karyawan': result,
+            'summary_bagian': summary_bagian
         }
         
         return jsonify({
@@ -2283,24 +2525,25 @@ def admin_reports_monthly():
 
 @app.route('/admin/reports/performance')
 @admin_required
+@cached_report(lambda: (date.today() - timedelta(days=30), date.today()))
 def admin_reports_performance():
     """Generate laporan kinerja karyawan"""
     try:
         db = get_db_manager()
         
-        # Query untuk analisis kinerja
+        # Query untuk analisis kinerja (dari rollup harian)
         query = """
         SELECT e.name, e.bagian,
-               COUNT(a.id) as total_absen,
-               COUNT(CASE WHEN a.jam_masuk IS NOT NULL THEN 1 END) as total_hadir,
-               COUNT(CASE WHEN a.status = 'Tepat Waktu' THEN 1 END) as tepat_waktu,
-               COUNT(CASE WHEN a.status = 'Terlambat' THEN 1 END) as terlambat,
-               AVG(TIMESTAMPDIFF(HOUR, a.jam_masuk, a.jam_pulang)) as rata_jam_kerja,
-               MIN(TIME(a.jam_masuk)) as jam_masuk_tercepat,
-               MAX(TIME(a.jam_pulang)) as jam_pulang_terlama
+               COUNT(r.tanggal) as total_absen,
+               COALESCE(SUM(r.hadir), 0) as total_hadir,
+               COALESCE(SUM(r.tepat_waktu), 0) as tepat_waktu,
+               COALESCE(SUM(r.terlambat), 0) as terlambat,
+               AVG(r.work_hours) as rata_jam_kerja,
+               MIN(r.jam_masuk) as jam_masuk_tercepat,
+               MAX(r.jam_pulang) as jam_pulang_terlama
         FROM employees e
-        LEFT JOIN attendance a ON e.id = a.employee_id 
-                                AND a.tanggal >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
+        LEFT JOIN attendance_daily_employee r ON r.employee_id = e.id
+                                AND r.tanggal >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
         GROUP BY e.id, e.name, e.bagian
         ORDER BY total_hadir DESC, tepat_waktu DESC
         """
@@ -2351,6 +2594,8 @@ def admin_reports_performance():
 
 @app.route('/admin/reports/overtime')
 @admin_required
+@cached_report(lambda: (request.args.get('start_date', (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')),
+                        request.args.get('end_date', datetime.now().strftime('%Y-%m-%d'))))
 def admin_reports_overtime():
     """Generate laporan lembur/overtime"""
     try:
@@ -2363,28 +2608,28 @@ def admin_reports_overtime():
         # Jam kerja normal (8 jam per hari)
         NORMAL_WORK_HOURS = 8
         
-        # Query untuk analisis lembur
+        # Query untuk analisis lembur (dari rollup harian, jam kerja sudah dihitung)
         query = """
         SELECT e.name, e.bagian,
-               DATE(a.tanggal) as tanggal,
-               a.jam_masuk, a.jam_pulang,
-               TIMESTAMPDIFF(HOUR, a.jam_masuk, a.jam_pulang) as total_jam,
+               r.tanggal,
+               r.jam_masuk, r.jam_pulang,
+               r.work_hours as total_jam,
                CASE 
-                   WHEN TIMESTAMPDIFF(HOUR, a.jam_masuk, a.jam_pulang) > %s 
-                   THEN TIMESTAMPDIFF(HOUR, a.jam_masuk, a.jam_pulang) - %s
+                   WHEN r.work_hours > %s 
+                   THEN r.work_hours - %s
                    ELSE 0
                END as jam_lembur,
                CASE 
-                   WHEN TIMESTAMPDIFF(HOUR, a.jam_masuk, a.jam_pulang) > %s 
+                   WHEN r.work_hours > %s 
                    THEN 'Lembur'
                    ELSE 'Normal'
                END as status_lembur
-        FROM employees e
-        JOIN attendance a ON e.id = a.employee_id 
-        WHERE DATE(a.tanggal) BETWEEN %s AND %s
-              AND a.jam_masuk IS NOT NULL 
-              AND a.jam_pulang IS NOT NULL
-        ORDER BY e.name, a.tanggal
+        FROM attendance_daily_employee r
+        JOIN employees e ON e.id = r.employee_id
+        WHERE r.tanggal BETWEEN %s AND %s
+              AND r.jam_masuk IS NOT NULL 
+              AND r.jam_pulang IS NOT NULL
+        ORDER BY e.name, r.tanggal
         """
         
         result = db.execute_query(query, (NORMAL_WORK_HOURS, NORMAL_WORK_HOURS, NORMAL_WORK_HOURS, start_date, end_date))
@@ -2463,210 +2708,96 @@ def admin_reports_overtime():
 @app.route('/admin/reports/export')
 @admin_required
 def admin_reports_export():
-    """Export laporan dalam berbagai format"""
+    """Export laporan dalam berbagai format (streaming; rentang besar bisa di-resume)"""
     try:
         report_type = request.args.get('type', 'daily')
         format_type = request.args.get('format', 'csv')
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
         
+        if format_type not in EXPORT_FORMATS:
+            return jsonify({'status': 'error', 'message': f'Unsupported format: {format_type}. Supported formats: {", ".join(EXPORT_FORMATS)}'}), 400
+        
+        try:
+            export = build_export_query(report_type, start_date, end_date)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        
+        extension, mimetype = EXPORT_FORMATS[format_type]
+        download_name = f"{export['filename']}.{extension}"
+        meta = {
+            'report_type': report_type,
+            'date_range': f"{export['start_date']} to {export['end_date']}" if export['start_date'] and export['end_date'] else 'N/A',
+            'generated_at': datetime.now().isoformat()
+        }
         db = get_db_manager()
         
-        # Query berdasarkan tipe laporan
-        if report_type == 'daily':
-            date_filter = start_date or datetime.now().strftime('%Y-%m-%d')
-            query = """
-            SELECT e.name as 'Nama Karyawan', e.bagian as 'Bagian', 
-                   a.waktu_masuk as 'Waktu Masuk', a.waktu_keluar as 'Waktu Keluar', 
-                   a.status as 'Status',
-                   TIMESTAMPDIFF(HOUR, a.waktu_masuk, a.waktu_keluar) as 'Total Jam'
-            FROM employees e
-            LEFT JOIN attendance a ON e.id = a.employee_id AND DATE(a.tanggal) = %s
-            ORDER BY e.name
-            """
-            params = (date_filter,)
-            filename = f"laporan_harian_{date_filter}"
-            
-        elif report_type == 'weekly':
-            if not start_date or not end_date:
-                # Default to current week
-                today = datetime.now()
-                start_week = today - timedelta(days=today.weekday())
-                end_week = start_week + timedelta(days=6)
-                start_date = start_week.strftime('%Y-%m-%d')
-                end_date = end_week.strftime('%Y-%m-%d')
-                
-            query = """
-            SELECT e.name as 'Nama Karyawan', e.bagian as 'Bagian',
-                   COUNT(a.id) as 'Total Hari Kerja',
-                   COUNT(CASE WHEN a.waktu_masuk IS NOT NULL THEN 1 END) as 'Hari Hadir',
-                   COUNT(CASE WHEN a.status = 'Terlambat' THEN 1 END) as 'Hari Terlambat',
-                   ROUND(AVG(TIMESTAMPDIFF(HOUR, a.waktu_masuk, a.waktu_keluar)), 2) as 'Rata-rata Jam Kerja'
-            FROM employees e
-            LEFT JOIN attendance a ON e.id = a.employee_id 
-                                    AND DATE(a.tanggal) BETWEEN %s AND %s
-            GROUP BY e.id, e.name, e.bagian
-            ORDER BY e.name
-            """
-            params = (start_date, end_date)
-            filename = f"laporan_mingguan_{start_date}_to_{end_date}"
-            
-        elif report_type == 'monthly':
-            if not start_date or not end_date:
-                # Default to current month
-                today = datetime.now()
-                first_day = today.replace(day=1)
-                if today.month == 12:
-                    last_day = today.replace(year=today.year + 1, month=1, day=1) - timedelta(days=1)
-                else:
-                    last_day = today.replace(month=today.month + 1, day=1) - timedelta(days=1)
-                start_date = first_day.strftime('%Y-%m-%d')
-                end_date = last_day.strftime('%Y-%m-%d')
-                
-            query = """
-            SELECT e.name as 'Nama Karyawan', e.bagian as 'Bagian',
-                   COUNT(DISTINCT DATE(a.tanggal)) as 'Total Hari Kerja',
-                   COUNT(CASE WHEN a.waktu_masuk IS NOT NULL THEN 1 END) as 'Hari Hadir',
-                   COUNT(CASE WHEN a.status = 'Terlambat' THEN 1 END) as 'Hari Terlambat',
-                   ROUND(SUM(TIMESTAMPDIFF(HOUR, a.waktu_masuk, a.waktu_keluar)), 2) as 'Total Jam Kerja',
-                   ROUND(AVG(TIMESTAMPDIFF(HOUR, a.waktu_masuk, a.waktu_keluar)), 2) as 'Rata-rata Jam Kerja'
-            FROM employees e
-            LEFT JOIN attendance a ON e.id = a.employee_id 
-                                    AND DATE(a.tanggal) BETWEEN %s AND %s
-            GROUP BY e.id, e.name, e.bagian
-            ORDER BY e.name
-            """
-            params = (start_date, end_date)
-            filename = f"laporan_bulanan_{start_date}_to_{end_date}"
+        def open_rows():
+            first, rows = peek_rows(db.stream_query(export['query'], export['params'], EXPORT_CONFIG['fetch_size']))
+            return (first, rows) if first else (None, None)
+        
+        def write_rows(path, rows, columns):
+            if format_type == 'excel':
+                write_xlsx(path, rows, columns)
+                return
+            if format_type == 'csv':
+                chunks = iter_csv(rows, columns)
+            elif format_type == 'json':
+                chunks = iter_json(rows, meta)
+            else:
+                chunks = iter_ndjson(rows)
+            with open(path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        
+        # Excel and big ranges are rendered to a cached file so Range requests can resume them
+        resumable = (format_type == 'excel' or export['days'] >= EXPORT_CONFIG['resumable_min_days']
+                     or request.args.get('resumable') == '1')
+        if resumable:
+            if format_type == 'excel':
+                try:
+                    import openpyxl  # noqa: F401
+                except ImportError:
+                    return jsonify({'status': 'error', 'message': 'Excel export requires openpyxl. Please install: pip install openpyxl'}), 500
             
-        elif report_type == 'performance':
-            if not start_date or not end_date:
-                # Default to last 30 days
-                end_date = datetime.now().strftime('%Y-%m-%d')
-                start_date = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
-                
-            query = """
-            SELECT e.name as 'Nama Karyawan', e.bagian as 'Bagian',
-                   COUNT(a.id) as 'Total Absen',
-                   COUNT(CASE WHEN a.waktu_masuk IS NOT NULL THEN 1 END) as 'Total Hadir',
-                   COUNT(CASE WHEN a.status = 'Tepat Waktu' THEN 1 END) as 'Tepat Waktu',
-                   COUNT(CASE WHEN a.status = 'Terlambat' THEN 1 END) as 'Terlambat',
-                   ROUND(AVG(TIMESTAMPDIFF(HOUR, a.waktu_masuk, a.waktu_keluar)), 2) as 'Rata-rata Jam Kerja',
-                   ROUND((COUNT(CASE WHEN a.waktu_masuk IS NOT NULL THEN 1 END) / 30.0) * 100, 1) as 'Persentase Kehadiran'
-            FROM employees e
-            LEFT JOIN attendance a ON e.id = a.employee_id 
-                                    AND DATE(a.tanggal) BETWEEN %s AND %s
-            GROUP BY e.id, e.name, e.bagian
-            ORDER BY e.name
-            """
-            params = (start_date, end_date)
-            filename = f"laporan_kinerja_{start_date}_to_{end_date}"
+            def render(tmp_path):
+                first, rows = open_rows()
+                if first is None:
+                    return False
+                write_rows(tmp_path, rows, list(first.keys()))
+                return True
             
-        else: # range type
-            if not start_date or not end_date:
-                return jsonify({'status': 'error', 'message': 'Start date and end date required'}), 400
-                
-            query = """
-            SELECT e.name as 'Nama Karyawan', e.bagian as 'Bagian', 
-                   DATE(a.tanggal) as 'Tanggal',
-                   a.waktu_masuk as 'Waktu Masuk', a.waktu_keluar as 'Waktu Keluar', 
-                   a.status as 'Status',
-                   TIMESTAMPDIFF(HOUR, a.waktu_masuk, a.waktu_keluar) as 'Total Jam'
-            FROM employees e
-            LEFT JOIN attendance a ON e.id = a.employee_id 
-                                    AND DATE(a.tanggal) BETWEEN %s AND %s
-            ORDER BY e.name, a.tanggal
-            """
-            params = (start_date, end_date)
-            filename = f"laporan_{start_date}_to_{end_date}"
-        
-        result = db.execute_query(query, params)
+            path = export_file_cache.get_or_render(
+                export_file_cache.path_for(report_type, format_type, export['params'], export_data_version(),
+                                           extension=extension),
+                render
+            )
+            if not path:
+                return jsonify({'status': 'error', 'message': 'No data found for the specified criteria'}), 404
+            return send_file(path, mimetype=mimetype, as_attachment=True, download_name=download_name,
+                             conditional=True)
         
-        if not result:
+        first, rows = open_rows()
+        if first is None:
             return jsonify({'status': 'error', 'message': 'No data found for the specified criteria'}), 404
         
         if format_type == 'csv':
-            import csv
-            from io import StringIO
-            
-            output = StringIO()
-            writer = csv.DictWriter(output, fieldnames=result[0].keys() if result else [])
-            writer.writeheader()
-            writer.writerows(result)
-            
-            response = make_response(output.getvalue())
-            response.headers['Content-Type'] = 'text/csv; charset=utf-8'
-            response.headers['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
-            return response
-            
+            chunks = iter_csv(rows, list(first.keys()))
         elif format_type == 'json':
-            response_data = {
-                'report_type': report_type,
-                'date_range': f"{start_date} to {end_date}" if start_date and end_date else 'N/A',
-                'generated_at': datetime.now().isoformat(),
-                'total_records': len(result),
-                'data': result
-            }
-            response = make_response(jsonify(response_data))
-            response.headers['Content-Type'] = 'application/json; charset=utf-8'
-            response.headers['Content-Disposition'] = f'attachment; filename="{filename}.json"'
-            return response
-            
-        elif format_type == 'excel':
-            try:
-                import pandas as pd
-                from io import BytesIO
-                
-                # Convert to DataFrame
-                df = pd.DataFrame(result)
-                
-                # Create Excel file in memory
-                output = BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    df.to_excel(writer, sheet_name='Laporan Absensi', index=False)
-                    
-                    # Get workbook and worksheet for formatting
-                    workbook = writer.book
-                    worksheet = writer.sheets['Laporan Absensi']
-                    
-                    # Auto-adjust column width
-                    for column in worksheet.columns:
-                        max_length = 0
-                        column_letter = column[0].column_letter
-                        for cell in column:
-                            try:
-                                if len(str(cell.value)) > max_length:
-                                    max_length = len(str(cell.value))
-                            except:
-                                pass
-                        adjusted_width = min(max_length + 2, 30)
-                        worksheet.column_dimensions[column_letter].width = adjusted_width
-                
-                output.seek(0)
-                
-                response = make_response(output.getvalue())
-                response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-                response.headers['Content-Disposition'] = f'attachment; filename="{filename}.xlsx"'
-                return response
-                
-            except ImportError:
-                return jsonify({'status': 'error', 'message': 'Excel export requires pandas and openpyxl. Please install: pip install pandas openpyxl'}), 500
-                
+            chunks = iter_json(rows, meta)
         else:
-            return jsonify({'status': 'error', 'message': f'Unsupported format: {format_type}. Supported formats: csv, json, excel'}), 400
-            
+            chunks = iter_ndjson(rows)
+        
+        response = Response(stream_with_context(chunks), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+        return response
+        
     except Exception as e:
         logger.error(f"Error exporting report: {str(e)}")
         return jsonify({
             'status': 'error',
             'message': f'Error exporting report: {str(e)}'
         }), 500
-            
-    except Exception as e:
-        return jsonify({
-            'status': 'error',
-            'message': f'Error exporting report: {str(e)}'
-        }), 500
 
 @app.route('/admin/camera')
 @admin_required
@@ -2683,7 +2814,10 @@ def admin_database():
     try:
         db = get_db_manager()
         # Test database connection
-        db_status = "Connected" if db.get_connection() else "Disconnected"
+        connection = db.get_connection()
+        db_status = "Connected" if connection else "Disconnected"
+        if connection:
+            connection.close()
         
         # Get table info
         tables_info = []
@@ -2716,37 +2850,56 @@ def admin_database_reset():
         logger.info("Admin initiated database reset")
         
         db = get_db_manager()
-        cursor = db.get_connection().cursor()
-        
-        # Disable foreign key checks temporarily
-        cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
-        
-        # Count records before deletion
-        cursor.execute("SELECT COUNT(*) as count FROM employees")
-        emp_count = cursor.fetchone()['count']
-        
-        cursor.execute("SELECT COUNT(*) as count FROM attendance")
-        att_count = cursor.fetchone()['count']
-        
-        cursor.execute("SELECT COUNT(*) as count FROM activity_log")
-        log_count = cursor.fetchone()['count']
-        
-        # Delete data in order (attendance first due to foreign keys)
-        cursor.execute("DELETE FROM attendance")
-        cursor.execute("DELETE FROM activity_log")
-        cursor.execute("DELETE FROM employees")
-        
-        # Reset auto increment counters
-        cursor.execute("ALTER TABLE employees AUTO_INCREMENT = 1")
-        cursor.execute("ALTER TABLE attendance AUTO_INCREMENT = 1")
-        cursor.execute("ALTER TABLE activity_log AUTO_INCREMENT = 1")
-        
-        # Re-enable foreign key checks
-        cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
-        
-        # Commit changes
-        db.get_connection().commit()
-        cursor.close()
+        connection = db.get_connection()
+        if not connection:
+            raise RuntimeError('Tidak dapat meminjam koneksi database')
+        # FOREIGN_KEY_CHECKS is session state: restored below, and the connection is discarded, not pooled
+        connection.mark_session_modified()
+        try:
+            cursor = connection.cursor()
+            
+            # Disable foreign key checks temporarily
+            cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
+            
+            # Count records before deletion
+            cursor.execute("SELECT COUNT(*) as count FROM employees")
+            emp_count = cursor.fetchone()['count']
+            
+            cursor.execute("SELECT COUNT(*) as count FROM attendance")
+            att_count = cursor.fetchone()['count']
+            
+            cursor.execute("SELECT COUNT(*) as count FROM activity_log")
+            log_count = cursor.fetchone()['count']
+            
+            # Delete data in order (attendance first due to foreign keys)
+            cursor.execute("DELETE FROM attendance")
+            cursor.execute("DELETE FROM attendance_daily_employee")
+            cursor.execute("DELETE FROM attendance_daily_bagian")
+            cursor.execute("DELETE FROM activity_log")
+            cursor.execute("DELETE FROM employees")
+            employee_directory.invalidate()
+            report_cache.clear()
+            bump_export_data_version()
+            event_bus.publish('attendance', {'action': 'cleared'})
+            
+            # Reset auto increment counters
+            cursor.execute("ALTER TABLE employees AUTO_INCREMENT = 1")
+            cursor.execute("ALTER TABLE attendance AUTO_INCREMENT = 1")
+            cursor.execute("ALTER TABLE activity_log AUTO_INCREMENT = 1")
+            
+            # Re-enable foreign key checks
+            cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
+            
+            # Commit changes
+            connection.commit()
+            cursor.close()
+        finally:
+            try:
+                with connection.cursor() as restore_cursor:
+                    restore_cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
+            except Exception:
+                pass
+            connection.close()
         
         # Delete face recognition model
         model_path = "static/face_recognition_model.pkl"
@@ -2784,7 +2937,8 @@ def admin_database_status():
     """Get database status for AJAX"""
     try:
         db = get_db_manager()
-        cursor = db.get_connection().cursor()
+        connection = db.get_connection()
+        cursor = connection.cursor()
         
         # Get current counts
         cursor.execute("SELECT COUNT(*) as count FROM employees")
@@ -2797,6 +2951,7 @@ def admin_database_status():
         log_count = cursor.fetchone()['count']
         
         cursor.close()
+        connection.close()
         
         return jsonify({
             'success': True,
@@ -3193,14 +3348,16 @@ def mark_attendance_mobile():
                         })
                     
                     # Check if face recognition model exists
-                    if 'face_recognition_model.pkl' not in os.listdir('static') and 'face_embeddings.pkl' not in os.listdir('static'):
+                    if not face_model_exists():
                         return jsonify({
                             'status': 'error',
                             'message': '❌ Karyawan Tidak Dikenal'
                         })
                     
-                    # Extract faces from the frame (for validation only)
-                    faces = extract_faces(frame)
+                    # Satu pass InsightFace di frame penuh: deteksi + identifikasi wajah terbesar
+                    # (detector me-resize sendiri ke det_size profil)
+                    logger.info(f"Mobile frame for InsightFace: shape={frame.shape}")
+                    faces = recognize_frame(frame, endpoint='mobile', max_faces=1)
                     
                     if len(faces) == 0:
                         return jsonify({
@@ -3208,16 +3365,8 @@ def mark_attendance_mobile():
                             'message': 'Wajah tidak terdeteksi. Pastikan pencahayaan cukup dan wajah terlihat jelas.'
                         })
                     
-                    # INSIGHTFACE: Kirim FULL FRAME, bukan crop!
-                    # InsightFace akan detect dan extract embedding sendiri
-                    # Resize frame ke ukuran yang cukup besar untuk detection
-                    frame_resized = cv2.resize(frame, (640, 480), interpolation=cv2.INTER_CUBIC)
-                    
-                    logger.info(f"Mobile frame for InsightFace: shape={frame_resized.shape}")
-                    
-                    # Identify the face with InsightFace (pass full frame)
-                    identified_users, confidence = identify_face_insightface_wrapper(frame_resized)
-                    user = identified_users[0]
+                    user = faces[0]['identity']
+                    confidence = faces[0]['confidence']
                     
                     if user == 'Unknown':
                         return jsonify({
@@ -3244,6 +3393,7 @@ def mark_attendance_mobile():
                             'status': 'success',
                             'message': f'✅ Absensi {mode} berhasil untuk {user}!',
                             'user': user,
+                            'confidence': round(confidence, 1),
                             'mode': mode,
                             'time': datetime.now().strftime('%H:%M:%S')
                         })
@@ -3251,7 +3401,8 @@ def mark_attendance_mobile():
                         return jsonify({
                             'status': 'warning',
                             'message': result.get('message', f'Absensi {mode} sudah tercatat hari ini untuk {user}'),
-                            'user': user
+                            'user': user,
+                            'confidence': round(confidence, 1)
                         })
                         
                 except Exception as img_error:
@@ -3291,40 +3442,38 @@ def run_attendance_ajax(mode='masuk', camera_id=None):
             
         logger.info(f"Starting non-GUI attendance for {mode} with camera {camera_id}")
         
-        cap = cv2.VideoCapture(camera_id)
-        if not cap.isOpened():
+        # Producer thread selalu menyimpan frame terbaru; loop ini jalan sesuai kecepatan inference
+        source = open_frame_source(camera_id)
+        if not source.start():
             logger.warning(f"Cannot open camera {camera_id}, trying default")
-            cap = cv2.VideoCapture(0)
-            if not cap.isOpened():
+            source = open_frame_source(0)
+            if not source.start():
                 return {'status': 'error', 'message': 'Kamera tidak tersedia'}
 
-        if 'face_recognition_model.pkl' not in os.listdir('static') and 'face_embeddings.pkl' not in os.listdir('static'):
-            cap.release()
+        if not face_model_exists():
+            source.stop()
             return {'status': 'error', 'message': '❌ Karyawan Tidak Dikenal'}
 
         recognition_success = False
         success_user = ""
         attempts = 0
-        max_attempts = 150  # 5 detik maksimal untuk AJAX
+        deadline = time.time() + 5  # 5 detik maksimal untuk AJAX
         
+        pipeline = create_frame_pipeline()
         logger.info(f"Starting face detection loop for {mode}")
         
-        while attempts < max_attempts:
-            ret, frame = cap.read()
-            if not ret:
+        while time.time() < deadline:
+            frame, frame_info = source.read(timeout=1.0)
+            if frame is None:
                 logger.warning(f"Cannot read frame at attempt {attempts}")
                 break
-                
-            faces = extract_faces(frame)
-            if len(faces) > 0:
-                logger.info(f"Face detected at attempt {attempts}")
-                (x, y, w, h) = faces[0]
-                face = cv2.resize(frame[y:y+h, x:x+w], (50, 50))
-                # Convert to grayscale for consistency
-                gray_face = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY) if len(face.shape) == 3 else face
-                identified_users, confidence = identify_face(gray_face.flatten())
-                user = identified_users[0]
-                
+            
+            # Recognition hanya jalan untuk track baru / kualitas wajah naik
+            for track in pipeline.process(frame):
+                if not track['recognized']:
+                    continue
+                user = track['identity']
+                confidence = track['confidence']
                 if user != 'Unknown':
                     # Update attendance
                     result = update_attendance(user, mode)
@@ -3334,10 +3483,13 @@ def run_attendance_ajax(mode='masuk', camera_id=None):
                     break
                 else:
                     logger.info(f"Face detected but not recognized (confidence: {confidence:.1f}%)")
-                
+            
+            if recognition_success:
+                break
             attempts += 1
         
-        cap.release()
+        source.stop()
+        logger.info(f"Frame pipeline stats: {pipeline.stats}, frame source: {source.get_stats()}")
         
         if recognition_success:
             return {
@@ -3364,8 +3516,9 @@ def run_attendance(mode='masuk'):
     import time
     time.sleep(0.5)  # Wait 500ms untuk cleanup
     
-    cap = cv2.VideoCapture(selected_camera_id)
-    if not cap.isOpened():
+    # Frame grabber di thread terpisah (hanya frame terbaru yang disimpan)
+    source = open_frame_source(selected_camera_id)
+    if not source.start():
         print(f"[ERROR] Kamera tidak dapat dibuka untuk mode {mode}")
         return render_template('home.html', mess="Kamera tidak tersedia.",
             names=[], rolls=[], tanggal=[], times=[], l=0,
@@ -3375,12 +3528,9 @@ def run_attendance(mode='masuk'):
 
     print(f"[DEBUG] Kamera berhasil dibuka untuk mode {mode}")
     
-    # Set buffer size untuk mengurangi latency
-    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-    
-    if 'face_recognition_model.pkl' not in os.listdir('static') and 'face_embeddings.pkl' not in os.listdir('static'):
+    if not face_model_exists():
         print(f"[ERROR] Model tidak ditemukan untuk mode {mode}")
-        cap.release()
+        source.stop()
         return render_template('home.html', mess="❌ Karyawan Tidak Dikenal",
             names=[], rolls=[], tanggal=[], times=[], l=0,
             totalreg=totalreg(), datetoday2=datetoday2,
@@ -3398,26 +3548,25 @@ def run_attendance(mode='masuk'):
     success_user = ""
     loading_counter = 0
     frame_count = 0
+    pipeline = create_frame_pipeline()
     
     while True:
         frame_count += 1
-        ret, frame = cap.read()
-        if not ret:
+        frame, frame_info = source.read(timeout=1.0)
+        if frame is None:
             print(f"[ERROR] Tidak dapat membaca frame {frame_count} untuk mode {mode}")
             break
             
         # Debug setiap 30 frame (sekitar 1 detik)
         if frame_count % 30 == 1:
-            print(f"[DEBUG] Frame {frame_count} - Mode {mode}")
+            print(f"[DEBUG] Frame {frame_count} - Mode {mode} - latency {frame_info['latency_ms']}ms")
             
-        faces = extract_faces(frame)
-        if len(faces) > 0:
-            (x, y, w, h) = faces[0]
-            face = cv2.resize(frame[y:y+h, x:x+w], (50, 50))
-            # Convert to grayscale for consistency
-            gray_face = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY) if len(face.shape) == 3 else face
-            identified_users, confidence = identify_face(gray_face.flatten())
-            user = identified_users[0]
+        # Detect setiap N frame + tracking; identitas dipakai ulang per track
+        track = pipeline.primary_track(pipeline.process(frame))
+        if track is not None:
+            (x, y, w, h) = track['box']
+            user = track['identity']
+            confidence = track['confidence']
             
             # Tampilkan recognition result dengan confidence
             cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
@@ -3467,8 +3616,9 @@ def run_attendance(mode='masuk'):
             print(f"[DEBUG] ESC ditekan, keluar dari mode {mode}")
             break
     
-    print(f"[DEBUG] Keluar dari loop kamera untuk mode {mode}, total frame: {frame_count}")
-    cap.release()
+    print(f"[DEBUG] Keluar dari loop kamera untuk mode {mode}, total frame: {frame_count}, pipeline: {pipeline.stats}")
+    source.stop()
+    print(f"[DEBUG] Frame source: {source.get_stats()}")
     cv2.destroyAllWindows()
     print(f"[DEBUG] Kamera dan window ditutup untuk mode {mode}")
     
@@ -3642,19 +3792,16 @@ def update_attendance(name, mode='masuk'):
             # Old format: name_bagian
             username = name.split('_')[0]
             userbagian = name.split('_')[1]
-            employee = Employee.get_employee_by_name_bagian(username, userbagian)
+            employee = (employee_directory.get_by_name_bagian(username, userbagian)
+                        or Employee.get_employee_by_name_bagian(username, userbagian))
         else:
             # New format: just name (from InsightFace)
             username = name
             userbagian = None
-            # Search by name only
-            employees = Employee.get_all_employees()
-            employee = None
-            for emp in employees:
-                if emp.get('name') == username:
-                    employee = emp
-                    userbagian = emp.get('bagian', 'Unknown')
-                    break
+            # Search by name only (directory index; DB only on a cache miss)
+            employee = employee_directory.get_by_name(username) or Employee.get_employee_by_name(username)
+            if employee:
+                userbagian = employee.get('bagian', 'Unknown')
         
         current_time = datetime.now().time()
         today = date.today()
@@ -3662,31 +3809,27 @@ def update_attendance(name, mode='masuk'):
         if not employee:
             # Jika employee belum ada, tambahkan dulu
             if Employee.add_employee(username, userbagian):
-                employee = Employee.get_employee_by_name_bagian(username, userbagian)
+                employee = employee_directory.get_by_name_bagian(username, userbagian)
             else:
                 logger.error(f"Gagal menambah employee: {username} ({userbagian})")
                 return {'success': False, 'message': 'Gagal menambah karyawan ke database'}
         
-        # Check if already attended today
-        existing_attendance = Attendance.get_attendance_by_employee_date(employee['id'], today)
-        
-        # Update attendance
+        # Atomic upsert - tidak perlu cek "sudah absen" terpisah
         if mode == 'masuk':
-            if existing_attendance and existing_attendance.get('jam_masuk'):
-                return {
-                    'success': False, 
-                    'message': f'Absensi masuk sudah tercatat hari ini pada {existing_attendance["jam_masuk"]}'
-                }
-            success = Attendance.add_or_update_attendance(employee['id'], today, jam_masuk=current_time)
+            status, row = Attendance.record_attendance(employee['id'], today, jam_masuk=current_time)
             activity_type = 'login'
+            already_recorded = row.get('jam_masuk') if row else None
         else:  # mode == 'keluar'
-            if existing_attendance and existing_attendance.get('jam_pulang'):
-                return {
-                    'success': False, 
-                    'message': f'Absensi keluar sudah tercatat hari ini pada {existing_attendance["jam_pulang"]}'
-                }
-            success = Attendance.add_or_update_attendance(employee['id'], today, jam_pulang=current_time)
+            status, row = Attendance.record_attendance(employee['id'], today, jam_pulang=current_time)
             activity_type = 'logout'
+            already_recorded = row.get('jam_pulang') if row else None
+        
+        if status == 'unchanged':
+            return {
+                'success': False, 
+                'message': f'Absensi {mode} sudah tercatat hari ini pada {already_recorded}'
+            }
+        success = status in ('inserted', 'updated')
         
         if success:
             # Log aktivitas
@@ -3704,6 +3847,7 @@ def update_attendance(name, mode='masuk'):
 
 @app.route('/get_attendance_data')
 @qr_verification_required
+@cached_report(current_week_range)
 def get_attendance_data():
     """AJAX endpoint untuk mendapatkan data absensi terbaru"""
     try:
@@ -3763,22 +3907,26 @@ def api_update_employee():
         
         db = get_db_manager()
         
-        # Get old employee data untuk rename folder
-        result = db.execute_query("SELECT * FROM karyawan WHERE id = %s", (employee_id,))
-        if not result or len(result) == 0:
+        # Get old employee data untuk rename folder (database, not the per-worker directory)
+        old_employee = Employee.get_employee_by_id(employee_id)
+        if not old_employee:
             return jsonify({'success': False, 'message': 'Karyawan tidak ditemukan'})
         
-        old_employee = result[0]
-        old_name = old_employee['nama']
+        old_name = old_employee['name']
         old_bagian = old_employee['bagian']
         
         # Update database
         update_query = """
-            UPDATE karyawan 
-            SET nama = %s, bagian = %s, nik = %s, email = %s, telepon = %s
+            UPDATE employees 
+            SET name = %s, bagian = %s, nik = %s, email = %s, phone = %s
             WHERE id = %s
         """
-        db.execute_query(update_query, (new_name, new_bagian, new_nik, new_email, new_telepon, employee_id))
+        db.execute_query(update_query, (new_name, new_bagian, new_nik or None, new_email or None,
+                                        new_telepon, employee_id))
+        employee_directory.invalidate()
+        report_cache.invalidate_employee(employee_id)
+        if old_bagian != new_bagian:
+            attendance_rollup.schedule_employee(employee_id)
         
         # Rename folder foto jika nama/bagian berubah
         if old_name != new_name or old_bagian != new_bagian:
@@ -3789,7 +3937,7 @@ def api_update_employee():
                 logger.info(f"Renamed folder: {old_folder} -> {new_folder}")
             
             # Train ulang model karena nama berubah
-            train_model()
+            training_job_manager.submit(employee_name=new_name, reason='update_employee')
         
         logger.info(f"Employee updated: ID {employee_id}, {old_name} -> {new_name}")
         return jsonify({
@@ -3814,19 +3962,22 @@ def api_delete_employee():
         db = get_db_manager()
         
         # Get employee data
-        result = db.execute_query("SELECT * FROM karyawan WHERE id = %s", (employee_id,))
-        if not result or len(result) == 0:
+        employee = Employee.get_employee_by_id(employee_id)
+        if not employee:
             return jsonify({'success': False, 'message': 'Karyawan tidak ditemukan'})
         
-        employee = result[0]
-        emp_name = employee['nama']
+        emp_name = employee['name']
         emp_bagian = employee['bagian']
         
         # Hapus data absensi terkait
-        db.execute_query("DELETE FROM absensi WHERE id_karyawan = %s", (employee_id,))
+        db.execute_query("DELETE FROM attendance WHERE employee_id = %s", (employee_id,))
+        db.execute_query("DELETE FROM activity_log WHERE employee_id = %s", (employee_id,))
         
         # Hapus karyawan
-        db.execute_query("DELETE FROM karyawan WHERE id = %s", (employee_id,))
+        db.execute_query("DELETE FROM employees WHERE id = %s", (employee_id,))
+        employee_directory.invalidate()
+        report_cache.invalidate_employee(employee_id)
+        attendance_rollup.schedule_employee(employee_id)
         
         # Hapus folder foto
         face_folder = f"static/faces/{emp_name}_{emp_bagian}"
@@ -3840,7 +3991,7 @@ def api_delete_employee():
             os.remove(photo_path)
         
         # Train ulang model
-        train_model()
+        training_job_manager.submit(reason='delete_employee')
         
         logger.info(f"Employee deleted: ID {employee_id}, {emp_name} ({emp_bagian})")
         return jsonify({
@@ -3856,23 +4007,21 @@ def api_delete_employee():
 def api_get_employee(employee_id):
     """API untuk mendapatkan detail karyawan berdasarkan ID"""
     try:
-        db = get_db_manager()
-        result = db.execute_query("SELECT * FROM karyawan WHERE id = %s", (employee_id,))
+        employee = Employee.get_employee_by_id(employee_id)
         
-        if not result or len(result) == 0:
+        if not employee:
             return jsonify({'success': False, 'message': 'Karyawan tidak ditemukan'})
         
-        employee = result[0]
         return jsonify({
             'success': True,
             'employee': {
                 'id': employee['id'],
-                'name': employee['nama'],
+                'name': employee['name'],
                 'bagian': employee['bagian'],
-                'nik': employee.get('nik', ''),
-                'email': employee.get('email', ''),
-                'telepon': employee.get('telepon', ''),
-                'tanggal_bergabung': str(employee.get('tanggal_bergabung', ''))
+                'nik': employee.get('nik') or '',
+                'email': employee.get('email') or '',
+                'telepon': employee.get('phone') or '',
+                'tanggal_bergabung': str(employee.get('hire_date') or '')
             }
         })
         
@@ -3898,6 +4047,9 @@ def delete_employee():
             db.execute_query("DELETE FROM attendance WHERE employee_id = %s", (employee['id'],))
             db.execute_query("DELETE FROM activity_log WHERE employee_id = %s", (employee['id'],))
             db.execute_query("DELETE FROM employees WHERE id = %s", (employee['id'],))
+            employee_directory.invalidate()
+            report_cache.invalidate_employee(employee['id'])
+            attendance_rollup.schedule_employee(employee['id'])
             
             # Hapus folder foto
             face_folder = f"static/faces/{employee_name}_{employee_bagian}"
@@ -3905,7 +4057,7 @@ def delete_employee():
                 shutil.rmtree(face_folder)
             
             # Train ulang model
-            train_model()
+            training_job_manager.submit(reason='delete_employee')
             
             logger.info(f"Employee {employee_name} ({employee_bagian}) deleted successfully")
             return jsonify({'status': 'success', 'message': f'Karyawan {employee_name} berhasil dihapus'})
@@ -3951,6 +4103,9 @@ def delete_attendance():
                 logger.info(f"Delete result: {result}")
                 
                 if result > 0:
+                    report_cache.invalidate_attendance(employee['id'], [tanggal_obj])
+                    attendance_rollup.schedule_day(employee['id'], tanggal_obj, employee['bagian'])
+                    Attendance.publish_change('deleted', employee['id'], tanggal_obj)
                     logger.info(f"Attendance deleted for {employee_name} on {tanggal}")
                     return jsonify({'status': 'success', 'message': 'Data absensi berhasil dihapus'})
                 else:
@@ -4103,7 +4258,7 @@ def add():
         logger.error(f"Gagal menambah employee {newusername} ({newbagian}) ke database")
     
     print(f"[DEBUG] Successfully captured {i} images for {newusername}_{newbagian}")
-    train_model()
+    training_job_manager.submit(employee_name=newusername, reason='add')
     return home()
 
 # =======================
@@ -4129,6 +4284,120 @@ def api_get_attendance_data():
             'status': 'error',
             'message': 'Gagal mengambil data absensi'
         }), 500
+
+def batch_image_sources():
+    """
+    Gambar untuk /api/recognize/batch tanpa di-decode dulu: upload multipart
+    'images' atau JSON {"images": [base64 / data URL, ...]}
+    
+    Returns:
+        List (label, FileStorage atau string base64)
+    """
+    sources = [(upload.filename, upload) for upload in request.files.getlist('images')]
+    payload = request.get_json(silent=True) or {}
+    encoded = payload.get('images') if isinstance(payload, dict) else None
+    if isinstance(encoded, list):
+        sources.extend((f'image_{idx}', image_data) for idx, image_data in enumerate(encoded))
+    return sources
+
+def decode_batch_image(source, max_pixels):
+    """
+    Decode satu gambar batch; ukuran dicek dari header sebelum decode penuh
+    
+    Returns:
+        Tuple (frame BGR atau None, pesan error atau None)
+    """
+    try:
+        if isinstance(source, str):
+            data = base64.b64decode(source.split(',', 1)[1] if ',' in source else source)
+        else:
+            data = source.read()
+        if not data:
+            return None, 'Gambar kosong'
+        width, height = Image.open(BytesIO(data)).size
+    except Exception:
+        return None, 'Gambar tidak bisa di-decode'
+    if width * height > max_pixels:
+        return None, f'Gambar terlalu besar ({width}x{height}, maks {max_pixels} piksel)'
+    frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    return frame, None if frame is not None else 'Gambar tidak bisa di-decode'
+
+@app.route('/api/recognize/batch', methods=['POST'])
+def api_recognize_batch():
+    """
+    Identifikasi semua wajah di banyak gambar sekaligus (rombongan di pintu
+    masuk, backfill dari still CCTV). Tidak mencatat absensi.
+    
+    Input: multipart 'images' (file) atau JSON {"images": [base64, ...]};
+    opsional max_faces per gambar (query/form/JSON).
+    Output per gambar: daftar wajah dengan identity, score, confidence, box.
+    Hanya untuk admin atau sesi QR yang masih berlaku (tanpa bypass referrer).
+    """
+    if not session.get('admin_logged_in') and not has_valid_qr_session():
+        return jsonify({'status': 'error', 'message': 'Login admin atau QR verification diperlukan'}), 403
+    if not USE_INSIGHTFACE:
+        return jsonify({'status': 'error', 'message': 'InsightFace tidak tersedia'}), 503
+    
+    max_bytes = FACE_CONFIG['recognize_batch_max_mb'] * 1024 * 1024
+    if request.content_length is None or request.content_length > max_bytes:
+        return jsonify({'status': 'error',
+                        'message': f"Request maksimal {FACE_CONFIG['recognize_batch_max_mb']} MB (dengan Content-Length)"}), 413
+    
+    try:
+        # Count before reading or decoding any image
+        sources = batch_image_sources()
+        if not sources:
+            return jsonify({'status': 'error', 'message': 'Tidak ada gambar'}), 400
+        max_images = FACE_CONFIG['recognize_batch_max_images']
+        if len(sources) > max_images:
+            return jsonify({'status': 'error', 'message': f'Maksimal {max_images} gambar per request'}), 413
+        
+        images = []
+        for label, source in sources:
+            frame, error = decode_batch_image(source, FACE_CONFIG['recognize_batch_max_pixels'])
+            images.append((label, frame, error))
+        
+        payload = request.get_json(silent=True) or {}
+        max_faces = request.values.get('max_faces', payload.get('max_faces'))
+        try:
+            max_faces = int(max_faces) if max_faces else None
+        except (TypeError, ValueError):
+            return jsonify({'status': 'error', 'message': 'max_faces harus angka'}), 400
+        
+        start = time.time()
+        batches = recognize_frames([frame for _, frame, _ in images], endpoint='batch', max_faces=max_faces)
+        elapsed_ms = (time.time() - start) * 1000
+        
+        results = []
+        for (label, frame, error), faces in zip(images, batches):
+            result = {
+                'name': label,
+                'faces': [{
+                    'identity': face['identity'],
+                    'score': round(face['confidence'] / 100, 4),
+                    'confidence': round(face['confidence'], 1),
+                    'box': [int(v) for v in face['box']]
+                } for face in faces]
+            }
+            if error:
+                result['error'] = error
+            results.append(result)
+        
+        total_faces = sum(len(result['faces']) for result in results)
+        recognized = sum(face['identity'] != 'Unknown' for result in results for face in result['faces'])
+        logger.info(f"Batch recognition: {len(images)} gambar, {total_faces} wajah, "
+                    f"{recognized} dikenali ({elapsed_ms:.0f} ms)")
+        return jsonify({
+            'status': 'success',
+            'images': results,
+            'total_faces': total_faces,
+            'recognized': recognized,
+            'elapsed_ms': round(elapsed_ms, 1)
+        })
+    except Exception as e:
+        logger.error(f"Error in api_recognize_batch: {e}")
+        return jsonify({'status': 'error', 'message': 'Gagal memproses gambar'}), 500
+
 @app.route('/api/cameras')
 def api_get_cameras():
     """API endpoint untuk mendapatkan daftar kamera yang tersedia"""
@@ -4236,7 +4505,9 @@ def health_check():
     """Health check endpoint for monitoring"""
     try:
         # Check database connection
-        db_manager.get_connection()
+        connection = db_manager.get_connection()
+        if connection:
+            connection.close()
         
         # Check if model exists
         model_exists = os.path.exists('./static/face_recognition_model.pkl')
@@ -4244,7 +4515,15 @@ def health_check():
         return jsonify({
             'status': 'healthy',
             'timestamp': datetime.now().isoformat(),
-            'database': 'connected',
+            'database': 'connected' if connection else 'disconnected',
+            'db_pool': db_manager.get_pool_metrics(),
+            'activity_log': activity_log_writer.get_stats(),
+            'attendance_rollup': attendance_rollup.get_stats(),
+            'report_cache': report_cache.get_stats(),
+            'events': event_bus.get_stats(),
+            'qr_sessions': qr_sync_manager.get_stats(),
+            'state_backend': state_backend.get_stats(),
+            'readiness': model_warmup.get_status(),
             'model': 'available' if model_exists else 'missing',
             'version': '2.0'
         })
@@ -4255,7 +4534,65 @@ def health_check():
             'error': str(e)
         }), 500
 
+@app.route('/health/ready')
+def readiness_check():
+    """Readiness untuk load balancer: 200 hanya jika model wajah sudah siap (warm)"""
+    status = model_warmup.get_status()
+    return jsonify(status), 200 if status['state'] == 'ready' else 503
+
+def has_live_feed_access():
+    """Akses topic attendance/training: admin, localhost, atau QR verification yang masih berlaku"""
+    if session.get('admin_logged_in'):
+        return True
+    if request.referrer and 'localhost' in request.referrer and '/localhost' in request.referrer:
+        return True
+    return has_valid_qr_session()
+
+def has_valid_qr_session():
+    """QR verification di session ini masih dalam QR_VALIDITY_MINUTES"""
+    if not session.get('qr_verified'):
+        return False
+    verification_time_str = session.get('qr_verified_time')
+    if verification_time_str:
+        time_diff = (datetime.now() - datetime.fromisoformat(verification_time_str)).total_seconds()
+        return time_diff <= QR_VALIDITY_MINUTES * 60
+    return True
+
+@app.route('/api/events')
+def api_events():
+    """
+    Live feed Server-Sent Events
+    
+    Query param topics (comma separated): attendance, qr, training.
+    Topic 'qr' terbuka untuk halaman QR laptop; topic lain butuh akses
+    seperti /get_attendance_data.
+    """
+    requested = {topic.strip() for topic in request.args.get('topics', 'attendance').split(',') if topic.strip()}
+    public_topics = {'qr'}
+    if not requested <= public_topics and not has_live_feed_access():
+        return jsonify({'status': 'error', 'message': 'QR verification required'}), 403
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    
+    subscription, replay = event_bus.subscribe(requested, last_event_id)
+    if subscription is None:
+        return jsonify({'status': 'error', 'message': 'Terlalu banyak koneksi live feed'}), 503
+    
+    response = Response(sse_stream(subscription, replay, keepalive=EVENT_BUS_CONFIG['keepalive'],
+                                   max_duration=EVENT_BUS_CONFIG['max_stream_seconds']),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Disable proxy buffering (nginx / tunnels)
+    # Also release the subscription if the client leaves before the stream starts
+    response.call_on_close(subscription.close)
+    return response
+
 @app.route('/api/stats')
+@cached_report(current_week_range)
 def get_stats():
     """Get system statistics"""
     try:
@@ -4329,6 +4666,19 @@ def signal_handler(sig, frame):
     """Handle Ctrl+C gracefully"""
     print('\n🛑 Shutting down Kafebasabasi system...')
     
+    # Stop background training queue
+    try:
+        training_job_manager.shutdown(wait=False)
+    except:
+        pass
+    
+    # Flush buffered activity logs before the pool closes
+    try:
+        activity_log_writer.shutdown()
+        print('✅ Activity log flushed')
+    except:
+        pass
+    
     # Close database connection
     try:
         db_manager.close_connection()
@@ -4447,4 +4797,5 @@ if __name__ == '__main__':
         logger.error(f"Application error: {e}")
     finally:
         # Final cleanup
+        activity_log_writer.shutdown()
         db_manager.close_connection()
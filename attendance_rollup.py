@@ -0,0 +1,270 @@
+"""
+Attendance Rollup - Ringkasan absensi harian untuk laporan
+
+Dua tabel ringkasan yang dijaga dari tabel attendance:
+- attendance_daily_employee  satu baris per karyawan per hari (hadir,
+                             terlambat, jam kerja sudah dihitung)
+- attendance_daily_bagian    satu baris per bagian per hari
+
+Setiap write absensi menjadwalkan refresh baris (karyawan, tanggal) dan
+(bagian, tanggal) yang bersangkutan di thread background (refresh yang
+sama digabung). rebuild_range() membangun ulang rentang tanggal tertentu.
+Backfill awal (schedule_backfill) juga berjalan di thread tersebut, dengan
+MySQL GET_LOCK supaya hanya satu worker yang mengisinya.
+Endpoint laporan membaca tabel ini dengan filter tanggal yang sargable,
+sehingga biayanya tergantung panjang periode, bukan panjang histori.
+"""
+
+import threading
+import logging
+from typing import List, Optional, Tuple
+
+from database import get_db_manager
+
+logger = logging.getLogger(__name__)
+
+# Sama dengan ekspresi yang dulu dihitung ulang di setiap laporan
+_EMPLOYEE_ROLLUP_INSERT = """
+INSERT INTO attendance_daily_employee
+    (employee_id, tanggal, bagian, status, jam_masuk, jam_pulang,
+     hadir, terlambat, tepat_waktu, work_hours, work_seconds)
+SELECT a.employee_id, a.tanggal, e.bagian, a.status, a.jam_masuk, a.jam_pulang,
+       a.jam_masuk IS NOT NULL,
+       a.status = 'Terlambat',
+       a.status = 'Tepat Waktu',
+       TIMESTAMPDIFF(HOUR, a.jam_masuk, a.jam_pulang),
+       TIME_TO_SEC(TIMEDIFF(a.jam_pulang, a.jam_masuk))
+FROM attendance a
+JOIN employees e ON e.id = a.employee_id
+WHERE {where}
+"""
+
+_BAGIAN_ROLLUP_INSERT = """
+INSERT INTO attendance_daily_bagian
+    (tanggal, bagian, total_records, hadir, terlambat, tepat_waktu,
+     work_days, work_hours_total, overtime_hours_total)
+SELECT tanggal, bagian, COUNT(*), SUM(hadir), SUM(terlambat), SUM(tepat_waktu),
+       COUNT(work_hours), COALESCE(SUM(work_hours), 0),
+       COALESCE(SUM(GREATEST(work_hours - %s, 0)), 0)
+FROM attendance_daily_employee
+WHERE {where}
+GROUP BY tanggal, bagian
+"""
+
+NORMAL_WORK_HOURS = 8
+
+# MySQL named lock: one gunicorn worker backfills, the others skip
+BACKFILL_LOCK_NAME = 'attendance_rollup_backfill'
+
+
+class AttendanceRollup:
+    """Pemeliharaan tabel rollup; refresh per write berjalan di satu worker thread"""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending = []  # Ordered unique refresh keys
+        self.pending_keys = set()
+        self.thread = None
+        self.active = False
+        self.listeners = []  # fn(employee_id, dates) after a refresh; dates None = everything
+        self.stats = {'scheduled': 0, 'coalesced': 0, 'refreshed': 0, 'rebuilds': 0, 'errors': 0}
+
+    # ------------------------------------------------------------------ writes
+
+    def add_listener(self, listener):
+        """Daftarkan callback yang dipanggil setelah rollup berubah (mis. invalidasi cache laporan)"""
+        self.listeners.append(listener)
+
+    def _notify(self, employee_id, dates):
+        for listener in self.listeners:
+            try:
+                listener(employee_id, dates)
+            except Exception as e:
+                logger.error(f"Attendance rollup listener gagal: {e}")
+
+    def _run_statements(self, statements: List[Tuple[str, tuple]]) -> bool:
+        ok = get_db_manager().execute_transaction(statements)
+        if not ok:
+            with self.condition:
+                self.stats['errors'] += 1
+        return ok
+
+    def refresh_day(self, employee_id, tanggal, bagian: Optional[str] = None) -> bool:
+        """Hitung ulang baris (karyawan, tanggal) dan (bagian, tanggal) secara sinkron"""
+        if bagian is None:
+            rows = get_db_manager().execute_query("SELECT bagian FROM employees WHERE id = %s", (employee_id,))
+            bagian = rows[0]['bagian'] if rows else None
+
+        statements = [
+            ("DELETE FROM attendance_daily_employee WHERE employee_id = %s AND tanggal = %s", (employee_id, tanggal)),
+            (_EMPLOYEE_ROLLUP_INSERT.format(where="a.employee_id = %s AND a.tanggal = %s"), (employee_id, tanggal)),
+        ]
+        if bagian is not None:
+            statements += [
+                ("DELETE FROM attendance_daily_bagian WHERE tanggal = %s AND bagian = %s", (tanggal, bagian)),
+                (_BAGIAN_ROLLUP_INSERT.format(where="tanggal = %s AND bagian = %s"),
+                 (NORMAL_WORK_HOURS, tanggal, bagian)),
+            ]
+        ok = self._run_statements(statements)
+        if ok:
+            with self.condition:
+                self.stats['refreshed'] += 1
+            self._notify(employee_id, [tanggal])
+        return ok
+
+    def refresh_employee(self, employee_id) -> bool:
+        """Hitung ulang semua hari seorang karyawan (setelah bagian berubah atau karyawan dihapus)"""
+        db = get_db_manager()
+        rows = db.execute_query(
+            """SELECT tanggal FROM attendance_daily_employee WHERE employee_id = %s
+               UNION SELECT tanggal FROM attendance WHERE employee_id = %s""",
+            (employee_id, employee_id)
+        )
+        dates = sorted({row['tanggal'] for row in rows or []})
+        if not dates:
+            return True
+
+        statements = [
+            ("DELETE FROM attendance_daily_employee WHERE employee_id = %s", (employee_id,)),
+            (_EMPLOYEE_ROLLUP_INSERT.format(where="a.employee_id = %s"), (employee_id,)),
+        ]
+        for start in range(0, len(dates), 500):
+            chunk = tuple(dates[start:start + 500])
+            placeholders = ", ".join(["%s"] * len(chunk))
+            statements += [
+                (f"DELETE FROM attendance_daily_bagian WHERE tanggal IN ({placeholders})", chunk),
+                (_BAGIAN_ROLLUP_INSERT.format(where=f"tanggal IN ({placeholders})"),
+                 (NORMAL_WORK_HOURS,) + chunk),
+            ]
+        ok = self._run_statements(statements)
+        if ok:
+            self._notify(employee_id, dates)
+        return ok
+
+    def rebuild_range(self, start_date, end_date) -> bool:
+        """Bangun ulang kedua tabel rollup untuk rentang tanggal (inklusif)"""
+        logger.info(f"Rebuilding attendance rollups {start_date} s/d {end_date}")
+        ok = self._run_statements([
+            ("DELETE FROM attendance_daily_employee WHERE tanggal BETWEEN %s AND %s", (start_date, end_date)),
+            (_EMPLOYEE_ROLLUP_INSERT.format(where="a.tanggal BETWEEN %s AND %s"), (start_date, end_date)),
+            ("DELETE FROM attendance_daily_bagian WHERE tanggal BETWEEN %s AND %s", (start_date, end_date)),
+            (_BAGIAN_ROLLUP_INSERT.format(where="tanggal BETWEEN %s AND %s"),
+             (NORMAL_WORK_HOURS, start_date, end_date)),
+        ])
+        if ok:
+            with self.condition:
+                self.stats['rebuilds'] += 1
+            self._notify(None, None)
+        return ok
+
+    def clear(self) -> bool:
+        """Kosongkan rollup (setelah reset data absensi)"""
+        ok = self._run_statements([
+            ("DELETE FROM attendance_daily_employee", ()),
+            ("DELETE FROM attendance_daily_bagian", ()),
+        ])
+        if ok:
+            self._notify(None, None)
+        return ok
+
+    def ensure_backfilled(self) -> bool:
+        """
+        Isi rollup dari seluruh histori jika masih kosong (instalasi lama)
+
+        Dijalankan di bawah MySQL GET_LOCK: jika worker lain sedang mengisi,
+        worker ini melewatkannya.
+        """
+        db = get_db_manager()
+        if db.execute_query("SELECT 1 AS x FROM attendance_daily_employee LIMIT 1"):
+            return True
+
+        connection = db.get_connection()
+        if not connection:
+            return False
+        # Named locks belong to the session: never hand this connection back to the pool
+        connection.mark_session_modified()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT GET_LOCK(%s, 0) AS acquired", (BACKFILL_LOCK_NAME,))
+                row = cursor.fetchone()
+            if not row or not row['acquired']:
+                logger.info("Attendance rollup backfill berjalan di worker lain - dilewati")
+                return True
+            try:
+                # Re-check under the lock: another worker may have just finished
+                if db.execute_query("SELECT 1 AS x FROM attendance_daily_employee LIMIT 1"):
+                    return True
+                bounds = db.execute_query("SELECT MIN(tanggal) AS start_date, MAX(tanggal) AS end_date FROM attendance")
+                if not bounds or bounds[0]['start_date'] is None:
+                    return True
+                return self.rebuild_range(bounds[0]['start_date'], bounds[0]['end_date'])
+            finally:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT RELEASE_LOCK(%s)", (BACKFILL_LOCK_NAME,))
+        finally:
+            connection.close()
+
+    # ------------------------------------------------------------ background
+
+    def schedule_day(self, employee_id, tanggal, bagian: Optional[str] = None):
+        """Jadwalkan refresh_day di worker (tidak menambah latency write absensi)"""
+        self._schedule(('day', employee_id, tanggal, bagian))
+
+    def schedule_employee(self, employee_id):
+        """Jadwalkan refresh_employee di worker"""
+        self._schedule(('employee', employee_id))
+
+    def schedule_backfill(self):
+        """Jadwalkan ensure_backfilled di worker (tidak menahan startup)"""
+        self._schedule(('backfill',))
+
+    def _schedule(self, key):
+        with self.condition:
+            self.stats['scheduled'] += 1
+            if key in self.pending_keys:
+                self.stats['coalesced'] += 1
+                return
+            self.pending.append(key)
+            self.pending_keys.add(key)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._worker, name='attendance-rollup', daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                key = self.pending.pop(0)
+                self.pending_keys.discard(key)
+                self.active = True
+            try:
+                if key[0] == 'day':
+                    self.refresh_day(*key[1:])
+                elif key[0] == 'backfill':
+                    self.ensure_backfilled()
+                else:
+                    self.refresh_employee(key[1])
+            except Exception as e:
+                logger.error(f"Attendance rollup refresh {key} gagal: {e}")
+                with self.condition:
+                    self.stats['errors'] += 1
+            with self.condition:
+                self.active = False
+                self.condition.notify_all()
+
+    def wait_idle(self, timeout: float = 5.0) -> bool:
+        """Tunggu sampai semua refresh terjadwal selesai"""
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending and not self.active, timeout)
+
+    def get_stats(self):
+        with self.condition:
+            stats = dict(self.stats)
+            stats['pending'] = len(self.pending)
+        return stats
+
+
+# Instance global rollup manager
+attendance_rollup = AttendanceRollup()
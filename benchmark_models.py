@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Benchmark profil model face recognition (MODEL_PROFILES) pada set gambar lokal
+
+Set gambar memakai layout yang sama dengan foto training:
+    <images_dir>/<nama>/<foto>.jpg
+
+Untuk setiap profil dilaporkan latency per gambar (deteksi + embedding),
+detection rate, dan akurasi top-1 leave-one-out: setiap embedding dicocokkan
+dengan embedding gambar lain, benar jika tetangga terdekatnya orang yang sama.
+
+Contoh:
+    python benchmark_models.py --images static/faces --profiles accurate,fast
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from config import FACE_CONFIG, MODEL_PROFILES
+from face_recognition_insightface import extract_face_embedding, get_insightface_app
+
+
+def load_image_set(images_dir, max_per_person=None):
+    """[(nama, path)] dari <images_dir>/<nama>/*"""
+    samples = []
+    for person in sorted(os.listdir(images_dir)):
+        person_dir = os.path.join(images_dir, person)
+        if not os.path.isdir(person_dir):
+            continue
+        files = sorted(f for f in os.listdir(person_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+        for name in files[:max_per_person]:
+            samples.append((person, os.path.join(person_dir, name)))
+    return samples
+
+
+def leave_one_out_accuracy(labels, embeddings):
+    """Top-1 accuracy: tetangga terdekat (selain dirinya) harus orang yang sama"""
+    if len(embeddings) < 2:
+        return None
+    matrix = np.stack(embeddings)
+    similarity = matrix @ matrix.T
+    np.fill_diagonal(similarity, -np.inf)
+    nearest = similarity.argmax(axis=1)
+    correct = sum(labels[i] == labels[j] for i, j in enumerate(nearest))
+    return correct / len(labels)
+
+
+def benchmark_profile(profile, images, warmup=2, repeat=1):
+    # No fallback: a profile that cannot be built must not report the 'fast' numbers
+    app = get_insightface_app(profile, fallback=False)
+    if app is None:
+        return {'profile': profile, 'error': 'model tidak bisa dimuat'}
+
+    for _, image in images[:warmup]:
+        extract_face_embedding(image, profile)
+
+    latencies = []
+    labels = []
+    embeddings = []
+    for person, image in images:
+        embedding = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            embedding = extract_face_embedding(image, profile)
+            latencies.append((time.perf_counter() - start) * 1000)
+        if embedding is not None:
+            labels.append(person)
+            embeddings.append(embedding)
+
+    latencies = np.array(latencies)
+    return {
+        'profile': profile,
+        'mean_ms': float(latencies.mean()),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'detection_rate': len(embeddings) / len(images),
+        'accuracy': leave_one_out_accuracy(labels, embeddings)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark latency dan akurasi profil model wajah')
+    parser.add_argument('--images', default=FACE_CONFIG['faces_dir'], help='Folder <nama>/<foto> (default: foto training)')
+    parser.add_argument('--profiles', default=','.join(MODEL_PROFILES), help='Profil dipisah koma')
+    parser.add_argument('--max-per-person', type=int, default=None, help='Batasi jumlah foto per orang')
+    parser.add_argument('--warmup', type=int, default=2, help='Gambar untuk warm-up (tidak diukur)')
+    parser.add_argument('--repeat', type=int, default=1, help='Ulangi setiap gambar N kali')
+    args = parser.parse_args()
+
+    profiles = [name.strip() for name in args.profiles.split(',') if name.strip()]
+    unknown = [name for name in profiles if name not in MODEL_PROFILES]
+    if unknown:
+        print(f"❌ Profil tidak dikenal: {', '.join(unknown)} (tersedia: {', '.join(MODEL_PROFILES)})")
+        return 1
+
+    if not os.path.isdir(args.images):
+        print(f"❌ Folder gambar tidak ditemukan: {args.images}")
+        return 1
+    samples = load_image_set(args.images, args.max_per_person)
+    images = [(person, cv2.imread(path)) for person, path in samples]
+    images = [(person, image) for person, image in images if image is not None]
+    if not images:
+        print(f"❌ Tidak ada gambar di {args.images}")
+        return 1
+    print(f"📷 {len(images)} gambar dari {len({person for person, _ in images})} orang")
+
+    print(f"\n{'profil':<10} {'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8} {'deteksi':>8} {'akurasi':>8}")
+    for profile in profiles:
+        result = benchmark_profile(profile, images, args.warmup, args.repeat)
+        if 'error' in result:
+            print(f"{profile:<10} {result['error']}")
+            continue
+        accuracy = f"{result['accuracy'] * 100:.1f}%" if result['accuracy'] is not None else '-'
+        print(f"{profile:<10} {result['mean_ms']:>8.1f} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} "
+              f"{result['detection_rate'] * 100:>7.1f}% {accuracy:>8}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
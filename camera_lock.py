@@ -5,21 +5,30 @@ Prevents multiple devices from accessing camera simultaneously
 
 import threading
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
+
+from state_backend import state_backend
 
 class CameraLockManager:
     """
     Manages camera access locks to prevent conflicts when multiple
     devices try to access the camera simultaneously.
+    
+    Locks live in the shared state backend (key camera_lock:<camera_id>,
+    expiring after lock_timeout), so every instance and every worker
+    sees the same locks. Acquire/release are compare-and-set operations.
     """
     
-    def __init__(self, camera_id='default', session_id='default'):
-        self.locks = {}  # {camera_id: {locked_by: session_id, locked_at: datetime}}
-        self.lock = threading.Lock()
+    def __init__(self, camera_id='default', session_id='default', backend=None):
+        self.backend = backend or state_backend
         self.lock_timeout = 60  # Lock expires after 60 seconds
         self._context_camera_id = camera_id
         self._context_session_id = session_id
     
+    @staticmethod
+    def _key(camera_id):
+        return f"camera_lock:{camera_id}"
+    
     def __enter__(self):
         """Context manager entry - acquire lock"""
         self.acquire_lock(self._context_camera_id, self._context_session_id)
@@ -32,54 +41,35 @@ class CameraLockManager:
         
     def acquire_lock(self, camera_id, session_id):
         """Try to acquire a lock on a camera"""
-        with self.lock:
-            now = datetime.now()
-            
-            # Check if camera is already locked
-            if camera_id in self.locks:
-                lock_info = self.locks[camera_id]
-                locked_at = lock_info.get('locked_at', now)
-                
-                # Check if lock has expired
-                if now - locked_at > timedelta(seconds=self.lock_timeout):
-                    # Lock expired, remove it
-                    del self.locks[camera_id]
-                elif lock_info.get('locked_by') != session_id:
-                    # Camera is locked by another session
-                    return False
-            
-            # Acquire the lock
-            self.locks[camera_id] = {
-                'locked_by': session_id,
-                'locked_at': now
-            }
-            return True
+        current = self.backend.get(self._key(camera_id))
+        
+        # Camera is locked by another session (expired locks are already gone)
+        if current is not None and current.get('locked_by') != session_id:
+            return False
+        
+        # Acquire the lock (or re-acquire our own); fails if someone else got there first
+        return self.backend.compare_and_set(self._key(camera_id), current, {
+            'locked_by': session_id,
+            'locked_at': datetime.now().isoformat()
+        }, ttl=self.lock_timeout)
     
     def release_lock(self, camera_id, session_id=None):
         """Release a lock on a camera"""
-        with self.lock:
-            if camera_id in self.locks:
-                # If session_id provided, only release if it matches
-                if session_id and self.locks[camera_id].get('locked_by') != session_id:
-                    return False
-                del self.locks[camera_id]
-                return True
+        current = self.backend.get(self._key(camera_id))
+        if current is None:
+            return False
+        # If session_id provided, only release if it matches
+        if session_id and current.get('locked_by') != session_id:
             return False
+        return self.backend.compare_and_set(self._key(camera_id), current, None)
     
     def check_lock(self, camera_id):
         """Check if a camera is locked"""
-        with self.lock:
-            if camera_id in self.locks:
-                now = datetime.now()
-                lock_info = self.locks[camera_id]
-                locked_at = lock_info.get('locked_at', now)
-                
-                # Check if lock has expired
-                if now - locked_at > timedelta(seconds=self.lock_timeout):
-                    del self.locks[camera_id]
-                    return None
-                return lock_info
+        lock_info = self.backend.get(self._key(camera_id))
+        if lock_info is None:
             return None
+        lock_info['locked_at'] = datetime.fromisoformat(lock_info['locked_at'])
+        return lock_info
     
     def get_lock_info(self, camera_id):
         """Get detailed lock information"""
@@ -87,25 +77,17 @@ class CameraLockManager:
     
     def refresh_lock(self, camera_id, session_id):
         """Refresh/extend a lock"""
-        with self.lock:
-            if camera_id in self.locks:
-                if self.locks[camera_id].get('locked_by') == session_id:
-                    self.locks[camera_id]['locked_at'] = datetime.now()
-                    return True
+        current = self.backend.get(self._key(camera_id))
+        if current is None or current.get('locked_by') != session_id:
             return False
+        return self.backend.compare_and_set(self._key(camera_id), current, {
+            'locked_by': session_id,
+            'locked_at': datetime.now().isoformat()
+        }, ttl=self.lock_timeout)
     
     def cleanup_expired_locks(self):
-        """Remove all expired locks"""
-        with self.lock:
-            now = datetime.now()
-            expired = []
-            for camera_id, lock_info in self.locks.items():
-                locked_at = lock_info.get('locked_at', now)
-                if now - locked_at > timedelta(seconds=self.lock_timeout):
-                    expired.append(camera_id)
-            for camera_id in expired:
-                del self.locks[camera_id]
-            return len(expired)
+        """Remove all expired state entries (locks themselves expire via TTL)"""
+        return self.backend.purge_expired()
     
     def is_camera_available(self, camera_id):
         """Check if camera is available (not locked or lock expired)"""
@@ -139,7 +121,7 @@ def start_cleanup_thread():
             time.sleep(30)  # Check every 30 seconds
             cleaned = camera_lock_manager.cleanup_expired_locks()
             if cleaned > 0:
-                print(f"[Camera Lock] Cleaned up {cleaned} expired locks")
+                print(f"[Camera Lock] Cleaned up {cleaned} expired state entries")
     
     thread = threading.Thread(target=cleanup_loop, daemon=True)
     thread.start()
@@ -15,7 +15,14 @@ DATABASE_CONFIG = {
     'password': os.getenv('DB_PASSWORD', ''),
     'database': os.getenv('DB_NAME', 'absensi_karyawan_db'),
     'charset': 'utf8mb4',
-    'autocommit': True
+    'autocommit': True,
+    # Connection pool
+    'pool_min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+    'pool_max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+    'pool_idle_timeout': int(os.getenv('DB_POOL_IDLE_TIMEOUT', 300)),  # Detik idle sebelum ditutup
+    'pool_max_lifetime': int(os.getenv('DB_POOL_MAX_LIFETIME', 3600)),  # Umur maksimum koneksi (detik)
+    'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),  # Tunggu maksimum saat pool penuh
+    'pool_ping_interval': float(os.getenv('DB_POOL_PING_INTERVAL', 5))  # Ping saat borrow jika idle >= ini
 }
 
 # Konfigurasi aplikasi
@@ -32,7 +39,115 @@ FACE_CONFIG = {
     'model_file': 'static/face_recognition_model.pkl',
     'faces_dir': 'static/faces',
     'num_images': 10,
-    'face_size': (50, 50)
+    'face_size': (50, 50),
+    # Training pipeline: worker threads for decode + detection, recognizer batch size
+    'train_workers': int(os.getenv('FACE_TRAIN_WORKERS', os.cpu_count() or 1)),
+    'train_batch_size': int(os.getenv('FACE_TRAIN_BATCH_SIZE', 32)),
+    # onnxruntime intra-op threads per session (0 = onnxruntime default), used by profiles without their own
+    'ort_intra_op_threads': int(os.getenv('FACE_ORT_INTRA_OP_THREADS', 0)),
+    # onnxruntime providers in priority order (kiosks are CPU-only; add CUDAExecutionProvider for GPU hosts)
+    'ort_providers': [p.strip() for p in os.getenv('FACE_ORT_PROVIDERS', 'CPUExecutionProvider').split(',') if p.strip()],
+    # Model profile (see MODEL_PROFILES) for this deployment, and per-endpoint (mobile, kiosk, batch) overrides "mobile=fast,kiosk=balanced"
+    'model_profile': os.getenv('FACE_MODEL_PROFILE', 'accurate'),
+    'endpoint_profiles': dict(
+        item.split('=', 1) for item in os.getenv('FACE_ENDPOINT_PROFILES', '').replace(' ', '').split(',') if '=' in item
+    ),
+    # Recognition: IVF-flat ANN index once the roster has this many identities (0 = always exact)
+    'ann_min_identities': int(os.getenv('FACE_ANN_MIN_IDENTITIES', 5000)),
+    'ann_nprobe': int(os.getenv('FACE_ANN_NPROBE', 8)),
+    'ann_candidates': int(os.getenv('FACE_ANN_CANDIDATES', 64)),
+    # Recognition: score only the top-k identities by centroid similarity (0 = disabled)
+    'centroid_top_k': int(os.getenv('FACE_CENTROID_TOP_K', 10)),
+    'centroid_min_identities': int(os.getenv('FACE_CENTROID_MIN_IDENTITIES', 50)),
+    'centroid_medoid_dispersion': float(os.getenv('FACE_CENTROID_MEDOID_DISPERSION', 0.3)),
+    'centroid_max_medoids': int(os.getenv('FACE_CENTROID_MAX_MEDOIDS', 3)),
+    # Camera loop: detect every N frames and track in between; re-recognize when quality grows by this factor
+    'track_detect_every': int(os.getenv('FACE_TRACK_DETECT_EVERY', 5)),
+    'track_quality_gain': float(os.getenv('FACE_TRACK_QUALITY_GAIN', 1.25)),
+    # Camera loop: cheap Haar check before the InsightFace detector while no face is tracked
+    'presence_gate': os.getenv('FACE_PRESENCE_GATE', 'False') == 'True',
+    # /api/recognize/batch: aligned crops per recognizer call, images, body size and pixels per image
+    'recognize_batch_size': int(os.getenv('FACE_RECOGNIZE_BATCH_SIZE', 32)),
+    'recognize_batch_max_images': int(os.getenv('FACE_RECOGNIZE_BATCH_MAX_IMAGES', 20)),
+    'recognize_batch_max_mb': int(os.getenv('FACE_RECOGNIZE_BATCH_MAX_MB', 64)),
+    'recognize_batch_max_pixels': int(os.getenv('FACE_RECOGNIZE_BATCH_MAX_PIXELS', 3840 * 2160))
+}
+
+# Profil model face recognition
+# - detector_pack/recognizer_pack: model pack insightface (~/.insightface/models/<pack>)
+# - det_size: ukuran input detector SCRFD
+# - detector_model/recognizer_model: file .onnx pengganti (mis. hasil kuantisasi int8), None = dari pack
+# - intra/inter_op_threads (None = FACE_CONFIG['ort_intra_op_threads'] / default onnxruntime),
+#   graph_optimization (disable|basic|extended|all), execution_mode (sequential|parallel)
+# Recognizer menentukan ruang embedding: semua profil yang dipakai pada database wajah yang
+# sama harus memakai recognizer yang sama (ganti recognizer = training ulang full_rebuild)
+MODEL_PROFILES = {
+    'accurate': {
+        'detector_pack': 'buffalo_l', 'det_size': (640, 640),
+        'recognizer_pack': 'buffalo_l',
+        'detector_model': os.getenv('FACE_ACCURATE_DETECTOR_MODEL') or None,
+        'recognizer_model': os.getenv('FACE_ACCURATE_RECOGNIZER_MODEL') or None,
+        'intra_op_threads': None, 'inter_op_threads': None,
+        'graph_optimization': 'all', 'execution_mode': 'sequential'
+    },
+    'balanced': {
+        'detector_pack': 'buffalo_l', 'det_size': (480, 480),
+        'recognizer_pack': 'buffalo_l',
+        'detector_model': os.getenv('FACE_BALANCED_DETECTOR_MODEL') or None,
+        'recognizer_model': os.getenv('FACE_BALANCED_RECOGNIZER_MODEL') or None,
+        'intra_op_threads': None, 'inter_op_threads': None,
+        'graph_optimization': 'all', 'execution_mode': 'sequential'
+    },
+    'fast': {
+        # Light SCRFD-500M detector, same ArcFace R50 recognizer so the face database stays valid
+        'detector_pack': 'buffalo_sc', 'det_size': (320, 320),
+        'recognizer_pack': 'buffalo_l',
+        'detector_model': os.getenv('FACE_FAST_DETECTOR_MODEL') or None,
+        'recognizer_model': os.getenv('FACE_FAST_RECOGNIZER_MODEL') or None,
+        'intra_op_threads': None, 'inter_op_threads': 1,
+        'graph_optimization': 'all', 'execution_mode': 'sequential'
+    }
+}
+
+# Write-behind activity log: flush setiap N ms atau M baris
+ACTIVITY_LOG_CONFIG = {
+    'max_queue': int(os.getenv('ACTIVITY_LOG_MAX_QUEUE', 10000)),
+    'batch_size': int(os.getenv('ACTIVITY_LOG_BATCH_SIZE', 200)),
+    'flush_interval_ms': int(os.getenv('ACTIVITY_LOG_FLUSH_MS', 500))
+}
+
+# Export laporan: streaming, dan file cache untuk download besar yang bisa di-resume
+EXPORT_CONFIG = {
+    'fetch_size': int(os.getenv('EXPORT_FETCH_SIZE', 1000)),  # Baris per fetch dari server-side cursor
+    'cache_dir': os.getenv('EXPORT_CACHE_DIR', 'cache/exports'),
+    'cache_ttl': int(os.getenv('EXPORT_CACHE_TTL', 600)),  # Detik file export dipakai ulang
+    'cache_max_age': int(os.getenv('EXPORT_CACHE_MAX_AGE', 86400)),  # File lebih tua dari ini dihapus
+    'resumable_min_days': int(os.getenv('EXPORT_RESUMABLE_MIN_DAYS', 31))  # Rentang >= ini ditulis ke file
+}
+
+# Cache hasil laporan/statistik dashboard (di-invalidate saat data ditulis)
+REPORT_CACHE_CONFIG = {
+    'max_entries': int(os.getenv('REPORT_CACHE_MAX_ENTRIES', 256)),
+    'ttl': int(os.getenv('REPORT_CACHE_TTL', 300))  # Detik
+}
+
+# Live feed (Server-Sent Events)
+EVENT_BUS_CONFIG = {
+    'history_size': int(os.getenv('EVENT_HISTORY_SIZE', 500)),  # Event disimpan untuk replay Last-Event-ID
+    'max_subscribers': int(os.getenv('EVENT_MAX_SUBSCRIBERS', 100)),
+    'keepalive': float(os.getenv('EVENT_KEEPALIVE', 15)),  # Detik antar komentar keepalive
+    'max_stream_seconds': float(os.getenv('EVENT_MAX_STREAM_SECONDS', 300)),  # Umur satu stream SSE (0 = tanpa batas)
+    'shared_log_size': int(os.getenv('EVENT_SHARED_LOG_SIZE', 100)),  # Event di log state backend (antar worker)
+    'poll_interval': float(os.getenv('EVENT_POLL_INTERVAL', 1))  # Detik antar baca log event worker lain
+}
+
+# State bersama antar worker (sesi QR, camera lock, status training)
+# memory = satu worker; sqlite = beberapa worker di satu mesin; redis = beberapa mesin
+STATE_BACKEND_CONFIG = {
+    'backend': os.getenv('STATE_BACKEND', 'memory'),
+    'sqlite_path': os.getenv('STATE_SQLITE_PATH', 'data/state.db'),
+    'redis_url': os.getenv('STATE_REDIS_URL', 'redis://localhost:6379/0'),
+    'prefix': os.getenv('STATE_KEY_PREFIX', 'absensi:')
 }
 
 # Konfigurasi file dan folder
@@ -5,7 +5,10 @@ Menggunakan PyMySQL untuk koneksi ke MySQL database
 
 import pymysql
 import pymysql.cursors
+from collections import deque
 from datetime import datetime, date
+import threading
+import time
 import logging
 from config import get_db_config
 
@@ -13,10 +16,285 @@ from config import get_db_config
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes available in time"""
+
+
+class PooledConnection:
+    """
+    Proxy koneksi PyMySQL dari pool.
+    
+    close() tidak menutup koneksi fisik tetapi mengembalikannya ke pool;
+    invalidate() membuang koneksi yang rusak. Setelah mark_session_modified()
+    (SET SESSION ..., FOREIGN_KEY_CHECKS, dll.) close() juga membuang koneksi
+    supaya state session tidak terbawa ke peminjam berikutnya.
+    """
+    
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+        self._session_modified = False
+    
+    def __getattr__(self, name):
+        raw = self.__dict__.get('_raw')
+        if raw is None:
+            raise pymysql.err.InterfaceError(0, 'Pooled connection already returned')
+        return getattr(raw, name)
+    
+    def close(self):
+        """Kembalikan koneksi ke pool (atau buang jika state session sudah diubah)"""
+        raw, self._raw = self._raw, None
+        if raw is None:
+            return
+        if self._session_modified:
+            self._pool._discard(raw)
+        else:
+            self._pool._release(raw, self._created_at)
+    
+    def mark_session_modified(self):
+        """Koneksi ini tidak boleh kembali ke pool (variabel session sudah diubah)"""
+        self._session_modified = True
+    
+    def invalidate(self):
+        """Tutup koneksi fisik (misalnya setelah OperationalError)"""
+        raw, self._raw = self._raw, None
+        if raw is not None:
+            self._pool._discard(raw)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+    
+    def __del__(self):
+        # Safety net for callers that never close()
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """
+    Pool koneksi thread-safe dengan ukuran min/max.
+    
+    - Health check (ping) saat borrow untuk koneksi yang idle lebih dari ping_interval
+    - Koneksi idle lebih dari idle_timeout (di atas min_size) atau lebih tua dari
+      max_lifetime ditutup (recycling)
+    - Metrics: checkouts, creations, waits, timeouts, health check failures, recycled
+    """
+    
+    def __init__(self, connect_fn, min_size=2, max_size=10, idle_timeout=300,
+                 max_lifetime=3600, borrow_timeout=10, ping_interval=5):
+        self.connect_fn = connect_fn
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.borrow_timeout = borrow_timeout
+        self.ping_interval = ping_interval
+        self.condition = threading.Condition()
+        self.idle = deque()  # (raw, created_at, last_used); most recently used on the right
+        self.size = 0  # Open connections (idle + checked out)
+        self.closed = False
+        self.metrics = {
+            'checkouts': 0,
+            'creations': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'timeouts': 0,
+            'health_check_failures': 0,
+            'recycled': 0,
+            'discarded': 0
+        }
+    
+    def _close_raw(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+    
+    def _expired(self, created_at, last_used, now):
+        if self.max_lifetime and now - created_at > self.max_lifetime:
+            return True
+        return bool(self.idle_timeout) and now - last_used > self.idle_timeout and self.size > self.min_size
+    
+    def _prune_idle(self, now):
+        """Tutup koneksi idle yang kedaluwarsa (condition harus dipegang); yang terlama ada di kiri"""
+        expired = []
+        while self.idle and self._expired(self.idle[0][1], self.idle[0][2], now):
+            expired.append(self.idle.popleft()[0])
+            self.size -= 1
+            self.metrics['recycled'] += 1
+        return expired
+    
+    def _create(self):
+        raw = self.connect_fn()
+        with self.condition:
+            self.metrics['creations'] += 1
+        return raw
+    
+    def acquire(self, timeout=None):
+        """
+        Pinjam koneksi dari pool
+        
+        Returns:
+            PooledConnection (close() mengembalikan ke pool)
+        
+        Raises:
+            PoolTimeoutError: Pool penuh dan tidak ada koneksi kembali dalam timeout
+        """
+        timeout = self.borrow_timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+        waited = None
+        
+        while True:
+            to_close = []
+            candidate = None
+            create = False
+            with self.condition:
+                if self.closed:
+                    raise pymysql.err.InterfaceError(0, 'Connection pool is closed')
+                now = time.time()
+                to_close = self._prune_idle(now)
+                if self.idle:
+                    candidate = self.idle.pop()
+                elif self.size < self.max_size:
+                    self.size += 1
+                    create = True
+                else:
+                    if waited is None:
+                        waited = now
+                        self.metrics['waits'] += 1
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self.metrics['timeouts'] += 1
+                        self.metrics['wait_time_total'] += now - waited
+                        raise PoolTimeoutError(f"No database connection available after {timeout}s")
+                    self.condition.wait(remaining)
+                    continue
+            
+            for raw in to_close:
+                self._close_raw(raw)
+            
+            if create:
+                try:
+                    raw = self._create()
+                except Exception:
+                    with self.condition:
+                        self.size -= 1
+                        self.condition.notify()
+                    raise
+                return self._checkout(raw, time.time(), waited)
+            
+            raw, created_at, last_used = candidate
+            if self.ping_interval is not None and time.time() - last_used >= self.ping_interval:
+                try:
+                    raw.ping(reconnect=False)
+                except Exception as e:
+                    logger.warning(f"Pooled connection failed health check: {e}")
+                    with self.condition:
+                        self.metrics['health_check_failures'] += 1
+                    self._discard(raw)
+                    continue
+            return self._checkout(raw, created_at, waited)
+    
+    def _checkout(self, raw, created_at, waited):
+        with self.condition:
+            self.metrics['checkouts'] += 1
+            if waited is not None:
+                self.metrics['wait_time_total'] += time.time() - waited
+        return PooledConnection(self, raw, created_at)
+    
+    def _release(self, raw, created_at):
+        now = time.time()
+        try:
+            # Leave no open transaction behind for the next borrower
+            if not raw.get_autocommit():
+                raw.rollback()
+        except Exception:
+            self._discard(raw)
+            return
+        
+        with self.condition:
+            if self.closed or (self.max_lifetime and now - created_at > self.max_lifetime):
+                self.size -= 1
+                self.metrics['recycled'] += 1
+                self.condition.notify()
+                close = True
+            else:
+                self.idle.append((raw, created_at, now))
+                self.condition.notify()
+                close = False
+        if close:
+            self._close_raw(raw)
+    
+    def _discard(self, raw):
+        with self.condition:
+            self.size -= 1
+            self.metrics['discarded'] += 1
+            self.condition.notify()
+        self._close_raw(raw)
+    
+    def warm(self):
+        """Buka koneksi sampai min_size"""
+        while True:
+            with self.condition:
+                if self.closed or self.size >= self.min_size:
+                    return
+                self.size += 1
+            try:
+                raw = self._create()
+            except Exception as e:
+                with self.condition:
+                    self.size -= 1
+                logger.warning(f"Gagal mengisi pool koneksi: {e}")
+                return
+            with self.condition:
+                self.idle.append((raw, time.time(), time.time()))
+                self.condition.notify()
+    
+    def close_all(self):
+        """Tutup semua koneksi idle; koneksi yang masih dipinjam ditutup saat dikembalikan"""
+        with self.condition:
+            self.closed = True
+            idle = [entry[0] for entry in self.idle]
+            self.idle.clear()
+            self.size -= len(idle)
+            self.condition.notify_all()
+        for raw in idle:
+            self._close_raw(raw)
+    
+    def get_metrics(self):
+        """Snapshot metrics dan ukuran pool"""
+        with self.condition:
+            metrics = dict(self.metrics)
+            metrics.update({
+                'size': self.size,
+                'idle': len(self.idle),
+                'in_use': self.size - len(self.idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size
+            })
+        metrics['wait_time_total'] = round(metrics['wait_time_total'], 3)
+        return metrics
+
+
 class DatabaseManager:
     def __init__(self):
         self.config = get_db_config()
         self.connection = None
+        self.pool = ConnectionPool(
+            self._connect_raw,
+            min_size=self.config['pool_min_size'],
+            max_size=self.config['pool_max_size'],
+            idle_timeout=self.config['pool_idle_timeout'],
+            max_lifetime=self.config['pool_max_lifetime'],
+            borrow_timeout=self.config['pool_timeout'],
+            ping_interval=self.config['pool_ping_interval']
+        )
     
     def connect(self):
         """Membuat koneksi ke database MySQL"""
@@ -113,10 +391,46 @@ class DatabaseManager:
                 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
                 """
                 
+                # Rollup harian untuk laporan (dijaga oleh attendance_rollup.py)
+                create_daily_employee_table = """
+                CREATE TABLE IF NOT EXISTS attendance_daily_employee (
+                    employee_id INT NOT NULL,
+                    tanggal DATE NOT NULL,
+                    bagian VARCHAR(50) NOT NULL,
+                    status VARCHAR(20) NULL,
+                    jam_masuk TIME NULL,
+                    jam_pulang TIME NULL,
+                    hadir TINYINT NOT NULL DEFAULT 0,
+                    terlambat TINYINT NOT NULL DEFAULT 0,
+                    tepat_waktu TINYINT NOT NULL DEFAULT 0,
+                    work_hours INT NULL,
+                    work_seconds INT NULL,
+                    PRIMARY KEY (employee_id, tanggal),
+                    KEY idx_daily_employee_tanggal (tanggal, bagian)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+                """
+                
+                create_daily_bagian_table = """
+                CREATE TABLE IF NOT EXISTS attendance_daily_bagian (
+                    tanggal DATE NOT NULL,
+                    bagian VARCHAR(50) NOT NULL,
+                    total_records INT NOT NULL DEFAULT 0,
+                    hadir INT NOT NULL DEFAULT 0,
+                    terlambat INT NOT NULL DEFAULT 0,
+                    tepat_waktu INT NOT NULL DEFAULT 0,
+                    work_days INT NOT NULL DEFAULT 0,
+                    work_hours_total INT NOT NULL DEFAULT 0,
+                    overtime_hours_total INT NOT NULL DEFAULT 0,
+                    PRIMARY KEY (tanggal, bagian)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+                """
+                
                 # Eksekusi pembuatan tabel
                 cursor.execute(create_employees_table)
                 cursor.execute(create_attendance_table)
                 cursor.execute(create_activity_log_table)
+                cursor.execute(create_daily_employee_table)
+                cursor.execute(create_daily_bagian_table)
                 
                 logger.info("Semua tabel berhasil dibuat")
                 return True
@@ -126,30 +440,37 @@ class DatabaseManager:
             return False
     
     def close_connection(self):
-        """Menutup koneksi database"""
+        """Menutup koneksi database dan pool"""
         if self.connection:
             self.connection.close()
             logger.info("Koneksi database ditutup")
+        self.pool.close_all()
+    
+    def _connect_raw(self):
+        """Koneksi PyMySQL fisik baru (dipakai oleh pool)"""
+        return pymysql.connect(
+            host=self.config['host'],
+            port=self.config['port'],
+            user=self.config['user'],
+            password=self.config['password'],
+            database=self.config['database'],
+            charset=self.config['charset'],
+            cursorclass=pymysql.cursors.DictCursor,
+            autocommit=self.config['autocommit']
+        )
     
     def get_connection(self):
-        """Mendapatkan koneksi database baru untuk setiap request"""
+        """Pinjam koneksi dari pool; close() mengembalikannya ke pool"""
         try:
-            # Selalu buat koneksi baru untuk menghindari masalah thread
-            connection = pymysql.connect(
-                host=self.config['host'],
-                port=self.config['port'],
-                user=self.config['user'],
-                password=self.config['password'],
-                database=self.config['database'],
-                charset=self.config['charset'],
-                cursorclass=pymysql.cursors.DictCursor,
-                autocommit=self.config['autocommit']
-            )
-            return connection
+            return self.pool.acquire()
         except Exception as e:
             logger.error(f"Gagal membuat koneksi: {e}")
             return None
     
+    def get_pool_metrics(self):
+        """Metrics pool koneksi (checkouts, creations, waits, ...)"""
+        return self.pool.get_metrics()
+    
     def execute_query(self, query, params=None):
         """Eksekusi query dengan parameter"""
         connection = None
@@ -168,12 +489,126 @@ class DatabaseManager:
                 return result
         except Exception as e:
             logger.error(f"Gagal eksekusi query: {e}")
+            if connection:
+                if isinstance(e, (pymysql.err.OperationalError, pymysql.err.InterfaceError)):
+                    # Connection-level failure: do not hand it out again
+                    connection.invalidate()
+                    connection = None
+                else:
+                    try:
+                        connection.rollback()
+                    except:
+                        pass
+            return None
+        finally:
             if connection:
                 try:
-                    connection.rollback()
+                    connection.close()
                 except:
                     pass
-            return None
+    
+    def execute_write_and_fetch(self, write_query, write_params, select_query, select_params):
+        """
+        Eksekusi satu write lalu SELECT di koneksi yang sama (satu borrow dari pool)
+        
+        Returns:
+            Tuple (rowcount write, rows hasil SELECT), atau (None, None) jika gagal
+        """
+        connection = None
+        try:
+            connection = self.get_connection()
+            if not connection:
+                return None, None
+            
+            with connection.cursor() as cursor:
+                cursor.execute(write_query, write_params or ())
+                rowcount = cursor.rowcount
+                connection.commit()
+                cursor.execute(select_query, select_params or ())
+                return rowcount, cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Gagal eksekusi query: {e}")
+            if connection:
+                if isinstance(e, (pymysql.err.OperationalError, pymysql.err.InterfaceError)):
+                    connection.invalidate()
+                    connection = None
+                else:
+                    try:
+                        connection.rollback()
+                    except:
+                        pass
+            return None, None
+        finally:
+            if connection:
+                try:
+                    connection.close()
+                except:
+                    pass
+    
+    def stream_query(self, query, params=None, fetch_size=1000):
+        """
+        Generator baris hasil SELECT memakai server-side cursor (SSDictCursor)
+        
+        Baris diambil dari server per fetch_size, jadi memori tetap kecil untuk
+        hasil sebesar apapun. Jika generator tidak dihabiskan (mis. client
+        memutus download), koneksi dibuang dari pool daripada menguras sisa baris.
+        """
+        connection = self.get_connection()
+        if not connection:
+            raise RuntimeError("Tidak dapat meminjam koneksi database")
+        
+        finished = False
+        try:
+            cursor = connection.cursor(pymysql.cursors.SSDictCursor)
+            # Server pushes rows as fast as the consumer reads them; a slow download must not time it out
+            connection.mark_session_modified()
+            cursor.execute("SET SESSION net_write_timeout = 600")
+            cursor.execute(query, params or ())
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+            cursor.close()
+            finished = True
+        finally:
+            if finished:
+                connection.close()
+            else:
+                connection.invalidate()
+    
+    def execute_transaction(self, statements):
+        """
+        Eksekusi beberapa statement (query, params) dalam satu transaksi
+        
+        Returns:
+            True jika semua statement berhasil dan di-commit
+        """
+        connection = None
+        try:
+            connection = self.get_connection()
+            if not connection:
+                return False
+            
+            connection.begin()
+            with connection.cursor() as cursor:
+                for query, params in statements:
+                    cursor.execute(query, params or ())
+            connection.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Gagal eksekusi transaksi: {e}")
+            if connection:
+                if isinstance(e, (pymysql.err.OperationalError, pymysql.err.InterfaceError)):
+                    connection.invalidate()
+                    connection = None
+                else:
+                    try:
+                        connection.rollback()
+                    except:
+                        pass
+            return False
         finally:
             if connection:
                 try:
@@ -197,6 +632,9 @@ class DatabaseManager:
         if not self.create_tables():
             return False
         
+        # 4. Isi pool koneksi sampai ukuran minimum
+        self.pool.warm()
+        
         logger.info("Inisialisasi database selesai!")
         return True
 
@@ -0,0 +1,273 @@
+"""
+Embedding Store - On-disk format for the InsightFace embedding database
+
+Layout (semua file di folder yang sama):
+- face_embeddings.json         Header: format, version, generation, checksum,
+                               dimensi matrix dan identity index
+- face_embeddings.<gen>.npy    Matrix float32 (N, 512), baris sudah
+                               L2-normalized dan dikelompokkan per identitas
+
+Matrix dibuka dengan mmap (read-only) sehingga semua gunicorn worker berbagi
+page cache yang sama. Setiap save menulis ke file temp lalu di-rename secara
+atomic; header ditulis terakhir sehingga pembaca selalu melihat generasi
+yang lengkap.
+
+Save dan load antar proses diserialisasi dengan flock pada
+face_embeddings.json.lock (exclusive untuk save, shared untuk load), dan
+file matrix generasi sebelumnya disimpan satu generasi lagi.
+"""
+
+import os
+import glob
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of this process are serialized
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+STORE_FORMAT = 'smart-absen-embeddings'
+STORE_VERSION = 1
+
+
+class EmbeddingStoreError(Exception):
+    """Raised when the on-disk embedding store is missing or corrupt"""
+
+
+def _checksum(matrix: np.ndarray, identities: list) -> str:
+    """SHA-256 over the matrix bytes and the identity index"""
+    digest = hashlib.sha256()
+    matrix = np.ascontiguousarray(matrix)
+    # memoryview.cast rejects zero-sized shapes (empty database)
+    digest.update(memoryview(matrix).cast('B') if matrix.size else b'')
+    digest.update(json.dumps(identities, sort_keys=True).encode('utf-8'))
+    return f"sha256:{digest.hexdigest()}"
+
+
+def _atomic_write(path: str, write_fn, suffix: str):
+    """Write via a temp file in the target directory, fsync, then rename"""
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix=suffix)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write_fn(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class EmbeddingStore:
+    """
+    Versioned, memory-mapped store for the face embedding matrix.
+
+    save() menerima index dict hasil _build_embedding_index() (matrix,
+    offsets, counts, names) dan load() mengembalikan struktur yang sama
+    dengan matrix berupa np.memmap.
+    """
+
+    def __init__(self, header_path: str):
+        self.header_path = header_path
+        self.directory = os.path.dirname(header_path) or '.'
+        self.basename = os.path.splitext(os.path.basename(header_path))[0]
+        self.lock_path = header_path + '.lock'
+        self._thread_lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_fd = None
+
+    @contextmanager
+    def lock(self, shared: bool = False):
+        """
+        Inter-process lock on the store (reentrant within this process)
+
+        Hold it around read-modify-save sequences so another worker cannot
+        commit a generation in between. A nested lock keeps the mode of the
+        outermost one.
+        """
+        with self._thread_lock:
+            if self._lock_depth == 0 and fcntl is not None:
+                os.makedirs(self.directory, exist_ok=True)
+                fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                except Exception:
+                    os.close(fd)
+                    raise
+                self._lock_fd = fd
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and self._lock_fd is not None:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+                    os.close(self._lock_fd)
+                    self._lock_fd = None
+
+    def _matrix_filename(self, generation: int) -> str:
+        return f"{self.basename}.{generation}.npy"
+
+    def exists(self) -> bool:
+        """Check if a committed header exists"""
+        return os.path.exists(self.header_path)
+
+    def read_header(self) -> Optional[Dict]:
+        """Read and validate the header, or None if no store exists"""
+        if not self.exists():
+            return None
+        with open(self.header_path, 'r') as f:
+            header = json.load(f)
+        if header.get('format') != STORE_FORMAT:
+            raise EmbeddingStoreError(f"Unknown store format: {header.get('format')}")
+        if header.get('version', 0) > STORE_VERSION:
+            raise EmbeddingStoreError(
+                f"Store version {header.get('version')} is newer than supported ({STORE_VERSION})"
+            )
+        return header
+
+    def load(self, verify: bool = True) -> Optional[Dict]:
+        """
+        Open the current generation with mmap
+
+        Args:
+            verify: Recompute and compare the checksum (reads the whole matrix once)
+
+        Returns:
+            Index dict (matrix, owners, offsets, counts, names, metadata,
+            generation, checksum) or None
+        """
+        # Shared lock: a concurrent save cannot remove the file between header and np.load
+        with self.lock(shared=True):
+            header = self.read_header()
+            if header is None:
+                return None
+
+            matrix_path = os.path.join(self.directory, header['matrix_file'])
+            matrix = np.load(matrix_path, mmap_mode='r')
+
+        if matrix.dtype != np.float32 or matrix.shape != (header['rows'], header['dim']):
+            raise EmbeddingStoreError(
+                f"Matrix shape/dtype mismatch: {matrix.shape} {matrix.dtype}, "
+                f"header says ({header['rows']}, {header['dim']}) float32"
+            )
+
+        identities = header['identities']
+        if verify and _checksum(matrix, identities) != header['checksum']:
+            raise EmbeddingStoreError(f"Checksum mismatch for {matrix_path}")
+
+        names = [identity['name'] for identity in identities]
+        counts = np.array([identity['count'] for identity in identities], dtype=np.int64)
+        offsets = np.array([identity['offset'] for identity in identities], dtype=np.int64)
+        owners = np.repeat(np.arange(len(names), dtype=np.int32), counts)
+
+        logger.info(
+            f"Opened embedding store generation {header['generation']} "
+            f"({len(names)} identities, {header['rows']} embeddings, mmap)"
+        )
+        return {
+            'matrix': matrix,
+            'owners': owners,
+            'offsets': offsets,
+            'counts': counts,
+            'names': names,
+            'metadata': header.get('metadata', {}),
+            'generation': header['generation'],
+            'checksum': header['checksum']
+        }
+
+    def save(self, index: Optional[Dict], metadata: Optional[Dict] = None) -> int:
+        """
+        Write a new generation atomically
+
+        Args:
+            index: Index dict from _build_embedding_index(), or None for empty
+            metadata: Extra JSON-serializable data stored in the header
+
+        Returns:
+            The new generation number
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with self.lock():
+            return self._save_locked(index, metadata)
+
+    def _save_locked(self, index: Optional[Dict], metadata: Optional[Dict]) -> int:
+        # The latest generation is read under the lock, so two workers never write the same file
+        previous = None
+        try:
+            previous = self.read_header()
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable embedding store header: {e}")
+        generation = (previous or {}).get('generation', 0) + 1
+
+        if index is None:
+            matrix = np.zeros((0, 512), dtype=np.float32)
+            identities = []
+        else:
+            matrix = np.ascontiguousarray(index['matrix'], dtype=np.float32)
+            identities = [
+                {'name': name, 'offset': int(offset), 'count': int(count)}
+                for name, offset, count in zip(index['names'], index['offsets'], index['counts'])
+            ]
+
+        matrix_file = self._matrix_filename(generation)
+        _atomic_write(
+            os.path.join(self.directory, matrix_file),
+            lambda f: np.save(f, matrix, allow_pickle=False),
+            suffix='.npy'
+        )
+
+        header = {
+            'format': STORE_FORMAT,
+            'version': STORE_VERSION,
+            'generation': generation,
+            'matrix_file': matrix_file,
+            'dtype': 'float32',
+            'rows': int(matrix.shape[0]),
+            'dim': int(matrix.shape[1]),
+            'checksum': _checksum(matrix, identities),
+            'identities': identities,
+            'metadata': metadata or {},
+            'updated_at': datetime.now().isoformat()
+        }
+        _atomic_write(
+            self.header_path,
+            lambda f: f.write(json.dumps(header).encode('utf-8')),
+            suffix='.json'
+        )
+
+        # Keep the previous generation too, for readers that opened it without the lock
+        self._remove_stale_generations(keep={matrix_file, (previous or {}).get('matrix_file')})
+        return generation
+
+    def _remove_stale_generations(self, keep: set):
+        """Delete matrix files of older generations (open mmaps stay valid on POSIX)"""
+        pattern = os.path.join(self.directory, f"{self.basename}.*.npy")
+        for path in glob.glob(pattern):
+            if os.path.basename(path) not in keep:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.debug(f"Could not remove stale embedding matrix {path}: {e}")
+
+    def delete(self):
+        """Remove the header and all matrix generations"""
+        with self.lock():
+            if os.path.exists(self.header_path):
+                os.remove(self.header_path)
+            self._remove_stale_generations(keep=set())
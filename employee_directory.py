@@ -0,0 +1,170 @@
+"""
+Employee Directory - Cache data karyawan di memori proses
+
+Index dict by id, NIK, nama dan (nama, bagian) sehingga lookup hasil
+recognition -> baris karyawan O(1) tanpa round trip ke database.
+Dimuat saat startup (warm) dan di-invalidate setiap kali tabel employees
+ditulis. invalidate() juga mengganti token versi bersama di state backend,
+sehingga worker gunicorn lain memuat ulang paling lambat version_check_interval
+detik kemudian; max_age tetap membatasi umur cache untuk write yang tidak
+lewat invalidate().
+"""
+
+import threading
+import time
+import logging
+from typing import Dict, List, Optional
+
+from database import get_db_manager
+from state_backend import SharedVersion
+
+logger = logging.getLogger(__name__)
+
+
+def _load_employees() -> List[Dict]:
+    result = get_db_manager().execute_query("SELECT * FROM employees ORDER BY name")
+    if result is None:
+        raise RuntimeError("Gagal memuat data karyawan dari database")
+    return list(result)
+
+
+class EmployeeDirectory:
+    """Index karyawan per proses, thread-safe, dimuat ulang secara lazy setelah invalidate"""
+
+    def __init__(self, loader=_load_employees, max_age: float = 300,
+                 shared_version: Optional[SharedVersion] = None):
+        self.loader = loader
+        self.max_age = max_age
+        self.shared_version = shared_version
+        self._shared_token = None  # Shared version the loaded rows belong to
+        self.lock = threading.Lock()
+        self.reload_lock = threading.Lock()
+        self._employees = []
+        self._by_id = {}
+        self._by_nik = {}
+        self._by_name = {}
+        self._by_name_bagian = {}
+        self._loaded_at = None
+        self._version = 0  # Bumped by invalidate(); a reload started earlier does not count as fresh
+        self.stats = {'hits': 0, 'reloads': 0, 'invalidations': 0, 'load_errors': 0}
+
+    def _is_fresh(self) -> bool:
+        return self._loaded_at is not None and (not self.max_age or time.time() - self._loaded_at < self.max_age)
+
+    def _current_shared_token(self):
+        if self.shared_version is None:
+            return None
+        try:
+            return self.shared_version.current()
+        except Exception as e:
+            logger.warning(f"Versi employee directory di state backend tidak terbaca: {e}")
+            return self._shared_token
+
+    def warm(self) -> bool:
+        """Muat ulang sekarang (dipanggil saat startup)"""
+        return self._reload()
+
+    def _reload(self) -> bool:
+        with self.reload_lock:
+            with self.lock:
+                version = self._version
+            # Read before loading: a write elsewhere during the load leaves the token mismatched
+            shared_token = self._current_shared_token()
+            try:
+                employees = self.loader()
+            except Exception as e:
+                logger.error(f"Gagal memuat employee directory: {e}")
+                with self.lock:
+                    self.stats['load_errors'] += 1
+                return False
+
+            by_id, by_nik, by_name, by_name_bagian = {}, {}, {}, {}
+            for employee in employees:
+                by_id[employee['id']] = employee
+                if employee.get('nik'):
+                    by_nik[str(employee['nik'])] = employee
+                # First row in name order wins, as the old linear scan did
+                by_name.setdefault(employee.get('name'), employee)
+                by_name_bagian[(employee.get('name'), employee.get('bagian'))] = employee
+
+            with self.lock:
+                self._employees = employees
+                self._by_id = by_id
+                self._by_nik = by_nik
+                self._by_name = by_name
+                self._by_name_bagian = by_name_bagian
+                self._shared_token = shared_token
+                self.stats['reloads'] += 1
+                # Only fresh if nothing was written while we were loading
+                self._loaded_at = time.time() if version == self._version else None
+            logger.info(f"Employee directory dimuat: {len(employees)} karyawan")
+            return True
+
+    def invalidate(self):
+        """Tandai cache basi setelah tabel employees berubah"""
+        with self.lock:
+            self._version += 1
+            self._loaded_at = None
+            self.stats['invalidations'] += 1
+        if self.shared_version is not None:
+            try:
+                self.shared_version.bump()
+            except Exception as e:
+                logger.warning(f"Gagal mengganti versi employee directory di state backend: {e}")
+
+    def _ensure_loaded(self):
+        with self.lock:
+            fresh = self._is_fresh()
+            loaded_token = self._shared_token
+        if fresh and self.shared_version is not None:
+            # Another worker changed the employees table
+            fresh = self._current_shared_token() == loaded_token
+        if not fresh:
+            self._reload()
+
+    def _lookup(self, index_name: str, key) -> Optional[Dict]:
+        self._ensure_loaded()
+        with self.lock:
+            self.stats['hits'] += 1
+            employee = getattr(self, index_name).get(key)
+        return dict(employee) if employee else None
+
+    def get_by_id(self, employee_id) -> Optional[Dict]:
+        try:
+            employee_id = int(employee_id)
+        except (TypeError, ValueError):
+            return None
+        return self._lookup('_by_id', employee_id)
+
+    def get_by_nik(self, nik) -> Optional[Dict]:
+        return self._lookup('_by_nik', str(nik)) if nik else None
+
+    def get_by_name(self, name) -> Optional[Dict]:
+        return self._lookup('_by_name', name)
+
+    def get_by_name_bagian(self, name, bagian) -> Optional[Dict]:
+        return self._lookup('_by_name_bagian', (name, bagian))
+
+    def all(self) -> List[Dict]:
+        """Semua karyawan (urut nama)"""
+        self._ensure_loaded()
+        with self.lock:
+            return [dict(employee) for employee in self._employees]
+
+    def count(self) -> int:
+        self._ensure_loaded()
+        with self.lock:
+            return len(self._employees)
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats['employees'] = len(self._employees)
+            stats['age_seconds'] = round(time.time() - self._loaded_at, 1) if self._loaded_at else None
+        return stats
+
+
+# Instance global employee directory
+employee_directory = EmployeeDirectory(
+    shared_version=SharedVersion('employee_directory:version', check_interval=2)
+)
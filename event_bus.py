@@ -0,0 +1,268 @@
+"""
+Event Bus - Publish/subscribe untuk live update (SSE)
+
+Write absensi, verifikasi QR dan progress training dipublish sebagai event
+kecil (delta). Setiap client SSE punya antrian sendiri yang hanya terisi
+saat ada event, jadi server tidak bekerja selama tidak ada perubahan.
+
+Event terakhir disimpan di ring buffer sehingga client yang reconnect
+dengan Last-Event-ID mendapat event yang terlewat; jika sudah terlalu jauh
+tertinggal, client menerima event 'resync' dan memuat ulang datanya.
+
+Dengan state backend bersama (sqlite/redis) event juga ditulis ke log
+pendek di backend: id event menjadi satu urutan untuk semua worker, dan
+thread poller di setiap worker yang punya subscriber meneruskan event dari
+worker lain (paling lambat poll_interval detik). Stream SSE memegang satu
+thread selama terbuka, jadi jalankan gunicorn dengan worker gthread/gevent;
+max_duration membatasi umur satu stream (browser reconnect otomatis dengan
+Last-Event-ID).
+"""
+
+import json
+import queue
+import threading
+import time
+import logging
+from collections import deque
+from typing import Dict, Iterable, Iterator, Optional
+
+from config import EVENT_BUS_CONFIG
+from state_backend import state_backend
+
+logger = logging.getLogger(__name__)
+
+RESYNC = 'resync'
+SHARED_LOG_KEY = 'events:log'
+
+
+class Subscription:
+    """Antrian event untuk satu client"""
+
+    def __init__(self, bus, topics: Optional[Iterable[str]], max_queue: int):
+        self.bus = bus
+        self.topics = set(topics) if topics else None  # None = semua topic
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.overflowed = False
+
+    def wants(self, topic: str) -> bool:
+        return self.topics is None or topic in self.topics
+
+    def offer(self, event: Dict):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Slow client: drop its backlog, it reloads everything on 'resync'
+            self.overflowed = True
+
+    def get(self, timeout: float) -> Optional[Dict]:
+        if self.overflowed:
+            self.overflowed = False
+            with self.queue.mutex:
+                self.queue.queue.clear()
+            return {'id': self.bus.last_id, 'topic': RESYNC, 'data': {}}
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class EventBus:
+    """Event bus thread-safe dengan ring buffer untuk replay Last-Event-ID"""
+
+    def __init__(self, history_size: int = 500, max_queue: int = 200, max_subscribers: int = 100,
+                 backend=None, shared_log_size: int = 100, poll_interval: float = 1.0):
+        self.max_queue = max_queue
+        self.max_subscribers = max_subscribers
+        self.backend = backend  # Shared state backend; None = this process only
+        self.shared_log_size = shared_log_size
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.history = deque(maxlen=history_size)
+        self.subscribers = set()
+        self.last_id = 0
+        self._polled_id = None  # Last shared log sequence seen by the poller
+        self._own_ids = set()  # Published here and already delivered, skipped by the poller
+        self._poller = None
+        self.stats = {'published': 0, 'delivered': 0, 'rejected_subscribers': 0,
+                      'remote_events': 0, 'shared_errors': 0}
+
+    def _append_shared(self, event: Dict) -> Dict:
+        def append(log):
+            log = log or {'seq': 0, 'events': []}
+            seq = log['seq'] + 1
+            events = log['events'] + [dict(event, id=seq)]
+            return {'seq': seq, 'events': events[-self.shared_log_size:]}
+
+        # Stored copy: the same JSON the other workers read
+        return self.backend.update(SHARED_LOG_KEY, append)['events'][-1]
+
+    def _deliver(self, event: Dict, count_published: bool = True):
+        with self.lock:
+            if 'id' in event:
+                self.last_id = max(self.last_id, event['id'])
+            else:
+                self.last_id += 1
+                event['id'] = self.last_id
+            self.history.append(event)
+            subscribers = [subscriber for subscriber in self.subscribers if subscriber.wants(event['topic'])]
+            if count_published:
+                self.stats['published'] += 1
+            self.stats['delivered'] += len(subscribers)
+        for subscriber in subscribers:
+            subscriber.offer(event)
+
+    def publish(self, topic: str, data: Dict) -> int:
+        """Kirim event ke semua subscriber topic ini; mengembalikan id event"""
+        event = {'topic': topic, 'data': data, 'time': time.time()}
+        if self.backend is not None:
+            try:
+                event = self._append_shared(event)
+                with self.lock:
+                    self._own_ids.add(event['id'])
+            except Exception as e:
+                # Still reaches this worker's clients; the others pick it up on their next poll
+                logger.warning(f"Event bus: event '{topic}' tidak terkirim ke worker lain: {e}")
+                with self.lock:
+                    self.stats['shared_errors'] += 1
+        self._deliver(event)
+        return event['id']
+
+    def poll_shared(self):
+        """Teruskan event dari worker lain yang belum dikirim di proses ini"""
+        if self.backend is None:
+            return
+        try:
+            log = self.backend.get(SHARED_LOG_KEY) or {'seq': 0, 'events': []}
+        except Exception as e:
+            logger.warning(f"Event bus: log event bersama tidak terbaca: {e}")
+            with self.lock:
+                self.stats['shared_errors'] += 1
+            return
+
+        seq = log['seq']
+        with self.lock:
+            last, self._polled_id = self._polled_id, seq
+            if last is None or seq == last:
+                self.last_id = max(self.last_id, seq)
+                return
+            events = [event for event in log['events'] if event['id'] > last]
+            missed = seq < last or not events or events[0]['id'] != last + 1
+            remote = [event for event in events if event['id'] not in self._own_ids]
+            self._own_ids = {event_id for event_id in self._own_ids if event_id > seq}
+            if not missed:
+                self.stats['remote_events'] += len(remote)
+
+        if missed:
+            # Shared log was reset or has moved past this worker: clients reload everything
+            resync = {'id': seq, 'topic': RESYNC, 'data': {}}
+            with self.lock:
+                self.last_id = max(self.last_id, seq)
+                subscribers = list(self.subscribers)
+            for subscriber in subscribers:
+                subscriber.offer(resync)
+            return
+        for event in remote:
+            self._deliver(event, count_published=False)
+
+    def _poll_loop(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self.lock:
+                idle = not self.subscribers
+            if not idle:
+                self.poll_shared()
+
+    def _ensure_poller(self):
+        if self.backend is None or self._poller is not None:
+            return
+        with self.lock:
+            if self._poller is not None:
+                return
+            self._poller = threading.Thread(target=self._poll_loop, name='event-bus-poller', daemon=True)
+        self.poll_shared()  # Catch up before the first replay
+        self._poller.start()
+
+    def subscribe(self, topics: Optional[Iterable[str]] = None, last_event_id: Optional[int] = None):
+        """
+        Daftarkan subscriber baru
+
+        Returns:
+            Tuple (Subscription, replay events) - Subscription None jika
+            jumlah subscriber sudah maksimum
+        """
+        self._ensure_poller()
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                self.stats['rejected_subscribers'] += 1
+                return None, []
+            subscription = Subscription(self, topics, self.max_queue)
+            self.subscribers.add(subscription)
+
+            replay = []
+            if last_event_id is not None and last_event_id < self.last_id:
+                oldest_id = min(event['id'] for event in self.history) if self.history else self.last_id + 1
+                if last_event_id + 1 < oldest_id:
+                    replay = [{'id': self.last_id, 'topic': RESYNC, 'data': {}}]
+                else:
+                    replay = sorted((event for event in self.history
+                                     if event['id'] > last_event_id and subscription.wants(event['topic'])),
+                                    key=lambda event: event['id'])
+        return subscription, replay
+
+    def unsubscribe(self, subscription: Subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats['subscribers'] = len(self.subscribers)
+            stats['last_id'] = self.last_id
+            stats['shared'] = self.backend is not None
+        return stats
+
+
+def format_sse(event: Dict) -> str:
+    """Format satu event sebagai frame text/event-stream"""
+    payload = json.dumps(event['data'], default=str, ensure_ascii=False)
+    return f"id: {event['id']}\nevent: {event['topic']}\ndata: {payload}\n\n"
+
+
+def sse_stream(subscription: Subscription, replay: Iterable[Dict], keepalive: float = 15.0,
+               retry_ms: int = 3000, max_duration: float = 0) -> Iterator[str]:
+    """
+    Generator body response SSE; komentar keepalive dikirim setelah keepalive
+    detik tanpa event agar koneksi yang putus terdeteksi dan subscriber dilepas.
+    Stream berakhir setelah max_duration detik (0 = tanpa batas); browser
+    langsung reconnect dan mendapat event yang terlewat lewat Last-Event-ID.
+    """
+    deadline = time.time() + max_duration if max_duration else None
+    try:
+        yield f"retry: {retry_ms}\n\n"
+        for event in replay:
+            yield format_sse(event)
+        while True:
+            timeout = keepalive
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return
+                timeout = min(keepalive, remaining)
+            event = subscription.get(timeout=timeout)
+            if event is not None:
+                yield format_sse(event)
+            elif deadline is None or time.time() < deadline:
+                yield ": keepalive\n\n"
+    finally:
+        subscription.close()
+
+
+# Instance global event bus
+# (memory state backend = one process, nothing to share)
+event_bus = EventBus(EVENT_BUS_CONFIG['history_size'], max_subscribers=EVENT_BUS_CONFIG['max_subscribers'],
+                     backend=state_backend if state_backend.name != 'memory' else None,
+                     shared_log_size=EVENT_BUS_CONFIG['shared_log_size'],
+                     poll_interval=EVENT_BUS_CONFIG['poll_interval'])
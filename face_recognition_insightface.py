@@ -11,105 +11,420 @@ Fitur:
 
 import os
 import cv2
+import glob
 import numpy as np
 import pickle
 import logging
-from typing import Tuple, List, Optional, Dict
+import threading
+from typing import Tuple, List, Optional, Dict, Callable
+from concurrent.futures import ThreadPoolExecutor
+from embedding_store import EmbeddingStore
+from ann_index import IVFFlatIndex
+from config import FACE_CONFIG, MODEL_PROFILES
 import warnings
 warnings.filterwarnings('ignore')
 
 logger = logging.getLogger(__name__)
 
-# Global InsightFace app instance
-_insightface_app = None
+# Prepared InsightFace apps, one per model profile (see MODEL_PROFILES)
+_insightface_apps = {}
+_insightface_lock = threading.Lock()  # Warm-up thread and first request must not both build an app
+_failed_profiles = set()  # Profiles whose app could not be built (served by the 'fast' fallback)
+_recognizer_checked = set()  # Profiles already compared with the recognizer the database was built with
 _face_database = {}  # {name: [embeddings]}
-_database_path = 'static/face_embeddings.pkl'
+_database_path = 'static/face_embeddings.json'  # Header of the mmap embedding store
+_legacy_database_path = 'static/face_embeddings.pkl'  # Old pickle format (migrated on load)
+_embedding_store = EmbeddingStore(_database_path)
+_store_mtime = None  # mtime_ns of the header we loaded, to pick up saves by other workers
+_face_sources = {}  # {name: [source image per embedding, None if added directly]}
+_training_manifest = {}  # {"person/file.jpg": [mtime_ns, size]} of images already processed
+_faces_dir = 'static/faces'
+_ann_index_path = 'static/face_embeddings.ivf.npz'  # IVF-flat index for large rosters (index['ann'] in memory)
+_identity_centroids = {}  # {name: {'centroid', 'count', 'medoids'}} for the first-stage prefilter
+# Guards _identity_centroids and the parts of an index snapshot built lazily by request threads
+# (index['centroid_table']); the training worker clears the cache while requests read it
+_matcher_lock = threading.RLock()
 
-def get_insightface_app():
-    """Initialize InsightFace app singleton"""
-    global _insightface_app
-    if _insightface_app is None:
-        try:
-            from insightface.app import FaceAnalysis
-            _insightface_app = FaceAnalysis(
-                name='buffalo_l',  # Best accuracy model
-                providers=['CUDAExecutionProvider', 'CPUExecutionProvider']
-            )
-            _insightface_app.prepare(ctx_id=0, det_size=(640, 640))
-            logger.info("InsightFace initialized successfully (ArcFace buffalo_l model)")
-        except Exception as e:
-            logger.error(f"Failed to initialize InsightFace: {e}")
-            # Fallback to lighter model
-            try:
-                from insightface.app import FaceAnalysis
-                _insightface_app = FaceAnalysis(
-                    name='buffalo_sc',  # Lighter model
-                    providers=['CPUExecutionProvider']
-                )
-                _insightface_app.prepare(ctx_id=-1, det_size=(320, 320))
-                logger.info("InsightFace initialized with lighter model (buffalo_sc)")
-            except Exception as e2:
-                logger.error(f"Failed to initialize InsightFace fallback: {e2}")
-                return None
-    return _insightface_app
+# Contiguous, pre-normalized view of _face_database used for scoring.
+# Rebuilt lazily whenever the database changes (see _invalidate_embedding_index)
+_embedding_index = None
+
+# Weights for combining max and mean similarity per identity
+SCORE_MAX_WEIGHT = 0.7
+SCORE_MEAN_WEIGHT = 0.3
+
+_GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': 'ORT_DISABLE_ALL',
+    'basic': 'ORT_ENABLE_BASIC',
+    'extended': 'ORT_ENABLE_EXTENDED',
+    'all': 'ORT_ENABLE_ALL'
+}
+_EXECUTION_MODES = {'sequential': 'ORT_SEQUENTIAL', 'parallel': 'ORT_PARALLEL'}
+
+# Attendance needs only the SCRFD box + 5 keypoints and the ArcFace embedding;
+# the gender/age and 106/68-point landmark heads are never loaded
+LEAN_MODULES = ['detection', 'recognition']
+
+# ArcFace file of each model pack (other packs: the pack's model with taskname 'recognition')
+_PACK_RECOGNIZERS = {
+    'buffalo_l': 'w600k_r50.onnx',
+    'buffalo_m': 'w600k_r50.onnx',
+    'buffalo_s': 'w600k_mbf.onnx',
+    'buffalo_sc': 'w600k_mbf.onnx',
+    'antelopev2': 'glintr100.onnx'
+}
+
+
+def resolve_model_profile(profile: Optional[str] = None, endpoint: Optional[str] = None) -> str:
+    """
+    Name of the model profile to use: explicit profile, else the profile
+    configured for the endpoint, else the deployment default
+    """
+    name = profile or FACE_CONFIG.get('endpoint_profiles', {}).get(endpoint) or FACE_CONFIG.get('model_profile')
+    if name not in MODEL_PROFILES:
+        logger.warning(f"Unknown model profile '{name}' - using 'accurate'")
+        name = 'accurate'
+    return name
+
+
+def recognizer_key(profile: str) -> str:
+    """Identifies the embedding space of a profile (stored with the face database)"""
+    settings = MODEL_PROFILES[profile]
+    model = settings.get('recognizer_model')
+    return f"{settings['recognizer_pack']}:{os.path.basename(model) if model else 'default'}"
+
+
+def _session_options(settings: Dict):
+    import onnxruntime
+    options = onnxruntime.SessionOptions()
+    intra_op_threads = settings.get('intra_op_threads')
+    if intra_op_threads is None:
+        intra_op_threads = FACE_CONFIG.get('ort_intra_op_threads', 0)
+    if intra_op_threads:
+        options.intra_op_num_threads = intra_op_threads
+    if settings.get('inter_op_threads'):
+        options.inter_op_num_threads = settings['inter_op_threads']
+    level = _GRAPH_OPTIMIZATION_LEVELS[settings.get('graph_optimization', 'all')]
+    options.graph_optimization_level = getattr(onnxruntime.GraphOptimizationLevel, level)
+    options.execution_mode = getattr(onnxruntime.ExecutionMode, _EXECUTION_MODES[settings.get('execution_mode', 'sequential')])
+    return options
+
+
+def _load_model(model_file: str, providers: List[str], options=None):
+    """insightface model object for an .onnx file, optionally with our own SessionOptions"""
+    import onnxruntime
+    from insightface.model_zoo import model_zoo
+    model = model_zoo.get_model(model_file, providers=providers)
+    if model is None:
+        raise RuntimeError(f"Unsupported model file {model_file}")
+    if options is not None:
+        # get_model does not forward SessionOptions, so rebuild the session from the same file
+        model.session = onnxruntime.InferenceSession(model.model_file, sess_options=options, providers=providers)
+    return model
+
+
+def _pack_recognizer_file(pack: str) -> str:
+    """Path of the ArcFace .onnx inside a model pack (downloaded on first use)"""
+    from insightface.utils import ensure_available
+    model_dir = ensure_available('models', pack, root='~/.insightface')
+    known = os.path.join(model_dir, _PACK_RECOGNIZERS.get(pack, ''))
+    if os.path.isfile(known):
+        return known
+    for model_file in sorted(glob.glob(os.path.join(model_dir, '*.onnx'))):
+        model = _load_model(model_file, ['CPUExecutionProvider'])
+        if getattr(model, 'taskname', None) == 'recognition':
+            return model_file
+    raise RuntimeError(f"No recognition model in pack {pack} ({model_dir})")
+
+
+def _apply_session_options(app, settings: Dict, providers: List[str]):
+    """
+    Recreate the ONNX sessions of a FaceAnalysis app with the profile's
+    session options and optional replacement model files
+    
+    insightface does not forward SessionOptions to onnxruntime, so the
+    sessions are rebuilt from the model files when the profile asks for
+    anything other than the onnxruntime defaults.
+    """
+    overrides = {'detection': settings.get('detector_model'), 'recognition': settings.get('recognizer_model')}
+    customized = (
+        settings.get('intra_op_threads') is not None or FACE_CONFIG.get('ort_intra_op_threads', 0)
+        or settings.get('inter_op_threads') or settings.get('graph_optimization', 'all') != 'all'
+        or settings.get('execution_mode', 'sequential') != 'sequential'
+    )
+    if not customized and not any(overrides.values()):
+        return
+    
+    options = _session_options(settings) if customized else None
+    for task, model in list(app.models.items()):
+        if not customized and not overrides.get(task):
+            continue
+        app.models[task] = _load_model(overrides.get(task) or model.model_file, providers, options)
+        if overrides.get(task):
+            logger.info(f"InsightFace {task} model replaced by {overrides[task]}")
+    app.det_model = app.models['detection']
+
+
+def _build_insightface_app(profile: str):
+    """FaceAnalysis app for a profile: detector pack + det_size, recognizer pack, session options"""
+    from insightface.app import FaceAnalysis
+    
+    settings = MODEL_PROFILES[profile]
+    providers = FACE_CONFIG.get('ort_providers') or ['CPUExecutionProvider']
+    ctx_id = 0 if 'CUDAExecutionProvider' in providers else -1
+    
+    same_pack = settings['recognizer_pack'] == settings['detector_pack']
+    app = FaceAnalysis(name=settings['detector_pack'], providers=providers,
+                       allowed_modules=LEAN_MODULES if same_pack else ['detection'])
+    if not same_pack:
+        # FaceAnalysis insists on a detector, so the other pack's recognizer is loaded on its own
+        app.models['recognition'] = _load_model(_pack_recognizer_file(settings['recognizer_pack']), providers)
+    _apply_session_options(app, settings, providers)
+    app.prepare(ctx_id=ctx_id, det_size=tuple(settings['det_size']))
+    return app
+
+
+def get_insightface_app(profile: Optional[str] = None, fallback: bool = True):
+    """
+    Initialize the InsightFace app singleton of a model profile (default: deployment profile)
+    
+    If the profile cannot be built, the 'fast' profile app is returned
+    instead (fallback=False returns None). The fallback is never cached
+    under the failed profile's name.
+    """
+    profile = resolve_model_profile(profile)
+    app = _insightface_apps.get(profile)
+    if app is not None:
+        return app
+    if profile not in _failed_profiles:
+        with _insightface_lock:
+            app = _insightface_apps.get(profile)
+            if app is not None:
+                return app
+            if profile not in _failed_profiles:
+                # Built first and published only once prepared (readers skip the lock)
+                try:
+                    app = _build_insightface_app(profile)
+                    settings = MODEL_PROFILES[profile]
+                    logger.info(f"InsightFace initialized with profile '{profile}' "
+                                f"({settings['detector_pack']} detector {settings['det_size'][0]}x{settings['det_size'][1]}, "
+                                f"{settings['recognizer_pack']} recognizer)")
+                    _insightface_apps[profile] = app
+                    return app
+                except Exception as e:
+                    logger.error(f"Failed to initialize InsightFace profile '{profile}': {e}")
+                    _failed_profiles.add(profile)
+    
+    if not fallback or profile == 'fast':
+        return None
+    # Fallback to the lightest profile
+    app = get_insightface_app('fast', fallback=False)
+    if app is None:
+        logger.error("Failed to initialize InsightFace fallback")
+    else:
+        logger.warning(f"InsightFace profile '{profile}' unavailable - serving with fallback profile 'fast'")
+    return app
 
 
-def extract_face_embedding(image: np.ndarray) -> Optional[np.ndarray]:
+def warm_up_insightface(profiles: Optional[List[str]] = None) -> bool:
+    """
+    Build the InsightFace apps, run one dummy detection and one dummy
+    embedding each (first ONNX runs allocate their buffers), and load the
+    embedding index, so the first real recognition request is fast
+    
+    Args:
+        profiles: Profiles to warm (default: deployment profile + endpoint profiles)
+    
+    Returns:
+        False when the models could not be loaded
+    """
+    if profiles is None:
+        profiles = [resolve_model_profile()] + list(FACE_CONFIG.get('endpoint_profiles', {}).values())
+    for profile in dict.fromkeys(resolve_model_profile(name) for name in profiles):
+        app = get_insightface_app(profile)
+        if app is None:
+            return False
+        blank = np.zeros((640, 640, 3), dtype=np.uint8)
+        app.det_model.detect(blank, max_num=0, metric='default')
+        recognizer = app.models['recognition']
+        _embed_aligned_faces(app, [np.zeros((recognizer.input_size[1], recognizer.input_size[0], 3), dtype=np.uint8)])
+    
+    if not _face_database:
+        load_face_database()
+    index = _get_embedding_index()
+    if index is not None and _use_ann_index(index):
+        _get_ann_index(index, wait=True)
+    return True
+
+
+def extract_face_embedding(image: np.ndarray, profile: Optional[str] = None) -> Optional[np.ndarray]:
     """
     Extract 512-dimensional face embedding from image using ArcFace
     
     Args:
         image: BGR image (OpenCV format)
+        profile: Model profile (default: deployment profile)
     
     Returns:
         512-dim normalized embedding vector or None if no face detected
     """
-    app = get_insightface_app()
+    app = get_insightface_app(profile)
     if app is None:
         return None
     
     try:
-        # Detect and analyze faces
-        faces = app.get(image)
-        
-        if len(faces) == 0:
+        # Detector only, then align and embed just the largest (most prominent) face
+        aligned = _align_largest_face(app, image)
+        if aligned is None:
             logger.warning("No face detected in image")
             return None
         
-        # Get the largest face (most prominent)
-        largest_face = max(faces, key=lambda x: (x.bbox[2] - x.bbox[0]) * (x.bbox[3] - x.bbox[1]))
-        
-        # Return normalized embedding
-        embedding = largest_face.embedding
-        embedding = embedding / np.linalg.norm(embedding)  # L2 normalize
-        
-        return embedding
+        return _embed_aligned_faces(app, [aligned])[0]
         
     except Exception as e:
         logger.error(f"Error extracting face embedding: {e}")
         return None
 
 
-def detect_faces_insightface(image: np.ndarray) -> List[Dict]:
+def _detect(app, image: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Run the SCRFD session only: boxes [N, 5] (x1, y1, x2, y2, score) and keypoints [N, 5, 2]"""
+    bboxes, kpss = app.det_model.detect(image, max_num=0, metric='default')
+    if bboxes is None or len(bboxes) == 0 or kpss is None:
+        return np.zeros((0, 5), dtype=np.float32), np.zeros((0, 5, 2), dtype=np.float32)
+    return bboxes, kpss
+
+
+def _align(app, image: np.ndarray, kps: np.ndarray) -> np.ndarray:
+    """Similarity-transform crop from the 5 keypoints at the recognizer input size"""
+    from insightface.utils import face_align
+    return face_align.norm_crop(image, landmark=kps, image_size=app.models['recognition'].input_size[0])
+
+
+def _align_largest_face(app, image: np.ndarray) -> Optional[np.ndarray]:
+    """Run only the detector and return the aligned crop of the largest face"""
+    bboxes, kpss = _detect(app, image)
+    if len(bboxes) == 0:
+        return None
+    
+    areas = (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])
+    return _align(app, image, kpss[int(np.argmax(areas))])
+
+
+def _embed_aligned_faces(app, aligned_faces: List[np.ndarray]) -> np.ndarray:
+    """Embed aligned 112x112 crops in one batched recognizer call (L2-normalized)"""
+    features = app.models['recognition'].get_feat(aligned_faces)
+    features = np.asarray(features, dtype=np.float32).reshape(len(aligned_faces), -1)
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return features / norms
+
+
+def extract_embeddings_from_files(
+    image_paths: List[str],
+    progress_callback: Optional[Callable[[int, int, str], None]] = None,
+    workers: Optional[int] = None,
+    batch_size: Optional[int] = None
+) -> Dict[str, Optional[np.ndarray]]:
     """
-    Detect faces using InsightFace
+    Batched embedding extraction for training
+    
+    A thread pool decodes images with cv2.imread and runs the detector +
+    alignment (both release the GIL); aligned crops are embedded in batches
+    through the ArcFace ONNX session.
+    
+    Args:
+        image_paths: Image files to embed
+        progress_callback: Called as (done, total, path) after every image
+        workers: Decode/detect threads (default FACE_CONFIG['train_workers'])
+        batch_size: Recognizer batch size (default FACE_CONFIG['train_batch_size'])
     
     Returns:
-        List of face info dicts with bbox, embedding, landmarks
+        {path: normalized embedding of the largest face, or None}
     """
+    results = {path: None for path in image_paths}
+    total = len(image_paths)
+    if total == 0:
+        return results
+    
     app = get_insightface_app()
+    if app is None:
+        return results
+    
+    workers = max(1, workers or FACE_CONFIG.get('train_workers', 1))
+    batch_size = max(1, batch_size or FACE_CONFIG.get('train_batch_size', 32))
+    
+    if 'recognition' not in app.models or getattr(app, 'det_model', None) is None:
+        logger.error("InsightFace model pack has no detection/recognition model - cannot embed")
+        return results
+    
+    def decode_and_align(path):
+        img = cv2.imread(path)
+        if img is None:
+            return path, None
+        try:
+            return path, _align_largest_face(app, img)
+        except Exception as e:
+            logger.warning(f"Face detection failed for {path}: {e}")
+            return path, None
+    
+    pending_paths = []
+    pending_faces = []
+    
+    def flush():
+        if not pending_faces:
+            return
+        embeddings = _embed_aligned_faces(app, pending_faces)
+        for path, embedding in zip(pending_paths, embeddings):
+            results[path] = embedding
+        pending_paths.clear()
+        pending_faces.clear()
+    
+    done = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='face-train') as executor:
+        for path, aligned in executor.map(decode_and_align, image_paths):
+            if aligned is not None:
+                pending_paths.append(path)
+                pending_faces.append(aligned)
+                if len(pending_faces) >= batch_size:
+                    flush()
+            done += 1
+            if progress_callback:
+                progress_callback(done, total, path)
+    flush()
+    
+    return results
+
+
+def detect_faces_insightface(image: np.ndarray, profile: Optional[str] = None,
+                             with_embeddings: bool = True) -> List[Dict]:
+    """
+    Detect faces using InsightFace (detector + recognizer sessions only)
+    
+    Args:
+        with_embeddings: Also embed every face (one batched recognizer call)
+    
+    Returns:
+        List of face info dicts with bbox, normalized embedding, landmarks (5 float keypoints)
+    """
+    app = get_insightface_app(profile)
     if app is None:
         return []
     
     try:
-        faces = app.get(image)
+        bboxes, kpss = _detect(app, image)
+        if len(bboxes) == 0:
+            return []
+        embeddings = [None] * len(bboxes)
+        if with_embeddings:
+            embeddings = _embed_aligned_faces(app, [_align(app, image, kps) for kps in kpss])
         result = []
-        for face in faces:
+        for box, kps, embedding in zip(bboxes, kpss, embeddings):
             result.append({
-                'bbox': face.bbox.astype(int).tolist(),  # [x1, y1, x2, y2]
-                'embedding': face.embedding,
-                'det_score': float(face.det_score),
-                'landmarks': face.kps.astype(int).tolist() if face.kps is not None else None
+                'bbox': box[:4].astype(int).tolist(),  # [x1, y1, x2, y2]
+                'embedding': embedding,
+                'det_score': float(box[4]),
+                # Sub-pixel keypoints: they are fed back into _align (round only for display)
+                'landmarks': kps.astype(float).tolist()
             })
         return result
     except Exception as e:
@@ -125,80 +440,571 @@ def cosine_similarity(embedding1: np.ndarray, embedding2: np.ndarray) -> float:
     return float(np.dot(e1, e2))
 
 
+def _invalidate_embedding_index():
+    """Mark the embedding matrix as stale after _face_database changes"""
+    global _embedding_index
+    _embedding_index = None
+
+
+def _build_embedding_index() -> Optional[Dict]:
+    """
+    Build one contiguous float32 matrix from _face_database
+    
+    Rows are L2-normalized and grouped per identity, so identity i owns
+    rows offsets[i] : offsets[i] + counts[i].
+    
+    Returns:
+        Dict with matrix, owners, offsets, counts and names, or None if empty
+    """
+    names = []
+    blocks = []
+    for name, embeddings in _face_database.items():
+        if embeddings is None or len(embeddings) == 0:
+            continue
+        block = np.asarray(embeddings, dtype=np.float32)
+        names.append(name)
+        blocks.append(block.reshape(len(block), -1))
+    
+    if not blocks:
+        return None
+    
+    matrix = np.ascontiguousarray(np.vstack(blocks), dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    
+    counts = np.array([len(block) for block in blocks], dtype=np.int64)
+    offsets = np.zeros(len(counts), dtype=np.int64)
+    offsets[1:] = np.cumsum(counts)[:-1]
+    owners = np.repeat(np.arange(len(names), dtype=np.int32), counts)
+    
+    return {
+        'matrix': matrix,    # (N, 512) float32, rows normalized
+        'owners': owners,    # (N,) identity index per row
+        'offsets': offsets,  # (K,) first row of each identity
+        'counts': counts,    # (K,) rows per identity
+        'names': names       # (K,) identity names
+    }
+
+
+def _get_embedding_index() -> Optional[Dict]:
+    """Get (and lazily build) the embedding matrix for the current database"""
+    global _embedding_index
+    if _embedding_index is None:
+        _embedding_index = _build_embedding_index()
+    return _embedding_index
+
+
+def _normalize_query(query_embedding: np.ndarray) -> np.ndarray:
+    query = np.asarray(query_embedding, dtype=np.float32).ravel()
+    norm = np.linalg.norm(query)
+    return query / norm if norm > 0 else query
+
+
+def score_identities(query_embedding: np.ndarray, index: Dict) -> np.ndarray:
+    """
+    Score a query against every identity in one matrix-vector product
+    
+    Per identity: SCORE_MAX_WEIGHT * max + SCORE_MEAN_WEIGHT * mean of the
+    cosine similarities with all of its embeddings (segmented reduction).
+    
+    Returns:
+        (K,) array of scores aligned with index['names']
+    """
+    query = _normalize_query(query_embedding)
+    
+    similarities = index['matrix'] @ query
+    max_similarity = np.maximum.reduceat(similarities, index['offsets'])
+    avg_similarity = np.add.reduceat(similarities, index['offsets']) / index['counts']
+    
+    return SCORE_MAX_WEIGHT * max_similarity + SCORE_MEAN_WEIGHT * avg_similarity
+
+
+def score_identities_batch(query_embeddings: np.ndarray, index: Dict) -> np.ndarray:
+    """
+    Score many queries against every identity in one matrix product
+    
+    Same scoring as score_identities, with the segmented reduction run
+    along the row axis of the (Q, N) similarity matrix.
+    
+    Returns:
+        (Q, K) array of scores aligned with index['names']
+    """
+    queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+    norms = np.linalg.norm(queries, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    queries = queries / norms
+    
+    similarities = queries @ index['matrix'].T
+    max_similarity = np.maximum.reduceat(similarities, index['offsets'], axis=1)
+    avg_similarity = np.add.reduceat(similarities, index['offsets'], axis=1) / index['counts']
+    
+    return SCORE_MAX_WEIGHT * max_similarity + SCORE_MEAN_WEIGHT * avg_similarity
+
+
+def score_identity_subset(query_embedding: np.ndarray, index: Dict, identity_ids: np.ndarray) -> np.ndarray:
+    """
+    Same scoring as score_identities, restricted to some identities
+    
+    Only the rows of the given identities are read from the matrix.
+    
+    Returns:
+        Array of scores aligned with identity_ids
+    """
+    query = _normalize_query(query_embedding)
+    identity_ids = np.asarray(identity_ids, dtype=np.int64)
+    if len(identity_ids) == 0:
+        return np.zeros(0, dtype=np.float32)
+    
+    counts = index['counts'][identity_ids]
+    sub_offsets = np.zeros(len(counts), dtype=np.int64)
+    sub_offsets[1:] = np.cumsum(counts)[:-1]
+    rows = np.repeat(index['offsets'][identity_ids] - sub_offsets, counts) + np.arange(int(counts.sum()))
+    
+    similarities = np.asarray(index['matrix'][rows], dtype=np.float32) @ query
+    max_similarity = np.maximum.reduceat(similarities, sub_offsets)
+    avg_similarity = np.add.reduceat(similarities, sub_offsets) / counts
+    
+    return SCORE_MAX_WEIGHT * max_similarity + SCORE_MEAN_WEIGHT * avg_similarity
+
+
+def _identity_centroid_entry(rows: np.ndarray) -> Dict:
+    """
+    Prefilter representatives for one identity
+    
+    The centroid is the normalized mean of its (normalized) rows. When the
+    rows are spread out (1 - |mean| above FACE_CONFIG['centroid_medoid_dispersion'],
+    e.g. with and without glasses) a few medoids are kept as extra
+    representatives so the centroid alone does not hide the identity.
+    """
+    rows = np.asarray(rows, dtype=np.float32)
+    mean = rows.mean(axis=0)
+    length = float(np.linalg.norm(mean))
+    centroid = mean / length if length > 0 else mean
+    
+    medoids = np.zeros((0, rows.shape[1]), dtype=np.float32)
+    max_medoids = min(FACE_CONFIG.get('centroid_max_medoids', 3), len(rows) // 2)
+    if max_medoids > 0 and 1.0 - length > FACE_CONFIG.get('centroid_medoid_dispersion', 0.3):
+        # Farthest-first seeds, then the medoid of each seed's cluster
+        seeds = [int(np.argmin(rows @ centroid))]
+        while len(seeds) < max_medoids:
+            nearest = np.max(rows @ rows[seeds].T, axis=1)
+            seeds.append(int(np.argmin(nearest)))
+        similarity = rows @ rows.T
+        cluster = np.argmax(similarity[:, seeds], axis=1)
+        picked = []
+        for c in range(len(seeds)):
+            members = np.flatnonzero(cluster == c)
+            if len(members):
+                picked.append(members[np.argmax(similarity[np.ix_(members, members)].sum(axis=1))])
+        medoids = rows[picked]
+    
+    return {'centroid': centroid.astype(np.float32), 'count': len(rows), 'medoids': medoids}
+
+
+def _update_identity_centroid(name: str):
+    """Recompute the prefilter entry of one identity after its embeddings changed"""
+    embeddings = _face_database.get(name)
+    entry = None
+    if embeddings is not None and len(embeddings) > 0:
+        rows = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        norms = np.linalg.norm(rows, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        entry = _identity_centroid_entry(rows / norms)
+    with _matcher_lock:
+        if entry is None:
+            _identity_centroids.pop(name, None)
+        else:
+            _identity_centroids[name] = entry
+
+
+def _sync_identity_centroids(index: Dict):
+    """Compute entries for identities that have none yet and drop removed ones (caller holds _matcher_lock)"""
+    names = set(index['names'])
+    for name in [name for name in _identity_centroids if name not in names]:
+        del _identity_centroids[name]
+    
+    for i, name in enumerate(index['names']):
+        entry = _identity_centroids.get(name)
+        if entry is not None and entry['count'] == index['counts'][i]:
+            continue
+        offset, count = index['offsets'][i], index['counts'][i]
+        _identity_centroids[name] = _identity_centroid_entry(index['matrix'][offset:offset + count])
+
+
+def _get_centroid_table(index: Dict) -> Dict:
+    """
+    Stacked prefilter rows for an index snapshot
+    
+    The table is stored in the index dict itself, so a table can never be
+    paired with another generation's names and offsets.
+    
+    Returns:
+        Dict with matrix (R, 512) and offsets (K,): identity i owns the rows
+        from offsets[i] (its centroid first, then any medoids)
+    """
+    table = index.get('centroid_table')
+    if table is not None:
+        return table
+    
+    with _matcher_lock:
+        table = index.get('centroid_table')
+        if table is not None:
+            return table
+        
+        _sync_identity_centroids(index)
+        blocks = []
+        for name in index['names']:
+            entry = _identity_centroids[name]
+            blocks.append(np.vstack([entry['centroid'][None, :], entry['medoids']]))
+        
+        counts = np.array([len(block) for block in blocks], dtype=np.int64)
+        offsets = np.zeros(len(counts), dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)[:-1]
+        table = {
+            'matrix': np.ascontiguousarray(np.vstack(blocks), dtype=np.float32),
+            'offsets': offsets
+        }
+        index['centroid_table'] = table
+    return table
+
+
+def _prefilter_identities(query_embedding: np.ndarray, index: Dict, top_k: int) -> np.ndarray:
+    """Top-k identities by best centroid/medoid similarity"""
+    table = _get_centroid_table(index)
+    similarities = table['matrix'] @ _normalize_query(query_embedding)
+    best = np.maximum.reduceat(similarities, table['offsets'])
+    if len(best) <= top_k:
+        return np.arange(len(best))
+    return np.sort(np.argpartition(-best, top_k - 1)[:top_k])
+
+
+def _use_ann_index(index: Dict) -> bool:
+    """Exact scan for small rosters, IVF-flat candidates above FACE_CONFIG['ann_min_identities']"""
+    min_identities = FACE_CONFIG.get('ann_min_identities', 0)
+    return min_identities > 0 and len(index['names']) >= min_identities
+
+
+def _load_or_build_ann_index(index: Dict):
+    """Load the persisted IVF index for this store generation, or build (and persist) it"""
+    try:
+        checksum = index.get('checksum')
+        ann = IVFFlatIndex.load(_ann_index_path, checksum=checksum) if checksum else None
+        if ann is None:
+            ann = IVFFlatIndex.build(index['matrix'], checksum=checksum or '')
+            logger.info(f"Built ANN index: {ann.n_lists} lists over {ann.rows} embeddings")
+            if checksum:
+                try:
+                    ann.save(_ann_index_path)
+                except Exception as e:
+                    logger.warning(f"Could not persist ANN index: {e}")
+        index['ann'] = ann
+    except Exception as e:
+        logger.error(f"Could not build ANN index - using the centroid/exact path: {e}")
+
+
+def _get_ann_index(index: Dict, wait: bool = False) -> Optional[IVFFlatIndex]:
+    """
+    IVF index of an index snapshot (stored as index['ann'])
+    
+    The first call starts loading/building it on a background thread and
+    returns None; callers use the centroid or exact path until it is ready.
+    
+    Args:
+        wait: Block until the background build has finished
+    """
+    with _matcher_lock:
+        ann = index.get('ann')
+        thread = index.get('ann_thread')
+        if ann is None and thread is None:
+            thread = threading.Thread(target=_load_or_build_ann_index, args=(index,),
+                                      name='ann-index', daemon=True)
+            index['ann_thread'] = thread
+            thread.start()
+    if ann is None and wait:
+        thread.join()
+        ann = index.get('ann')
+    return ann
+
+
+def _score_candidates(query_embedding: np.ndarray, index: Dict) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Score the query against the identities worth scoring
+    
+    Small rosters: every identity (exact). Medium rosters: the top-k
+    identities by centroid similarity. Large rosters: the owners of the ANN
+    top-k rows (centroid top-k until its ANN index is ready). Candidates
+    are re-ranked exactly with score_identity_subset.
+    
+    Returns:
+        Tuple of (identity ids, scores)
+    """
+    if _use_ann_index(index):
+        ann = _get_ann_index(index)
+        if ann is not None:
+            rows = ann.search(
+                index['matrix'], query_embedding,
+                k=FACE_CONFIG.get('ann_candidates', 64),
+                nprobe=FACE_CONFIG.get('ann_nprobe', 8)
+            )
+            identity_ids = np.unique(index['owners'][rows])
+            return identity_ids, score_identity_subset(query_embedding, index, identity_ids)
+    
+    # Below the ANN threshold, or while the ANN index is still being built
+    top_k = FACE_CONFIG.get('centroid_top_k', 0)
+    min_identities = FACE_CONFIG.get('centroid_min_identities', 0)
+    if top_k > 0 and len(index['names']) >= max(min_identities, top_k + 1):
+        identity_ids = _prefilter_identities(query_embedding, index, top_k)
+        return identity_ids, score_identity_subset(query_embedding, index, identity_ids)
+    return np.arange(len(index['names'])), score_identities(query_embedding, index)
+
+
+def _database_from_index(index: Dict) -> Dict[str, np.ndarray]:
+    """Per-identity views into the (memory-mapped) embedding matrix"""
+    return {
+        name: index['matrix'][offset:offset + count]
+        for name, offset, count in zip(index['names'], index['offsets'], index['counts'])
+    }
+
+
+def _header_mtime() -> Optional[int]:
+    try:
+        return os.stat(_database_path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _open_embedding_store(verify: bool = True) -> bool:
+    """Map the current store generation into _face_database/_embedding_index"""
+    global _face_database, _embedding_index, _store_mtime, _face_sources, _training_manifest
+    
+    mtime = _header_mtime()
+    index = _embedding_store.load(verify=verify)
+    if index is None:
+        return False
+    
+    metadata = index.get('metadata', {})
+    row_sources = metadata.get('row_sources') or [None] * len(index['matrix'])
+    
+    _face_database = _database_from_index(index)
+    _face_sources = {
+        name: list(row_sources[offset:offset + count])
+        for name, offset, count in zip(index['names'], index['offsets'], index['counts'])
+    }
+    _training_manifest = dict(metadata.get('manifest', {}))
+    _embedding_index = index
+    _store_mtime = mtime
+    _recognizer_checked.clear()
+    return True
+
+
+def _sources_for(name: str) -> List[Optional[str]]:
+    """Source image per embedding of an identity, padded with None"""
+    sources = list(_face_sources.get(name, []))
+    count = len(_face_database.get(name, []))
+    return (sources + [None] * count)[:count]
+
+
+def _store_metadata(index: Optional[Dict]) -> Dict:
+    """Training manifest and per-row sources, aligned with the index rows"""
+    row_sources = []
+    if index is not None:
+        for name in index['names']:
+            row_sources.extend(_sources_for(name))
+    # Training embeds with the deployment profile's recognizer
+    return {'manifest': _training_manifest, 'row_sources': row_sources,
+            'recognizer': recognizer_key(resolve_model_profile())}
+
+
+def _migrate_legacy_database():
+    """One-time conversion of static/face_embeddings.pkl to the embedding store"""
+    global _face_database, _face_sources, _training_manifest
+    
+    with open(_legacy_database_path, 'rb') as f:
+        _face_database = pickle.load(f)
+    _face_sources = {}
+    _training_manifest = {}
+    _invalidate_embedding_index()
+    logger.info(f"Migrating legacy pickle database ({len(_face_database)} identities) to embedding store")
+    save_face_database()
+
+
 def load_face_database() -> Dict[str, List[np.ndarray]]:
-    """Load face embeddings database from file"""
+    """Load face embeddings database from the memory-mapped store"""
     global _face_database
     
-    if os.path.exists(_database_path):
-        try:
-            with open(_database_path, 'rb') as f:
-                _face_database = pickle.load(f)
+    # Another generation may have changed any identity
+    with _matcher_lock:
+        _identity_centroids.clear()
+    try:
+        if _embedding_store.exists():
+            _open_embedding_store()
             logger.info(f"Loaded face database with {len(_face_database)} identities")
-        except Exception as e:
-            logger.error(f"Error loading face database: {e}")
-            _face_database = {}
+            return _face_database
+        
+        if os.path.exists(_legacy_database_path):
+            _migrate_legacy_database()
+            return _face_database
+    except Exception as e:
+        logger.error(f"Error loading face database: {e}")
+        _face_database = {}
     
+    _invalidate_embedding_index()
     return _face_database
 
 
+def _reload_if_changed():
+    """Re-open the store when another worker has committed a new generation"""
+    if _store_mtime is not None and _header_mtime() != _store_mtime:
+        logger.info("Embedding store changed on disk - reloading")
+        load_face_database()
+
+
 def save_face_database():
-    """Save face embeddings database to file"""
+    """Save face embeddings database as a new store generation (atomic rename)"""
     global _face_database
     try:
-        os.makedirs(os.path.dirname(_database_path), exist_ok=True)
-        with open(_database_path, 'wb') as f:
-            pickle.dump(_face_database, f)
-        logger.info(f"Saved face database with {len(_face_database)} identities")
+        index = _get_embedding_index()
+        generation = _embedding_store.save(index, metadata=_store_metadata(index))
+        # Re-open through mmap so this worker shares pages with the others
+        _open_embedding_store(verify=False)
+        index = _embedding_index
+        if index is not None and _use_ann_index(index):
+            # k-means runs in the background, not in the enrolment request
+            _get_ann_index(index)
+        logger.info(f"Saved face database with {len(_face_database)} identities (generation {generation})")
     except Exception as e:
         logger.error(f"Error saving face database: {e}")
 
 
-def train_insightface_model() -> bool:
+def _scan_face_images(faces_dir: str) -> Dict[str, Tuple[int, int]]:
+    """Map "person/file" -> (mtime_ns, size) for every image under faces_dir"""
+    images = {}
+    for person_name in os.listdir(faces_dir):
+        person_path = os.path.join(faces_dir, person_name)
+        if not os.path.isdir(person_path):
+            continue
+        for img_file in os.listdir(person_path):
+            try:
+                stat = os.stat(os.path.join(person_path, img_file))
+            except OSError:
+                continue
+            images[f"{person_name}/{img_file}"] = (stat.st_mtime_ns, stat.st_size)
+    return images
+
+
+def train_insightface_model(
+    full_rebuild: bool = False,
+    progress_callback: Optional[Callable[[int, int, str], None]] = None
+) -> bool:
     """
-    Train InsightFace model by extracting embeddings from all face images
+    Train InsightFace model by extracting embeddings from face images
     
-    Reads images from static/faces/{name}/ and creates embedding database
+    Reads images from static/faces/{name}/. By default training is
+    incremental: only images that are new or changed since the last run
+    (keyed on path + mtime + size) are embedded, and vectors of changed or
+    deleted images (including deleted folders) are dropped.
+    
+    Args:
+        full_rebuild: Discard the database and re-embed every image
+        progress_callback: Called as (done, total, image) while embedding
     """
-    global _face_database
+    global _face_database, _face_sources, _training_manifest
     
-    faces_dir = 'static/faces'
+    faces_dir = _faces_dir
     if not os.path.exists(faces_dir):
         logger.warning(f"Faces directory not found: {faces_dir}")
         return False
     
-    _face_database = {}
-    total_images = 0
-    
     try:
-        for person_name in os.listdir(faces_dir):
-            person_path = os.path.join(faces_dir, person_name)
-            if not os.path.isdir(person_path):
-                continue
-            
-            embeddings = []
-            
-            for img_file in os.listdir(person_path):
-                img_path = os.path.join(person_path, img_file)
-                
-                # Read image
-                img = cv2.imread(img_path)
-                if img is None:
-                    continue
-                
-                # Extract embedding
-                embedding = extract_face_embedding(img)
-                if embedding is not None:
-                    embeddings.append(embedding)
-                    total_images += 1
-                    logger.debug(f"Processed: {person_name}/{img_file}")
+        current_images = _scan_face_images(faces_dir)
+        
+        if not full_rebuild:
+            if not _face_database:
+                load_face_database()
+            else:
+                _reload_if_changed()
+            if not _training_manifest:
+                # No record of which images were processed (e.g. migrated pickle)
+                logger.info("No training manifest found - running full rebuild")
+                full_rebuild = True
+        
+        database = {}
+        sources = {}
+        manifest = {}
+        dropped = 0
+        
+        if not full_rebuild:
+            manifest = {
+                path: key for path, key in _training_manifest.items()
+                if path in current_images
+            }
+            people_with_images = {path.split('/', 1)[0] for path in current_images}
+            for name, embeddings in _face_database.items():
+                for embedding, source in zip(embeddings, _sources_for(name)):
+                    if source is None:
+                        # Added without an image file: kept only while the person still has a folder
+                        unchanged = name in people_with_images
+                    else:
+                        unchanged = source in current_images and tuple(manifest.get(source, ())) == current_images[source]
+                    if unchanged:
+                        database.setdefault(name, []).append(embedding)
+                        sources.setdefault(name, []).append(source)
+                    else:
+                        dropped += 1
+        
+        pending = sorted(
+            path for path, key in current_images.items()
+            if tuple(manifest.get(path, ())) != key
+        )
+        removed_images = len(_training_manifest) - (len(manifest) if not full_rebuild else 0)
+        logger.info(
+            f"Training ({'full rebuild' if full_rebuild else 'incremental'}): "
+            f"{len(pending)} images to embed, {dropped} stale embeddings dropped"
+        )
+        
+        def report(done, total, img_path):
+            if progress_callback:
+                progress_callback(done, total, os.path.relpath(img_path, faces_dir))
+        
+        embeddings = extract_embeddings_from_files(
+            [os.path.join(faces_dir, rel_path) for rel_path in pending],
+            progress_callback=report
+        )
+        
+        total_images = 0
+        for rel_path in pending:
+            person_name = rel_path.split('/', 1)[0]
+            manifest[rel_path] = list(current_images[rel_path])
             
-            if embeddings:
-                _face_database[person_name] = embeddings
-                logger.info(f"Added {len(embeddings)} embeddings for {person_name}")
+            embedding = embeddings.get(os.path.join(faces_dir, rel_path))
+            if embedding is not None:
+                database.setdefault(person_name, []).append(embedding)
+                sources.setdefault(person_name, []).append(rel_path)
+                total_images += 1
+                logger.debug(f"Processed: {rel_path}")
         
-        if _face_database:
+        changed = full_rebuild or pending or dropped or removed_images
+        with _matcher_lock:
+            if full_rebuild:
+                _identity_centroids.clear()
+            else:
+                for name in set(_face_database) | set(database):
+                    if sources.get(name, []) != _sources_for(name):
+                        _identity_centroids.pop(name, None)
+        _face_database = database
+        _face_sources = sources
+        _training_manifest = manifest
+        _invalidate_embedding_index()
+        
+        if changed:
             save_face_database()
-            logger.info(f"InsightFace model trained with {len(_face_database)} identities, {total_images} images")
+        
+        if _face_database:
+            logger.info(
+                f"InsightFace model trained with {len(_face_database)} identities "
+                f"({total_images} new images embedded)"
+            )
             return True
         else:
             logger.warning("No face data found for training")
@@ -209,67 +1015,240 @@ def train_insightface_model() -> bool:
         return False
 
 
-def identify_face_insightface(image: np.ndarray, threshold: float = 0.45) -> Tuple[str, float]:
+def _check_recognizer(profile: str):
+    """Warn once per profile when its recognizer is not the one the database was built with"""
+    if profile in _recognizer_checked or _embedding_index is None:
+        return
+    _recognizer_checked.add(profile)
+    built_with = _embedding_index.get('metadata', {}).get('recognizer')
+    if built_with and built_with != recognizer_key(profile):
+        logger.warning(f"Model profile '{profile}' uses recognizer {recognizer_key(profile)} but the face "
+                       f"database was built with {built_with} - retrain with full_rebuild")
+
+
+def _ensure_database_index() -> Optional[Dict]:
+    """Load the database if not loaded (or pick up a newer generation) and return its index"""
+    # Load database if not loaded, or pick up a newer generation
+    if not _face_database:
+        load_face_database()
+    else:
+        _reload_if_changed()
+    
+    if not _face_database:
+        logger.warning("Face database is empty")
+        return None
+    
+    index = _get_embedding_index()
+    if index is None:
+        logger.warning("Face database has no embeddings")
+    return index
+
+
+def _match_embedding(query_embedding: np.ndarray, index: Dict, threshold: float) -> Tuple[str, float]:
+    """Best identity for a normalized embedding: (name, confidence %), "Unknown" below threshold"""
+    best_match = "Unknown"
+    best_score = 0.0
+    
+    # Exact matrix-vector scan, or ANN candidates re-ranked exactly for large rosters
+    identity_ids, scores = _score_candidates(query_embedding, index)
+    if len(scores):
+        best_idx = int(np.argmax(scores))
+        if scores[best_idx] > best_score:
+            best_score = float(scores[best_idx])
+            best_match = index['names'][int(identity_ids[best_idx])]
+    
+    return _apply_threshold(best_match, best_score, threshold)
+
+
+def _apply_threshold(best_match: str, best_score: float, threshold: float) -> Tuple[str, float]:
+    """(name, confidence %) for the best score, "Unknown" below threshold"""
+    # Convert to percentage
+    confidence = best_score * 100
+    
+    logger.info(f"Face recognition: {best_match} (confidence: {confidence:.1f}%)")
+    
+    # Apply threshold
+    if confidence < threshold * 100:
+        logger.warning(f"Low confidence ({confidence:.1f}%) - rejecting as Unknown")
+        return ("Unknown", confidence)
+    
+    return (best_match, confidence)
+
+
+def _match_embeddings(query_embeddings: np.ndarray, index: Dict, threshold: float) -> List[Tuple[str, float]]:
+    """
+    _match_embedding for many embeddings at once
+    
+    Below the ANN threshold every query is scored exactly in one matrix
+    product; large rosters keep the per-query ANN candidate search.
+    """
+    if len(query_embeddings) == 0:
+        return []
+    if _use_ann_index(index):
+        return [_match_embedding(query, index, threshold) for query in query_embeddings]
+    
+    scores = score_identities_batch(query_embeddings, index)
+    best_ids = np.argmax(scores, axis=1)
+    results = []
+    for row, best_idx in enumerate(best_ids):
+        best_score = max(float(scores[row, best_idx]), 0.0)
+        best_match = index['names'][int(best_idx)] if best_score > 0 else "Unknown"
+        results.append(_apply_threshold(best_match, best_score, threshold))
+    return results
+
+
+def identify_face_insightface(image: np.ndarray, threshold: float = 0.45,
+                              profile: Optional[str] = None) -> Tuple[str, float]:
     """
     Identify face using InsightFace embeddings
     
     Args:
         image: BGR image (OpenCV format)
         threshold: Minimum cosine similarity for recognition (0.45 = 45%)
+        profile: Model profile (default: deployment profile)
     
     Returns:
         Tuple of (identity_name, confidence_score)
         Returns ("Unknown", 0.0) if no match found
     """
-    global _face_database
-    
-    # Load database if not loaded
-    if not _face_database:
-        load_face_database()
-    
-    if not _face_database:
-        logger.warning("Face database is empty")
+    index = _ensure_database_index()
+    if index is None:
         return ("Unknown", 0.0)
     
     # Extract embedding from input image
-    query_embedding = extract_face_embedding(image)
+    profile = resolve_model_profile(profile)
+    query_embedding = extract_face_embedding(image, profile)
     if query_embedding is None:
         return ("Unknown", 0.0)
     
-    best_match = "Unknown"
-    best_score = 0.0
+    _check_recognizer(profile)
+    return _match_embedding(query_embedding, index, threshold)
+
+
+def identify_aligned_face(image: np.ndarray, landmarks, threshold: float = 0.45,
+                          profile: Optional[str] = None) -> Tuple[str, float]:
+    """
+    Identify a face the detector already located, without another detection pass
     
-    # Compare with all registered faces
-    for person_name, embeddings in _face_database.items():
-        # Calculate average similarity with all embeddings of this person
-        similarities = [cosine_similarity(query_embedding, emb) for emb in embeddings]
-        avg_similarity = np.mean(similarities)
-        max_similarity = np.max(similarities)
-        
-        # Use weighted combination of avg and max for robustness
-        score = 0.7 * max_similarity + 0.3 * avg_similarity
-        
-        if score > best_score:
-            best_score = score
-            best_match = person_name
+    Args:
+        image: Full BGR frame
+        landmarks: The face's 5 keypoints in frame coordinates
+    """
+    index = _ensure_database_index()
+    if index is None:
+        return ("Unknown", 0.0)
     
-    # Convert to percentage
-    confidence = best_score * 100
+    profile = resolve_model_profile(profile)
+    app = get_insightface_app(profile)
+    if app is None:
+        return ("Unknown", 0.0)
     
-    logger.info(f"Face recognition: {best_match} (confidence: {confidence:.1f}%)")
+    try:
+        aligned = _align(app, image, np.asarray(landmarks, dtype=np.float32))
+        query_embedding = _embed_aligned_faces(app, [aligned])[0]
+    except Exception as e:
+        logger.error(f"Error embedding aligned face: {e}")
+        return ("Unknown", 0.0)
     
-    # Apply threshold
-    if confidence < threshold * 100:
-        logger.warning(f"Low confidence ({confidence:.1f}%) - rejecting as Unknown")
-        return ("Unknown", confidence)
+    _check_recognizer(profile)
+    return _match_embedding(query_embedding, index, threshold)
+
+
+def recognize_faces(image: np.ndarray, threshold: float = 0.45, profile: Optional[str] = None,
+                    max_faces: Optional[int] = None) -> List[Dict]:
+    """
+    Detect and identify the faces of a full frame in one pass
     
-    return (best_match, confidence)
+    The detector runs once on the frame; the faces (largest first, at most
+    max_faces) are aligned from their keypoints and embedded in one batched
+    recognizer call.
+    
+    Returns:
+        List of dicts with bbox [x1, y1, x2, y2], det_score, landmarks (float),
+        identity ("Unknown" below threshold) and confidence (%)
+    """
+    return recognize_faces_batch([image], threshold, profile, max_faces)[0]
+
+
+def recognize_faces_batch(images: List[np.ndarray], threshold: float = 0.45, profile: Optional[str] = None,
+                          max_faces: Optional[int] = None, batch_size: Optional[int] = None) -> List[List[Dict]]:
+    """
+    recognize_faces for many images (or many faces per frame) at once
+    
+    The detector still runs per image (SCRFD input is one image), but the
+    faces of all images are embedded together in recognizer calls of
+    batch_size crops and matched in one matrix product.
+    
+    Args:
+        images: BGR images; None entries (undecodable uploads) give no faces
+        max_faces: Per-image limit, largest faces first
+        batch_size: Crops per recognizer call (default FACE_CONFIG['recognize_batch_size'])
+    
+    Returns:
+        One list of face dicts (see recognize_faces) per input image
+    """
+    results = [[] for _ in images]
+    profile = resolve_model_profile(profile)
+    app = get_insightface_app(profile)
+    if app is None:
+        return results
+    
+    # Detection per image; remember the keypoints of every kept face
+    pending = []  # (image index, keypoints)
+    for image_idx, image in enumerate(images):
+        if image is None:
+            continue
+        try:
+            bboxes, kpss = _detect(app, image)
+        except Exception as e:
+            logger.error(f"Error detecting faces in image {image_idx}: {e}")
+            continue
+        if len(bboxes) == 0:
+            continue
+        
+        areas = (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])
+        for i in np.argsort(-areas)[:max_faces]:
+            results[image_idx].append({
+                'bbox': bboxes[i, :4].astype(int).tolist(),
+                'det_score': float(bboxes[i, 4]),
+                'landmarks': kpss[i].astype(float).tolist(),  # Sub-pixel, reusable for _align
+                'identity': 'Unknown',
+                'confidence': 0.0
+            })
+            pending.append((image_idx, kpss[i]))
+    
+    if not pending:
+        return results
+    index = _ensure_database_index()
+    if index is None:
+        return results
+    
+    # Faces in the order they were appended, so embedding j belongs to faces[j]
+    faces = [face for image_faces in results for face in image_faces]
+    batch_size = max(1, batch_size or FACE_CONFIG.get('recognize_batch_size', 32))
+    try:
+        embeddings = []
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            embeddings.append(_embed_aligned_faces(app, [_align(app, images[i], kps) for i, kps in chunk]))
+        embeddings = np.vstack(embeddings)
+    except Exception as e:
+        logger.error(f"Error embedding faces: {e}")
+        return results
+    
+    _check_recognizer(profile)
+    for face, (identity, confidence) in zip(faces, _match_embeddings(embeddings, index, threshold)):
+        face['identity'], face['confidence'] = identity, confidence
+    return results
 
 
 def add_face_to_database(name: str, image: np.ndarray) -> bool:
     """
     Add a single face embedding to the database
     
+    The embedding has no source image; incremental training drops it once
+    static/faces/{name}/ has no images left.
+    
     Args:
         name: Person's identity name
         image: BGR image containing the face
@@ -279,18 +1258,23 @@ def add_face_to_database(name: str, image: np.ndarray) -> bool:
     """
     global _face_database
     
-    if not _face_database:
-        load_face_database()
-    
     embedding = extract_face_embedding(image)
     if embedding is None:
         return False
     
-    if name not in _face_database:
-        _face_database[name] = []
-    
-    _face_database[name].append(embedding)
-    save_face_database()
+    # Another worker may have committed a generation since we loaded ours
+    with _embedding_store.lock():
+        if not _face_database:
+            load_face_database()
+        else:
+            _reload_if_changed()
+        
+        # Stored embeddings may be read-only mmap views, so build a new list
+        _face_sources[name] = _sources_for(name) + [None]
+        _face_database[name] = list(_face_database.get(name, [])) + [embedding]
+        _invalidate_embedding_index()
+        _update_identity_centroid(name)
+        save_face_database()
     
     logger.info(f"Added face embedding for {name} (total: {len(_face_database[name])})")
     return True
@@ -300,14 +1284,20 @@ def remove_face_from_database(name: str) -> bool:
     """Remove all embeddings for a person from the database"""
     global _face_database
     
-    if not _face_database:
-        load_face_database()
-    
-    if name in _face_database:
-        del _face_database[name]
-        save_face_database()
-        logger.info(f"Removed {name} from face database")
-        return True
+    with _embedding_store.lock():
+        if not _face_database:
+            load_face_database()
+        else:
+            _reload_if_changed()
+        
+        if name in _face_database:
+            del _face_database[name]
+            _face_sources.pop(name, None)
+            _invalidate_embedding_index()
+            _update_identity_centroid(name)
+            save_face_database()
+            logger.info(f"Removed {name} from face database")
+            return True
     
     return False
 
@@ -0,0 +1,267 @@
+"""
+Frame Pipeline - Deteksi + tracking wajah untuk loop kamera absensi
+
+Daripada menjalankan deteksi dan ArcFace di setiap frame:
+- Deteksi wajah hanya setiap N frame (detect_every)
+- Di antara deteksi, posisi wajah diikuti dengan template matching murah
+- Recognition hanya dijalankan saat track baru muncul atau kualitas wajah
+  (ukuran x ketajaman) naik cukup jauh dari saat terakhir dikenali
+- Identitas hasil recognition dipakai ulang selama track masih hidup
+- Jika detector juga memberi 5 keypoint, recognition memakai keypoint itu
+  (digeser mengikuti track) sehingga ArcFace tidak perlu deteksi ulang
+- presence_fn opsional (mis. Haar cascade) bisa melewati deteksi saat
+  belum ada wajah sama sekali
+"""
+
+import itertools
+import logging
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+Box = Tuple[int, int, int, int]  # (x, y, w, h)
+
+
+def box_iou(a: Box, b: Box) -> float:
+    """Intersection over union dua box (x, y, w, h)"""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    intersection = ix * iy
+    union = aw * ah + bw * bh - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def face_quality(gray: np.ndarray, box: Box) -> float:
+    """Skor kualitas wajah: sisi terpendek box x ketajaman (variance of Laplacian, 0..1)"""
+    x, y, w, h = box
+    patch = gray[max(y, 0):y + h, max(x, 0):x + w]
+    if patch.size == 0:
+        return 0.0
+    sharpness = float(cv2.Laplacian(patch, cv2.CV_64F).var())
+    return min(w, h) * sharpness / (sharpness + 100.0)
+
+
+def crop_with_margin(frame: np.ndarray, box: Box, margin: float = 0.3) -> np.ndarray:
+    """Crop box dengan margin di sekelilingnya (detector ArcFace butuh konteks wajah)"""
+    x, y, w, h = box
+    dx, dy = int(w * margin), int(h * margin)
+    frame_h, frame_w = frame.shape[:2]
+    x1, y1 = max(x - dx, 0), max(y - dy, 0)
+    x2, y2 = min(x + w + dx, frame_w), min(y + h + dy, frame_h)
+    return frame[y1:y2, x1:x2]
+
+
+class FaceTrack:
+    """Satu wajah yang diikuti antar frame"""
+
+    def __init__(self, track_id: int, box: Box, gray: np.ndarray, frame_index: int, landmarks=None):
+        self.track_id = track_id
+        self.box = tuple(int(v) for v in box)
+        self.landmark_offsets = None  # 5 keypoints relative to the box origin, moved with the box
+        self.template = None
+        self.identity = None  # None = belum pernah dikenali
+        self.confidence = 0.0
+        self.quality = 0.0
+        self.recognized_quality = 0.0
+        self.recognitions = 0
+        self.last_detected = frame_index
+        self.last_recognized = None
+        self.refresh(gray, self.box, landmarks)
+
+    def refresh(self, gray: np.ndarray, box: Box, landmarks=None):
+        """Update box, keypoint, template dan kualitas dari frame saat ini"""
+        self.box = tuple(int(v) for v in box)
+        x, y, w, h = self.box
+        if landmarks is not None:
+            self.landmark_offsets = np.asarray(landmarks, dtype=np.float32) - np.array([x, y], dtype=np.float32)
+        patch = gray[max(y, 0):y + h, max(x, 0):x + w]
+        if patch.size:
+            self.template = patch.copy()
+        self.quality = face_quality(gray, self.box)
+
+    def follow(self, gray: np.ndarray, search_scale: float = 1.0, min_score: float = 0.5) -> bool:
+        """
+        Geser box ke posisi template paling cocok di sekitar posisi lama
+
+        Returns:
+            False jika wajah tidak ditemukan lagi (track hilang)
+        """
+        if self.template is None:
+            return False
+        x, y, w, h = self.box
+        th, tw = self.template.shape[:2]
+        dx, dy = int(w * search_scale), int(h * search_scale)
+        frame_h, frame_w = gray.shape[:2]
+        x1, y1 = max(x - dx, 0), max(y - dy, 0)
+        x2, y2 = min(x + w + dx, frame_w), min(y + h + dy, frame_h)
+        window = gray[y1:y2, x1:x2]
+        if window.shape[0] < th or window.shape[1] < tw:
+            return False
+
+        result = cv2.matchTemplate(window, self.template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, location = cv2.minMaxLoc(result)
+        if score < min_score:
+            return False
+        self.box = (x1 + location[0], y1 + location[1], tw, th)
+        self.quality = face_quality(gray, self.box)
+        return True
+
+    def landmarks(self) -> Optional[np.ndarray]:
+        """Keypoint di koordinat frame untuk posisi box saat ini"""
+        if self.landmark_offsets is None:
+            return None
+        return self.landmark_offsets + np.array(self.box[:2], dtype=np.float32)
+
+    def needs_recognition(self, frame_index: int, quality_gain: float, unknown_retry_frames: int) -> bool:
+        """
+        Track baru, kualitas naik quality_gain kali dari recognition terakhir,
+        atau masih Unknown dan sudah unknown_retry_frames frame sejak dicoba
+        """
+        if self.identity is None:
+            return True
+        if self.quality > self.recognized_quality * quality_gain:
+            return True
+        return self.identity == 'Unknown' and frame_index - self.last_recognized >= unknown_retry_frames
+
+    def snapshot(self, recognized: bool = False) -> Dict:
+        return {
+            'track_id': self.track_id,
+            'box': self.box,
+            'identity': self.identity or 'Unknown',
+            'confidence': self.confidence,
+            'quality': round(self.quality, 2),
+            'recognitions': self.recognitions,
+            'recognized': recognized
+        }
+
+
+class FramePipeline:
+    """
+    Pipeline per-frame: detect setiap N frame, track di antaranya,
+    recognize hanya untuk track baru / track yang kualitasnya membaik.
+
+    detect_fn(frame) -> list box (x, y, w, h), atau dict {'box', 'landmarks'}
+    recognize_fn(face_bgr) -> (identity, confidence) untuk crop wajah
+    landmark_recognize_fn(frame, landmarks) -> (identity, confidence), dipakai
+        bila track punya keypoint (tanpa crop dan tanpa deteksi ulang)
+    presence_fn(frame) -> bool, gate murah sebelum deteksi saat belum ada track
+    """
+
+    def __init__(self, detect_fn: Callable[[np.ndarray], Sequence],
+                 recognize_fn: Optional[Callable[[np.ndarray], Tuple[str, float]]] = None,
+                 detect_every: int = 5, quality_gain: float = 1.25,
+                 iou_threshold: float = 0.3, max_missed_detections: int = 2,
+                 max_recognitions: int = 5, unknown_retry_frames: int = 15,
+                 landmark_recognize_fn: Optional[Callable[[np.ndarray, np.ndarray], Tuple[str, float]]] = None,
+                 presence_fn: Optional[Callable[[np.ndarray], bool]] = None):
+        self.detect_fn = detect_fn
+        self.recognize_fn = recognize_fn
+        self.landmark_recognize_fn = landmark_recognize_fn
+        self.presence_fn = presence_fn
+        self.detect_every = max(1, detect_every)
+        self.quality_gain = quality_gain
+        self.iou_threshold = iou_threshold
+        self.max_missed_detections = max_missed_detections
+        self.max_recognitions = max_recognitions
+        self.unknown_retry_frames = unknown_retry_frames
+        self.tracks: List[FaceTrack] = []
+        self.frame_index = 0
+        self._track_ids = itertools.count(1)
+        self.stats = {'frames': 0, 'detections': 0, 'gated': 0, 'recognitions': 0, 'tracks_created': 0}
+
+    def reset(self):
+        self.tracks = []
+
+    def _detect(self, frame: np.ndarray, gray: np.ndarray):
+        self.stats['detections'] += 1
+        boxes, landmarks = [], []
+        for detection in self.detect_fn(frame):
+            if isinstance(detection, dict):
+                boxes.append(tuple(int(v) for v in detection['box']))
+                landmarks.append(detection.get('landmarks'))
+            else:
+                boxes.append(tuple(int(v) for v in detection))
+                landmarks.append(None)
+
+        # Greedy IoU matching, best pairs first
+        pairs = sorted(
+            ((box_iou(track.box, box), t, b) for t, track in enumerate(self.tracks) for b, box in enumerate(boxes)),
+            reverse=True
+        )
+        matched_tracks, matched_boxes = set(), set()
+        for iou, t, b in pairs:
+            if iou < self.iou_threshold:
+                break
+            if t in matched_tracks or b in matched_boxes:
+                continue
+            matched_tracks.add(t)
+            matched_boxes.add(b)
+            self.tracks[t].refresh(gray, boxes[b], landmarks[b])
+            self.tracks[t].last_detected = self.frame_index
+
+        missed_limit = self.max_missed_detections * self.detect_every
+        self.tracks = [
+            track for t, track in enumerate(self.tracks)
+            if t in matched_tracks or self.frame_index - track.last_detected <= missed_limit
+        ]
+        for b, box in enumerate(boxes):
+            if b not in matched_boxes:
+                self.tracks.append(FaceTrack(next(self._track_ids), box, gray, self.frame_index, landmarks[b]))
+                self.stats['tracks_created'] += 1
+
+    def process(self, frame: np.ndarray) -> List[Dict]:
+        """
+        Proses satu frame BGR
+
+        Returns:
+            Snapshot per track aktif (track_id, box, identity, confidence,
+            quality, recognized=True jika recognition dijalankan di frame ini)
+        """
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        self.stats['frames'] += 1
+
+        if self.frame_index % self.detect_every == 0 or not self.tracks:
+            if not self.tracks and self.presence_fn is not None and not self.presence_fn(frame):
+                # Nobody in front of the camera: skip the full detector
+                self.stats['gated'] += 1
+            else:
+                self._detect(frame, gray)
+        else:
+            self.tracks = [track for track in self.tracks if track.follow(gray)]
+
+        snapshots = []
+        for track in self.tracks:
+            recognized = False
+            if track.recognitions < self.max_recognitions and track.needs_recognition(
+                    self.frame_index, self.quality_gain, self.unknown_retry_frames):
+                landmarks = track.landmarks() if self.landmark_recognize_fn is not None else None
+                face = crop_with_margin(frame, track.box) if landmarks is None else frame
+                if face.size:
+                    if landmarks is not None:
+                        identity, confidence = self.landmark_recognize_fn(frame, landmarks)
+                    else:
+                        identity, confidence = self.recognize_fn(face)
+                    track.recognitions += 1
+                    track.recognized_quality = track.quality
+                    track.last_recognized = self.frame_index
+                    # An Unknown result from a later view does not erase a known identity
+                    if track.identity in (None, 'Unknown') or identity != 'Unknown':
+                        track.identity = identity
+                        track.confidence = confidence
+                    recognized = True
+                    self.stats['recognitions'] += 1
+            snapshots.append(track.snapshot(recognized))
+
+        self.frame_index += 1
+        return snapshots
+
+    def primary_track(self, snapshots: List[Dict]) -> Optional[Dict]:
+        """Track dengan wajah terbesar (orang yang paling dekat ke kamera)"""
+        if not snapshots:
+            return None
+        return max(snapshots, key=lambda track: track['box'][2] * track['box'][3])
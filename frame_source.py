@@ -0,0 +1,291 @@
+"""
+Frame Source - Sumber frame dengan thread producer terpisah dari recognition
+
+Producer thread terus membaca frame (kamera, file video, atau folder gambar)
+dan hanya menyimpan frame terbaru. Consumer (loop deteksi/recognition)
+mengambil frame dengan read() sesuai kecepatannya sendiri, sehingga
+inference yang lambat tidak membuat buffer kamera basi.
+
+Counter: captured, delivered, dropped (frame tertimpa sebelum diambil)
+dan latency capture -> read.
+"""
+
+import os
+import time
+import threading
+import logging
+from typing import Dict, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+class FrameSource:
+    """
+    Basis sumber frame threaded (latest-frame slot).
+
+    Subclass mengimplementasikan _open(), _grab() dan _close(). Jika
+    drop_frames=False producer menunggu sampai frame diambil (lossless,
+    untuk test dengan video/folder gambar).
+    """
+
+    def __init__(self, name: str, drop_frames: bool = True, fps: Optional[float] = None):
+        self.name = name
+        self.drop_frames = drop_frames
+        self.fps = fps  # Pace the producer (file/folder sources); None = as fast as the source
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+        self.ended = False
+        self._frame = None
+        self._frame_time = 0.0
+        self._sequence = 0
+        self._delivered_sequence = 0
+        self._stats = {'captured': 0, 'delivered': 0, 'dropped': 0, 'read_errors': 0}
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+        self._started_at = None
+
+    # Subclass hooks
+    def _open(self) -> bool:
+        raise NotImplementedError
+
+    def _grab(self) -> Optional[np.ndarray]:
+        """Frame berikutnya, atau None jika stream habis/gagal"""
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+    def start(self) -> bool:
+        """Buka sumber dan jalankan producer thread"""
+        if self.running:
+            return True
+        if not self._open():
+            logger.warning(f"Frame source {self.name} tidak dapat dibuka")
+            return False
+        self.running = True
+        self.ended = False
+        self._started_at = time.time()
+        self.thread = threading.Thread(target=self._produce, name=f"frame-source-{self.name}", daemon=True)
+        self.thread.start()
+        return True
+
+    def _produce(self):
+        interval = 1.0 / self.fps if self.fps else 0.0
+        next_time = time.time()
+        try:
+            while self.running:
+                frame = self._grab()
+                if frame is None:
+                    break
+                with self.condition:
+                    if not self.drop_frames:
+                        while self.running and self._sequence > self._delivered_sequence:
+                            self.condition.wait(0.1)
+                    elif self._sequence > self._delivered_sequence:
+                        self._stats['dropped'] += 1
+                    self._frame = frame
+                    self._frame_time = time.time()
+                    self._sequence += 1
+                    self._stats['captured'] += 1
+                    self.condition.notify_all()
+                if interval:
+                    next_time += interval
+                    delay = next_time - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        next_time = time.time()
+        except Exception as e:
+            logger.error(f"Frame source {self.name} producer error: {e}")
+        finally:
+            with self.condition:
+                self.ended = True
+                self.condition.notify_all()
+
+    def read(self, timeout: float = 1.0) -> Tuple[Optional[np.ndarray], Dict]:
+        """
+        Ambil frame terbaru yang belum pernah diambil
+
+        Returns:
+            Tuple (frame, info) - frame None jika timeout atau stream selesai.
+            info berisi sequence dan latency_ms (umur frame saat diambil)
+        """
+        deadline = time.time() + timeout
+        with self.condition:
+            while self._sequence <= self._delivered_sequence:
+                remaining = deadline - time.time()
+                if self.ended or remaining <= 0:
+                    return None, {'ended': self.ended}
+                self.condition.wait(remaining)
+
+            latency = time.time() - self._frame_time
+            self._delivered_sequence = self._sequence
+            self._stats['delivered'] += 1
+            self._latency_total += latency
+            self._latency_max = max(self._latency_max, latency)
+            frame = self._frame
+            self.condition.notify_all()
+            return frame, {'sequence': self._sequence, 'latency_ms': round(latency * 1000, 1)}
+
+    def stop(self):
+        """Hentikan producer dan tutup sumber"""
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2)
+        self.thread = None
+        self._close()
+
+    def get_stats(self) -> Dict:
+        """Counter captured/delivered/dropped dan latency rata-rata/maksimum"""
+        with self.condition:
+            stats = dict(self._stats)
+            delivered = stats['delivered']
+            elapsed = time.time() - self._started_at if self._started_at else 0.0
+            stats.update({
+                'source': self.name,
+                'avg_latency_ms': round(1000 * self._latency_total / delivered, 1) if delivered else 0.0,
+                'max_latency_ms': round(1000 * self._latency_max, 1),
+                'capture_fps': round(stats['captured'] / elapsed, 1) if elapsed else 0.0,
+                'delivered_fps': round(delivered / elapsed, 1) if elapsed else 0.0
+            })
+            return stats
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+class CameraSource(FrameSource):
+    """Kamera (cv2.VideoCapture) dengan buffer driver minimal"""
+
+    def __init__(self, camera_id: int = 0, max_read_errors: int = 10):
+        super().__init__(f"camera:{camera_id}", drop_frames=True)
+        self.camera_id = camera_id
+        self.max_read_errors = max_read_errors
+        self.cap = None
+
+    def _open(self) -> bool:
+        self.cap = cv2.VideoCapture(self.camera_id)
+        if not self.cap.isOpened():
+            self.cap.release()
+            self.cap = None
+            return False
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return True
+
+    def _grab(self) -> Optional[np.ndarray]:
+        errors = 0
+        while self.running:
+            ret, frame = self.cap.read()
+            if ret:
+                return frame
+            errors += 1
+            self._stats['read_errors'] += 1
+            if errors >= self.max_read_errors:
+                logger.warning(f"Camera {self.camera_id}: {errors} consecutive read errors")
+                return None
+            time.sleep(0.01)
+        return None
+
+    def _close(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+
+class VideoFileSource(FrameSource):
+    """File video; realtime=True memutar sesuai FPS file dan membuang frame seperti kamera"""
+
+    def __init__(self, path: str, realtime: bool = True, loop: bool = False):
+        super().__init__(f"video:{os.path.basename(path)}", drop_frames=realtime)
+        self.path = path
+        self.realtime = realtime
+        self.loop = loop
+        self.cap = None
+
+    def _open(self) -> bool:
+        self.cap = cv2.VideoCapture(self.path)
+        if not self.cap.isOpened():
+            return False
+        if self.realtime:
+            self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        return True
+
+    def _grab(self) -> Optional[np.ndarray]:
+        ret, frame = self.cap.read()
+        if not ret and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read()
+        return frame if ret else None
+
+    def _close(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+
+class ImageDirectorySource(FrameSource):
+    """Folder gambar (urut nama file) sebagai stream frame, untuk test tanpa kamera"""
+
+    def __init__(self, directory: str, fps: Optional[float] = None, loop: bool = False):
+        # Without a frame rate every image is delivered (lossless)
+        super().__init__(f"images:{os.path.basename(os.path.normpath(directory))}",
+                         drop_frames=fps is not None, fps=fps)
+        self.directory = directory
+        self.loop = loop
+        self.paths = []
+        self.position = 0
+
+    def _open(self) -> bool:
+        if not os.path.isdir(self.directory):
+            return False
+        self.paths = sorted(
+            os.path.join(self.directory, name) for name in os.listdir(self.directory)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        self.position = 0
+        return bool(self.paths)
+
+    def _grab(self) -> Optional[np.ndarray]:
+        # At most one full pass: a looping folder with no readable image ends the source
+        for _ in range(len(self.paths)):
+            if self.position >= len(self.paths):
+                if not self.loop:
+                    return None
+                self.position = 0
+            path = self.paths[self.position]
+            self.position += 1
+            frame = cv2.imread(path)
+            if frame is not None:
+                return frame
+            self._stats['read_errors'] += 1
+            logger.warning(f"Cannot read image {path}")
+        if self.paths and self.loop:
+            logger.error(f"No readable image in {self.directory}")
+        return None
+
+
+def open_frame_source(source: Union[int, str], realtime: bool = True) -> FrameSource:
+    """
+    Buat FrameSource dari camera id, path file video, atau folder gambar
+
+    Args:
+        source: Camera id (int / string angka), path video, atau folder gambar
+        realtime: Untuk video/folder: putar sesuai FPS dan buang frame (seperti kamera)
+    """
+    if isinstance(source, int) or (isinstance(source, str) and source.isdigit()):
+        return CameraSource(int(source))
+    if os.path.isdir(source):
+        return ImageDirectorySource(source, fps=30.0 if realtime else None)
+    return VideoFileSource(source, realtime=realtime)
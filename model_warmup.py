@@ -0,0 +1,89 @@
+"""
+Model Warmup - Memanaskan model wajah di background saat startup
+
+Membuat session ONNX InsightFace memakan beberapa detik. Tanpa warm-up,
+waktu itu ditanggung karyawan pertama di kiosk. ModelWarmup menjalankan
+warm_fn di thread terpisah saat aplikasi start dan mencatat status
+kesiapan yang dibaca oleh /health dan /health/ready:
+
+- warming   warm-up sedang berjalan
+- ready     inferensi sudah panas
+- degraded  model tidak bisa dimuat (request tetap dilayani, tanpa jaminan latency)
+"""
+
+import threading
+import time
+import logging
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+WARMING = 'warming'
+READY = 'ready'
+DEGRADED = 'degraded'
+
+
+class ModelWarmup:
+    """Warm-up sekali jalan di background thread dengan status kesiapan"""
+
+    def __init__(self, warm_fn: Callable[[], bool]):
+        self.warm_fn = warm_fn
+        self.lock = threading.Lock()
+        self.thread = None
+        self.state = WARMING
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+
+    def start(self):
+        """Mulai warm-up (sekali saja)"""
+        with self.lock:
+            if self.thread is not None or self.state == DEGRADED:
+                return
+            self.started_at = time.time()
+            self.thread = threading.Thread(target=self._run, name='model-warmup', daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        logger.info("🔥 Warming up face recognition model...")
+        try:
+            ok = self.warm_fn()
+            error = None if ok else 'Model wajah tidak bisa dimuat'
+        except Exception as e:
+            ok, error = False, str(e)
+        with self.lock:
+            self.finished_at = time.time()
+            self.state = READY if ok else DEGRADED
+            self.error = error
+            elapsed = self.finished_at - self.started_at
+        if ok:
+            logger.info(f"✅ Face recognition model ready ({elapsed:.1f}s)")
+        else:
+            logger.error(f"Model warm-up gagal, status degraded: {error}")
+
+    def mark_degraded(self, reason: str):
+        """Tandai degraded tanpa warm-up (mis. InsightFace tidak terinstall)"""
+        with self.lock:
+            self.state = DEGRADED
+            self.error = reason
+
+    def is_ready(self) -> bool:
+        with self.lock:
+            return self.state == READY
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Tunggu sampai warm-up selesai; True jika ready"""
+        thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+        return self.is_ready()
+
+    def get_status(self) -> Dict:
+        with self.lock:
+            status = {'state': self.state, 'error': self.error}
+            if self.started_at is not None:
+                end = self.finished_at or time.time()
+                status['started_at'] = datetime.fromtimestamp(self.started_at).isoformat()
+                status['warmup_seconds'] = round(end - self.started_at, 2)
+        return status
@@ -4,6 +4,12 @@ Berisi class-class untuk mengelola data karyawan dan absensi
 """
 
 from database import get_db_manager
+from employee_directory import employee_directory
+from attendance_rollup import attendance_rollup
+from report_cache import report_cache
+from event_bus import event_bus
+from activity_log_writer import ActivityLogWriter
+from config import ACTIVITY_LOG_CONFIG
 from datetime import datetime, date, time, timedelta
 import logging
 
@@ -24,6 +30,8 @@ class Employee:
             result = db.execute_query(query, (name, bagian, email, phone, gender, address, 
                                              position, status, hire_date, nik))
             if result:
+                employee_directory.invalidate()
+                report_cache.invalidate_employee()
                 logger.info(f"Karyawan {name} ({bagian}) berhasil ditambahkan")
                 return True
             return False
@@ -31,6 +39,18 @@ class Employee:
             logger.error(f"Gagal menambah karyawan: {e}")
             return False
     
+    @staticmethod
+    def get_employee_by_id(employee_id):
+        """Mendapatkan data karyawan berdasarkan ID"""
+        try:
+            db = get_db_manager()
+            query = "SELECT * FROM employees WHERE id = %s"
+            result = db.execute_query(query, (employee_id,))
+            return result[0] if result else None
+        except Exception as e:
+            logger.error(f"Gagal mendapatkan data karyawan by ID: {e}")
+            return None
+    
     @staticmethod
     def get_employee_by_name_bagian(name, bagian):
         """Mendapatkan data karyawan berdasarkan nama dan bagian"""
@@ -43,6 +63,18 @@ class Employee:
             logger.error(f"Gagal mendapatkan data karyawan: {e}")
             return None
     
+    @staticmethod
+    def get_employee_by_name(name):
+        """Mendapatkan data karyawan berdasarkan nama (baris pertama urut nama)"""
+        try:
+            db = get_db_manager()
+            query = "SELECT * FROM employees WHERE name = %s ORDER BY id LIMIT 1"
+            result = db.execute_query(query, (name,))
+            return result[0] if result else None
+        except Exception as e:
+            logger.error(f"Gagal mendapatkan data karyawan by nama: {e}")
+            return None
+    
     @staticmethod
     def get_employee_by_nik(nik):
         """Mendapatkan data karyawan berdasarkan NIK"""
@@ -86,6 +118,9 @@ class Employee:
             
             # Hapus employee
             result = db.execute_query("DELETE FROM employees WHERE id = %s", (employee_id,))
+            employee_directory.invalidate()
+            report_cache.invalidate_employee(employee_id)
+            attendance_rollup.schedule_employee(employee_id)
             
             if result > 0:
                 logger.info(f"Employee ID {employee_id} berhasil dihapus")
@@ -99,59 +134,84 @@ class Employee:
 class Attendance:
     """Model untuk data absensi"""
     
+    # Upsert on unique_attendance(employee_id, tanggal). Jam yang sudah terisi
+    # tidak ditimpa (COALESCE); total_jam_kerja dihitung di SQL sebelum jam
+    # diisi, karena assignment ON DUPLICATE KEY UPDATE dievaluasi berurutan.
+    UPSERT_QUERY = """
+    INSERT INTO attendance (employee_id, tanggal, jam_masuk, jam_pulang, total_jam_kerja)
+    VALUES (
+        %(employee_id)s, %(tanggal)s, CAST(%(jam_masuk)s AS TIME), CAST(%(jam_pulang)s AS TIME),
+        IF(CAST(%(jam_pulang)s AS TIME) > CAST(%(jam_masuk)s AS TIME),
+           TIMEDIFF(CAST(%(jam_pulang)s AS TIME), CAST(%(jam_masuk)s AS TIME)), NULL)
+    )
+    ON DUPLICATE KEY UPDATE
+        total_jam_kerja = IF(
+            COALESCE(jam_pulang, CAST(%(jam_pulang)s AS TIME)) > COALESCE(jam_masuk, CAST(%(jam_masuk)s AS TIME)),
+            TIMEDIFF(COALESCE(jam_pulang, CAST(%(jam_pulang)s AS TIME)), COALESCE(jam_masuk, CAST(%(jam_masuk)s AS TIME))),
+            total_jam_kerja
+        ),
+        jam_masuk = COALESCE(jam_masuk, CAST(%(jam_masuk)s AS TIME)),
+        jam_pulang = COALESCE(jam_pulang, CAST(%(jam_pulang)s AS TIME))
+    """
+    
     @staticmethod
-    def add_or_update_attendance(employee_id, tanggal, jam_masuk=None, jam_pulang=None):
-        """Menambah atau update data absensi"""
+    def record_attendance(employee_id, tanggal, jam_masuk=None, jam_pulang=None):
+        """
+        Catat jam masuk/pulang secara atomic (INSERT ... ON DUPLICATE KEY UPDATE)
+        
+        Aman untuk dua kiosk yang melihat orang yang sama bersamaan: unique key
+        menjamin hanya satu baris dan jam yang sudah ada tidak ditimpa.
+        
+        Returns:
+            Tuple (status, row): status 'inserted', 'updated', 'unchanged'
+            (jam sudah tercatat) atau 'error'; row adalah baris akhir
+        """
         try:
             db = get_db_manager()
+            params = {
+                'employee_id': employee_id,
+                'tanggal': tanggal,
+                'jam_masuk': jam_masuk.replace(microsecond=0) if isinstance(jam_masuk, time) else jam_masuk,
+                'jam_pulang': jam_pulang.replace(microsecond=0) if isinstance(jam_pulang, time) else jam_pulang
+            }
+            rowcount, rows = db.execute_write_and_fetch(
+                Attendance.UPSERT_QUERY, params,
+                "SELECT * FROM attendance WHERE employee_id = %s AND tanggal = %s",
+                (employee_id, tanggal)
+            )
+            if rowcount is None:
+                return 'error', None
             
-            # Cek apakah sudah ada record untuk hari ini
-            existing = Attendance.get_attendance_by_employee_date(employee_id, tanggal)
-            
-            if existing:
-                # Update existing record
-                updates = []
-                params = []
-                
-                if jam_masuk and not existing['jam_masuk']:
-                    updates.append("jam_masuk = %s")
-                    params.append(jam_masuk)
-                
-                if jam_pulang and not existing['jam_pulang']:
-                    updates.append("jam_pulang = %s")
-                    params.append(jam_pulang)
-                
-                if updates:
-                    # Hitung total jam kerja jika ada jam masuk dan pulang
-                    if jam_pulang and existing['jam_masuk']:
-                        total_jam = Attendance.calculate_work_hours(existing['jam_masuk'], jam_pulang)
-                        updates.append("total_jam_kerja = %s")
-                        params.append(total_jam)
-                    elif jam_masuk and existing['jam_pulang']:
-                        total_jam = Attendance.calculate_work_hours(jam_masuk, existing['jam_pulang'])
-                        updates.append("total_jam_kerja = %s")
-                        params.append(total_jam)
-                    
-                    params.extend([employee_id, tanggal])
-                    query = f"UPDATE attendance SET {', '.join(updates)} WHERE employee_id = %s AND tanggal = %s"
-                    result = db.execute_query(query, params)
-                    return result > 0
-            else:
-                # Insert new record
-                query = """
-                INSERT INTO attendance (employee_id, tanggal, jam_masuk, jam_pulang, total_jam_kerja) 
-                VALUES (%s, %s, %s, %s, %s)
-                """
-                total_jam = None
-                if jam_masuk and jam_pulang:
-                    total_jam = Attendance.calculate_work_hours(jam_masuk, jam_pulang)
-                
-                result = db.execute_query(query, (employee_id, tanggal, jam_masuk, jam_pulang, total_jam))
-                return result > 0
-                
+            # MySQL affected rows: 1 = insert, 2 = update, 0 = row unchanged
+            status = {1: 'inserted', 2: 'updated'}.get(rowcount, 'unchanged')
+            if status != 'unchanged':
+                report_cache.invalidate_attendance(employee_id, [tanggal])
+                attendance_rollup.schedule_day(employee_id, tanggal)
+                Attendance.publish_change(status, employee_id, tanggal, rows[0] if rows else None)
+            return status, rows[0] if rows else None
         except Exception as e:
-            logger.error(f"Gagal menambah/update absensi: {e}")
-            return False
+            logger.error(f"Gagal mencatat absensi: {e}")
+            return 'error', None
+    
+    @staticmethod
+    def publish_change(action, employee_id, tanggal, row=None):
+        """Publish delta absensi ke event bus (live feed SSE)"""
+        employee = employee_directory.get_by_id(employee_id) or Employee.get_employee_by_id(employee_id) or {}
+        event_bus.publish('attendance', {
+            'action': action,  # inserted / updated / deleted
+            'employee_id': employee_id,
+            'name': employee.get('name'),
+            'bagian': employee.get('bagian'),
+            'tanggal': tanggal,
+            'jam_masuk': row.get('jam_masuk') if row else None,
+            'jam_pulang': row.get('jam_pulang') if row else None
+        })
+    
+    @staticmethod
+    def add_or_update_attendance(employee_id, tanggal, jam_masuk=None, jam_pulang=None):
+        """Menambah atau update data absensi"""
+        status, _ = Attendance.record_attendance(employee_id, tanggal, jam_masuk, jam_pulang)
+        return status in ('inserted', 'updated')
     
     @staticmethod
     def get_attendance_by_employee_date(employee_id, tanggal):
@@ -247,6 +307,9 @@ class Attendance:
             result = db.execute_query("DELETE FROM attendance WHERE employee_id = %s AND tanggal = %s", 
                                     (employee_id, tanggal))
             if result > 0:
+                report_cache.invalidate_attendance(employee_id, [tanggal])
+                attendance_rollup.schedule_day(employee_id, tanggal)
+                Attendance.publish_change('deleted', employee_id, tanggal)
                 logger.info(f"Attendance deleted for employee_id {employee_id} on {tanggal}")
                 return True
             return False
@@ -260,16 +323,32 @@ class ActivityLog:
     
     @staticmethod
     def add_log(employee_id, activity_type, description=""):
-        """Menambah log aktivitas"""
+        """Menambah log aktivitas (write-behind, ditulis batch oleh activity_log_writer)"""
         try:
-            db = get_db_manager()
-            query = "INSERT INTO activity_log (employee_id, activity_type, description) VALUES (%s, %s, %s)"
-            result = db.execute_query(query, (employee_id, activity_type, description))
-            return result > 0
+            return activity_log_writer.submit(employee_id, activity_type, description)
         except Exception as e:
             logger.error(f"Gagal menambah log aktivitas: {e}")
             return False
     
+    @staticmethod
+    def add_logs(events):
+        """Tulis banyak log aktivitas dalam satu multi-row INSERT"""
+        if not events:
+            return True
+        try:
+            db = get_db_manager()
+            placeholders = ", ".join(["(%s, %s, %s, %s)"] * len(events))
+            query = f"INSERT INTO activity_log (employee_id, activity_type, description, created_at) VALUES {placeholders}"
+            params = []
+            for event in events:
+                params.extend([event['employee_id'], event['activity_type'],
+                               event.get('description', ''), event['created_at']])
+            result = db.execute_query(query, params)
+            return bool(result)
+        except Exception as e:
+            logger.error(f"Gagal menulis batch log aktivitas: {e}")
+            return False
+    
     @staticmethod
     def get_recent_logs(limit=50):
         """Mendapatkan log aktivitas terbaru"""
@@ -285,4 +364,13 @@ class ActivityLog:
             return db.execute_query(query, (limit,))
         except Exception as e:
             logger.error(f"Gagal mendapatkan log aktivitas: {e}")
-            return []
\ No newline at end of file
+            return []
+
+
+# Instance global write-behind writer untuk activity_log
+activity_log_writer = ActivityLogWriter(
+    ActivityLog.add_logs,
+    max_queue=ACTIVITY_LOG_CONFIG['max_queue'],
+    batch_size=ACTIVITY_LOG_CONFIG['batch_size'],
+    flush_interval_ms=ACTIVITY_LOG_CONFIG['flush_interval_ms']
+)
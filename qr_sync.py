@@ -2,78 +2,190 @@
 QR Sync Manager - Handles cross-device synchronization for QR code authentication
 """
 
+import atexit
+import heapq
 import threading
 import time
 import json
 import os
 from datetime import datetime, timedelta
 
+from event_bus import event_bus
+from state_backend import state_backend
+
 # File untuk menyimpan device-employee associations (persistent)
 DEVICE_DATA_FILE = os.path.join(os.path.dirname(__file__), 'data', 'device_registry.json')
+DEVICE_JOURNAL_FILE = DEVICE_DATA_FILE[:-len('.json')] + '.journal'
 
 class DeviceRegistry:
     """
     Menyimpan asosiasi antara device ID dengan employee.
-    Data disimpan ke file JSON agar persistent.
+    
+    Storage: snapshot JSON (DEVICE_DATA_FILE) + journal append-only
+    (DEVICE_JOURNAL_FILE, satu operasi JSON per baris). Saat load, journal
+    di-replay di atas snapshot. Jika journal sudah panjang, snapshot ditulis
+    ulang (tmp + fsync + atomic rename) dan journal dikosongkan.
+    
+    Lookup tidak menyentuh disk: last_seen hanya diupdate di memori dan
+    di-flush ke journal sebagai satu record gabungan setiap flush_interval detik.
     """
     
-    def __init__(self):
+    def __init__(self, data_file=DEVICE_DATA_FILE, journal_file=DEVICE_JOURNAL_FILE,
+                 flush_interval=30, compact_after=1000):
+        self.data_file = data_file
+        self.journal_file = journal_file
+        self.flush_interval = flush_interval
+        self.compact_after = compact_after  # Journal records before the snapshot is rewritten
         self.devices = {}  # {device_id: {employee_id, employee_name, nik, last_seen, ...}}
         self.lock = threading.Lock()
+        self.io_lock = threading.Lock()  # Serializes journal appends and compaction
+        self.journal_records = 0
+        self.seen_dirty = {}  # {device_id: last_seen} not yet written to the journal
+        self.flush_thread = None
+        self.stopped = threading.Event()
         self._load_from_file()
     
     def _load_from_file(self):
-        """Load device data from JSON file"""
+        """Load snapshot, then replay the journal on top of it"""
         try:
-            if os.path.exists(DEVICE_DATA_FILE):
-                with open(DEVICE_DATA_FILE, 'r') as f:
+            if os.path.exists(self.data_file):
+                with open(self.data_file, 'r') as f:
                     self.devices = json.load(f)
-                print(f"[DeviceRegistry] Loaded {len(self.devices)} registered devices")
         except Exception as e:
             print(f"[DeviceRegistry] Error loading device data: {e}")
             self.devices = {}
+        
+        torn = False
+        try:
+            if os.path.exists(self.journal_file):
+                with open(self.journal_file, 'r') as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            # Torn last line from a crash mid-append
+                            torn = True
+                            continue
+                        self._apply(record)
+                        self.journal_records += 1
+        except Exception as e:
+            print(f"[DeviceRegistry] Error replaying device journal: {e}")
+        if torn:
+            # Rewrite now so the next append doesn't land on the torn line
+            with self.io_lock:
+                self._compact()
+        print(f"[DeviceRegistry] Loaded {len(self.devices)} registered devices")
+    
+    def _apply(self, record):
+        op = record.get('op')
+        if op == 'put':
+            self.devices[record['id']] = record['data']
+        elif op == 'del':
+            self.devices.pop(record['id'], None)
+        elif op == 'seen':
+            for device_id, last_seen in record['ids'].items():
+                if device_id in self.devices:
+                    self.devices[device_id]['last_seen'] = last_seen
     
-    def _save_to_file(self):
-        """Save device data to JSON file"""
+    def _append(self, records):
+        """Append journal records (fsync'd); compacts when the journal gets long"""
+        if not records:
+            return
+        with self.io_lock:
+            try:
+                os.makedirs(os.path.dirname(self.journal_file), exist_ok=True)
+                with open(self.journal_file, 'a') as f:
+                    f.write(''.join(json.dumps(record, default=str) + '\n' for record in records))
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.journal_records += len(records)
+            except Exception as e:
+                print(f"[DeviceRegistry] Error writing device journal: {e}")
+                return
+            if self.journal_records >= self.compact_after:
+                self._compact()
+    
+    def _compact(self):
+        """Write a fresh snapshot (atomic rename) and empty the journal; io_lock must be held"""
+        with self.lock:
+            snapshot = json.dumps(self.devices, indent=2, default=str)
         try:
-            os.makedirs(os.path.dirname(DEVICE_DATA_FILE), exist_ok=True)
-            with open(DEVICE_DATA_FILE, 'w') as f:
-                json.dump(self.devices, f, indent=2, default=str)
+            tmp_path = self.data_file + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(snapshot)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.data_file)
+            # Replaying the old journal over the new snapshot is harmless, so a crash here loses nothing
+            with open(self.journal_file, 'w') as f:
+                f.flush()
+                os.fsync(f.fileno())
+            self.journal_records = 0
         except Exception as e:
-            print(f"[DeviceRegistry] Error saving device data: {e}")
+            print(f"[DeviceRegistry] Error compacting device data: {e}")
+    
+    def _ensure_flush_thread(self):
+        # Caller holds self.lock
+        if self.flush_thread is None and not self.stopped.is_set():
+            self.flush_thread = threading.Thread(target=self._flush_loop, name='device-registry-flush', daemon=True)
+            self.flush_thread.start()
+    
+    def _flush_loop(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+    
+    def flush(self):
+        """Tulis last_seen yang tertunda ke journal sebagai satu record"""
+        with self.lock:
+            dirty, self.seen_dirty = self.seen_dirty, {}
+        if dirty:
+            self._append([{'op': 'seen', 'ids': dirty}])
+    
+    def close(self):
+        """Flush last_seen dan compact (dipanggil saat aplikasi berhenti)"""
+        self.stopped.set()
+        self.flush()
+        with self.io_lock:
+            if self.journal_records:
+                self._compact()
     
     def register_device(self, device_id, employee_id, employee_name, nik=None):
         """Register a device with an employee"""
+        data = {
+            'employee_id': employee_id,
+            'employee_name': employee_name,
+            'nik': nik,
+            'registered_at': datetime.now().isoformat(),
+            'last_seen': datetime.now().isoformat()
+        }
         with self.lock:
-            self.devices[device_id] = {
-                'employee_id': employee_id,
-                'employee_name': employee_name,
-                'nik': nik,
-                'registered_at': datetime.now().isoformat(),
-                'last_seen': datetime.now().isoformat()
-            }
-            self._save_to_file()
-            print(f"[DeviceRegistry] Device {device_id[:8]}... registered to {employee_name}")
-            return True
+            self.devices[device_id] = data
+            self.seen_dirty.pop(device_id, None)
+        self._append([{'op': 'put', 'id': device_id, 'data': data}])
+        print(f"[DeviceRegistry] Device {device_id[:8]}... registered to {employee_name}")
+        return True
     
     def get_employee_by_device(self, device_id):
-        """Get employee info by device ID"""
+        """Get employee info by device ID (no disk I/O; last_seen is flushed later)"""
         with self.lock:
             if device_id in self.devices:
                 # Update last seen
-                self.devices[device_id]['last_seen'] = datetime.now().isoformat()
-                self._save_to_file()
+                last_seen = datetime.now().isoformat()
+                self.devices[device_id]['last_seen'] = last_seen
+                self.seen_dirty[device_id] = last_seen
+                self._ensure_flush_thread()
                 return self.devices[device_id]
             return None
     
     def unregister_device(self, device_id):
         """Remove device registration"""
         with self.lock:
-            if device_id in self.devices:
-                del self.devices[device_id]
-                self._save_to_file()
-                return True
-            return False
+            if device_id not in self.devices:
+                return False
+            del self.devices[device_id]
+            self.seen_dirty.pop(device_id, None)
+        self._append([{'op': 'del', 'id': device_id}])
+        return True
     
     def get_devices_by_employee(self, employee_id):
         """Get all devices registered to an employee"""
@@ -87,6 +199,44 @@ class DeviceRegistry:
 
 # Global device registry instance
 device_registry = DeviceRegistry()
+atexit.register(device_registry.close)
+
+
+class _SessionStripe:
+    """
+    One partition of the QR sessions, chosen by hashing the unit code.
+    Each stripe has its own lock, so kiosks polling different codes never
+    wait on each other.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = {}  # {session_id: {verified: bool, timestamp: datetime, ...}}
+        self.by_code = {}  # {code: {session_id: None}} in creation order
+        self.latest_verified = {}  # {code: session_id of the most recently verified session}
+        self.expiry_heap = []  # [(timestamp, session_id)] oldest first, stale entries skipped lazily
+
+
+def _verified_time(data):
+    return data.get('verified_at', data.get('timestamp'))
+
+
+def _auth_record(session_id, data):
+    """Verified session as stored in the state backend (JSON-safe)"""
+    record = dict(data, session_id=session_id)
+    for field in ('timestamp', 'verified_at'):
+        if isinstance(record.get(field), datetime):
+            record[field] = record[field].isoformat()
+    return record
+
+
+def _auth_from_record(record):
+    data = dict(record)
+    for field in ('timestamp', 'verified_at'):
+        if data.get(field):
+            data[field] = datetime.fromisoformat(data[field])
+    data['unit_code'] = data.get('code')  # Add unit_code field for compatibility
+    return data
 
 
 class QRSyncManager:
@@ -94,143 +244,259 @@ class QRSyncManager:
     Manages QR code sessions and cross-device synchronization.
     When a mobile device scans a QR code, the laptop browser should
     automatically detect the verification and redirect.
+    
+    Sessions are striped by unit code. Each stripe keeps indexes
+    code -> session ids and code -> latest verified session, plus an
+    expiry heap, so lookups and cleanup never scan every session.
+    
+    The latest verified session of each code is also published to the
+    shared state backend (key qr_auth:<code>), and per-code auth checks
+    read it from there, so a scan handled by one worker is seen by a
+    laptop polling another worker.
     """
     
-    def __init__(self):
-        self.sessions = {}  # {session_id: {verified: bool, timestamp: datetime, ...}}
-        self.lock = threading.Lock()
+    def __init__(self, stripes=16, backend=None):
+        self.backend = backend or state_backend
+        self.stripes = [_SessionStripe() for _ in range(stripes)]
+        self.session_codes = {}  # {session_id: code} to find the stripe of a session id
+        self.registry_lock = threading.Lock()  # Innermost lock: never held while taking a stripe lock
         self.cleanup_interval = 180  # Optimized: 5 minutes → 3 minutes
-        
+    
+    def _stripe(self, code):
+        return self.stripes[hash(code) % len(self.stripes)]
+    
+    def _locate(self, session_id):
+        with self.registry_lock:
+            code = self.session_codes.get(session_id)
+        return self._stripe(code) if code is not None else None
+    
+    # --- Helpers below are called with the stripe lock held ---
+    
+    def _add(self, stripe, session_id, data):
+        code = data['code']
+        stripe.sessions[session_id] = data
+        stripe.by_code.setdefault(code, {})[session_id] = None
+        heapq.heappush(stripe.expiry_heap, (data['timestamp'], session_id))
+        if data.get('verified'):
+            self._index_verified(stripe, session_id)
+        with self.registry_lock:
+            self.session_codes[session_id] = code
+    
+    def _remove(self, stripe, session_id):
+        data = stripe.sessions.pop(session_id, None)
+        if data is None:
+            return False
+        code = data['code']
+        code_sessions = stripe.by_code.get(code)
+        if code_sessions is not None:
+            code_sessions.pop(session_id, None)
+            if not code_sessions:
+                del stripe.by_code[code]
+        if stripe.latest_verified.get(code) == session_id:
+            # Fall back to the next most recent verified session of this code
+            del stripe.latest_verified[code]
+            for other_id in stripe.by_code.get(code, ()):
+                if stripe.sessions[other_id].get('verified', False):
+                    self._index_verified(stripe, other_id)
+            replacement_id = stripe.latest_verified.get(code)
+            replacement = _auth_record(replacement_id, stripe.sessions[replacement_id]) if replacement_id else None
+            # Only touch the shared record if it still points at the removed session
+            self.backend.update(
+                self._auth_key(code),
+                lambda current: replacement if current and current.get('session_id') == session_id else current,
+                ttl=self.cleanup_interval
+            )
+        with self.registry_lock:
+            if self.session_codes.get(session_id) == code:
+                del self.session_codes[session_id]
+        return True
+    
+    def _index_verified(self, stripe, session_id):
+        data = stripe.sessions[session_id]
+        current_id = stripe.latest_verified.get(data['code'])
+        if current_id is None or _verified_time(data) > _verified_time(stripe.sessions[current_id]):
+            stripe.latest_verified[data['code']] = session_id
+    
+    def _verify(self, stripe, session_id, **fields):
+        data = stripe.sessions[session_id]
+        data['verified'] = True
+        data['verified_at'] = datetime.now()
+        data.update(fields)
+        self._index_verified(stripe, session_id)
+        self._publish_auth(session_id, data)
+    
+    @staticmethod
+    def _auth_key(code):
+        return f"qr_auth:{code}"
+    
+    def _publish_auth(self, session_id, data):
+        """Store a verified session as the shared latest auth of its code, unless a newer one is there"""
+        record = _auth_record(session_id, data)
+        self.backend.update(
+            self._auth_key(data['code']),
+            lambda current: record if current is None or current['verified_at'] <= record['verified_at'] else current,
+            ttl=self.cleanup_interval
+        )
+    
+    def _first_session_id(self, stripe, code):
+        code_sessions = stripe.by_code.get(code)
+        return next(iter(code_sessions)) if code_sessions else None
+    
+    # --- Public API ---
+    
     def create_session(self, session_id, code=None):
         """Create a new QR session"""
-        with self.lock:
-            self.sessions[session_id] = {
+        code = code or session_id[:6].upper()
+        # A re-created session id replaces the old session (possibly in another stripe)
+        self.remove_session(session_id)
+        stripe = self._stripe(code)
+        with stripe.lock:
+            self._add(stripe, session_id, {
                 'verified': False,
                 'timestamp': datetime.now(),
-                'code': code or session_id[:6].upper(),
+                'code': code,
                 'device_info': None
-            }
-        return self.sessions[session_id]['code']
+            })
+        return code
     
     def verify_session(self, session_id=None, code=None):
         """Mark a session as verified (called when mobile scans QR)"""
-        with self.lock:
-            # Find session by code if session_id not provided
-            if code and not session_id:
-                for sid, data in self.sessions.items():
-                    if data.get('code') == code.upper():
-                        session_id = sid
-                        break
-            
-            if session_id and session_id in self.sessions:
-                self.sessions[session_id]['verified'] = True
-                self.sessions[session_id]['verified_at'] = datetime.now()
-                return True
-        return False
+        if code and not session_id:
+            stripe = self._stripe(code.upper())
+            with stripe.lock:
+                session_id = self._first_session_id(stripe, code.upper())
+                if session_id is None:
+                    return False
+                self._verify(stripe, session_id)
+        else:
+            stripe = self._locate(session_id) if session_id else None
+            if stripe is None:
+                return False
+            with stripe.lock:
+                if session_id not in stripe.sessions:
+                    return False
+                self._verify(stripe, session_id)
+        event_bus.publish('qr', {'action': 'verified'})
+        return True
     
     def check_session(self, session_id):
         """Check if a session has been verified"""
-        with self.lock:
-            if session_id in self.sessions:
-                return self.sessions[session_id].get('verified', False)
-        return False
+        data = self.get_session(session_id)
+        return data.get('verified', False) if data else False
     
     def get_session(self, session_id):
         """Get session data"""
-        with self.lock:
-            return self.sessions.get(session_id, None)
+        stripe = self._locate(session_id)
+        if stripe is None:
+            return None
+        with stripe.lock:
+            return stripe.sessions.get(session_id, None)
     
     def get_session_by_code(self, code):
         """Find session by verification code"""
-        with self.lock:
-            for session_id, data in self.sessions.items():
-                if data.get('code') == code.upper():
-                    return session_id, data
+        stripe = self._stripe(code.upper())
+        with stripe.lock:
+            session_id = self._first_session_id(stripe, code.upper())
+            if session_id is not None:
+                return session_id, stripe.sessions[session_id]
         return None, None
     
     def remove_session(self, session_id):
         """Remove a session"""
-        with self.lock:
-            if session_id in self.sessions:
-                del self.sessions[session_id]
+        stripe = self._locate(session_id)
+        if stripe is not None:
+            with stripe.lock:
+                self._remove(stripe, session_id)
     
     def clear_unit_code_sessions(self, unit_code):
         """Remove ALL sessions associated with a unit code"""
-        with self.lock:
-            to_remove = []
-            for session_id, data in self.sessions.items():
-                if data.get('code') == unit_code.upper():
-                    to_remove.append(session_id)
+        code = unit_code.upper()
+        stripe = self._stripe(code)
+        with stripe.lock:
+            to_remove = list(stripe.by_code.get(code, ()))
             for session_id in to_remove:
-                del self.sessions[session_id]
-            return len(to_remove)
+                self._remove(stripe, session_id)
+        # Also drops a verification made through another worker
+        shared_cleared = self.backend.delete(self._auth_key(code))
+        if to_remove or shared_cleared:
+            event_bus.publish('qr', {'action': 'cleared'})
+        return len(to_remove)
     
     def cleanup_old_sessions(self):
-        """Remove sessions older than cleanup_interval"""
-        with self.lock:
-            now = datetime.now()
-            expired = []
-            for session_id, data in self.sessions.items():
-                if now - data['timestamp'] > timedelta(seconds=self.cleanup_interval):
-                    expired.append(session_id)
-            for session_id in expired:
-                del self.sessions[session_id]
-        return len(expired)
+        """Remove sessions older than cleanup_interval (oldest first from each stripe's heap)"""
+        cutoff = datetime.now() - timedelta(seconds=self.cleanup_interval)
+        removed = 0
+        for stripe in self.stripes:
+            with stripe.lock:
+                heap = stripe.expiry_heap
+                while heap and heap[0][0] < cutoff:
+                    timestamp, session_id = heapq.heappop(heap)
+                    data = stripe.sessions.get(session_id)
+                    # Skip heap entries of sessions already removed or re-created
+                    if data is not None and data['timestamp'] == timestamp:
+                        self._remove(stripe, session_id)
+                        removed += 1
+        return removed
     
     def get_latest_auth(self, unit_code=None):
-        """Get the latest authenticated session for a unit code"""
-        with self.lock:
-            latest = None
-            latest_time = None
-            for session_id, data in self.sessions.items():
-                if data.get('verified', False):
-                    # If unit_code specified, filter by it
-                    if unit_code and data.get('code') != unit_code.upper():
+        """Get the latest authenticated session for a unit code (shared across workers)"""
+        if unit_code:
+            record = self.backend.get(self._auth_key(unit_code.upper()))
+            return _auth_from_record(record) if record else None
+        
+        # Without a unit code only this worker's sessions are searched
+        latest = None
+        for stripe in self.stripes:
+            with stripe.lock:
+                for session_id in stripe.latest_verified.values():
+                    data = stripe.sessions.get(session_id)
+                    if data is None:
                         continue
-                    verified_at = data.get('verified_at', data.get('timestamp'))
-                    if latest_time is None or verified_at > latest_time:
+                    if latest is None or _verified_time(data) > _verified_time(latest):
                         latest = data.copy()
                         latest['unit_code'] = data.get('code')  # Add unit_code field for compatibility
-                        latest_time = verified_at
-            return latest
+        return latest
     
     def verify_qr_auth(self, code, device_info=None, employee_info=None, device_id=None):
         """Verify QR auth by code (called when mobile scans QR)"""
-        with self.lock:
-            code_upper = code.upper()
+        code_upper = code.upper()
+        stripe = self._stripe(code_upper)
+        with stripe.lock:
             # Find existing session by code
-            found = False
-            for session_id, data in self.sessions.items():
-                if data.get('code') == code_upper:
-                    self.sessions[session_id]['verified'] = True
-                    self.sessions[session_id]['verified_at'] = datetime.now()
-                    self.sessions[session_id]['device_info'] = device_info
-                    self.sessions[session_id]['employee_info'] = employee_info
-                    self.sessions[session_id]['device_id'] = device_id
-                    found = True
-                    break
-            
-            # If no session found, create one
-            if not found:
-                session_id = f"mobile_{code_upper}_{datetime.now().timestamp()}"
-                self.sessions[session_id] = {
+            session_id = self._first_session_id(stripe, code_upper)
+            if session_id is not None:
+                self._verify(stripe, session_id, device_info=device_info,
+                             employee_info=employee_info, device_id=device_id)
+            else:
+                # If no session found, create one
+                now = datetime.now()
+                session_id = f"mobile_{code_upper}_{now.timestamp()}"
+                self._add(stripe, session_id, {
                     'verified': True,
-                    'timestamp': datetime.now(),
-                    'verified_at': datetime.now(),
+                    'timestamp': now,
+                    'verified_at': now,
                     'code': code_upper,
                     'device_info': device_info,
                     'employee_info': employee_info,
                     'device_id': device_id
-                }
-            return True
+                })
+                self._publish_auth(session_id, stripe.sessions[session_id])
+        event_bus.publish('qr', {'action': 'verified'})
+        return True
 
     def is_authenticated(self, unit_code):
-        """Check if a unit code has been authenticated"""
-        with self.lock:
-            for session_id, data in self.sessions.items():
-                if data.get('code') == unit_code.upper() and data.get('verified', False):
-                    return True
-        return False
+        """Check if a unit code has been authenticated (shared across workers)"""
+        return self.backend.get(self._auth_key(unit_code.upper())) is not None
+    
+    def get_stats(self):
+        """Session, unit code and heap entry counts across all stripes"""
+        stats = {'sessions': 0, 'codes': 0, 'heap_entries': 0, 'stripes': len(self.stripes)}
+        for stripe in self.stripes:
+            with stripe.lock:
+                stats['sessions'] += len(stripe.sessions)
+                stats['codes'] += len(stripe.by_code)
+                stats['heap_entries'] += len(stripe.expiry_heap)
+        return stats
 
 
 # Global instance
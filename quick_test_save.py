@@ -64,4 +64,4 @@ except Exception as e:
 
 print("\n🎉 Test selesai!")
 print(f"Cek folder: {faces_dir}")
-print("Cek file model: static/face_embeddings.pkl")
+print("Cek file model: static/face_embeddings.json")
@@ -0,0 +1,265 @@
+"""
+Report Cache - Cache hasil query laporan dan statistik dashboard
+
+Entry disimpan per key dengan TTL dan eviction LRU. Setiap entry diberi
+tag tanggal (setiap hari dalam periode laporan), tag karyawan, dan tag
+'employees' untuk hasil yang bergantung pada daftar karyawan. Write absensi
+meng-invalidate tag tanggal/karyawan yang bersangkutan saja; perubahan data
+karyawan meng-invalidate tag 'employees'.
+
+Cache tetap per proses; setiap invalidasi juga ditambahkan ke log bersama
+di state backend, dan worker lain menerapkan tag yang sama sebelum lookup
+berikutnya. Worker yang tertinggal lebih jauh dari panjang log mengosongkan
+seluruh cache-nya.
+"""
+
+import threading
+import time
+import logging
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, Optional
+
+from config import REPORT_CACHE_CONFIG
+from state_backend import state_backend
+
+logger = logging.getLogger(__name__)
+
+EMPLOYEES_TAG = ('employees',)
+ALL_DATES_TAG = ('date', '*')
+INVALIDATION_LOG_KEY = 'report_cache:invalidations'
+
+
+def _as_date(value) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value), '%Y-%m-%d').date()
+
+
+class ReportCache:
+    """Cache key -> hasil, thread-safe, dengan TTL, LRU dan index tag"""
+
+    def __init__(self, max_entries: int = 256, ttl: float = 300, max_date_tags: int = 366,
+                 backend=None, log_size: int = 100):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_date_tags = max_date_tags  # Longer periods are tagged ALL_DATES_TAG instead of per day
+        self.backend = backend  # Shared invalidation log; None = this process only
+        self.log_size = log_size
+        self._log_seq = None  # Last shared invalidation applied here
+        self._own_seqs = set()  # Published by this process, already applied locally
+        self.lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, expires_at, tags), oldest first
+        self._tag_index = {}  # tag -> set of keys
+        self._version = 0  # Bumped by every invalidation; results computed across one are not stored
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'expired': 0, 'invalidated': 0,
+                      'remote_invalidations': 0, 'sync_errors': 0}
+
+    def date_tags(self, start_date, end_date=None) -> set:
+        """Tag ('date', 'YYYY-MM-DD') untuk setiap hari dalam periode (inklusif)"""
+        start = _as_date(start_date)
+        end = _as_date(end_date) if end_date is not None else start
+        days = (end - start).days + 1
+        if days > self.max_date_tags:
+            return {ALL_DATES_TAG}
+        return {('date', (start + timedelta(days=offset)).isoformat()) for offset in range(max(days, 0))}
+
+    def get(self, key):
+        """(True, value) jika ada dan belum expired, selain itu (False, None)"""
+        self._sync()
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.time():
+                self._remove(key)
+                self.stats['expired'] += 1
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return True, entry[0]
+
+    def get_or_compute(self, key, compute_fn: Callable, ttl: Optional[float] = None,
+                       date_range=None, employee_ids: Iterable = (), tags: Iterable = (),
+                       cache_if: Optional[Callable] = None):
+        """
+        Nilai dari cache, atau hitung dengan compute_fn() lalu simpan
+
+        Args:
+            date_range: Tuple (start, end) periode yang dibaca hasil ini
+            employee_ids: Karyawan yang datanya dibaca hasil ini
+            tags: Tag tambahan, mis. EMPLOYEES_TAG
+            cache_if: Predicate hasil; False = jangan disimpan (mis. response error)
+        """
+        found, value = self.get(key)
+        if found:
+            return value
+
+        with self.lock:
+            version = self._version
+        value = compute_fn()
+        if cache_if is not None and not cache_if(value):
+            return value
+
+        entry_tags = set(tags)
+        if date_range is not None:
+            entry_tags |= self.date_tags(*date_range)
+        entry_tags |= {('employee', int(employee_id)) for employee_id in employee_ids}
+        self.set(key, value, ttl=ttl, tags=entry_tags, version=version)
+        return value
+
+    def set(self, key, value, ttl: Optional[float] = None, tags: Iterable = (), version: Optional[int] = None):
+        with self.lock:
+            if version is not None and version != self._version:
+                # Something was invalidated while this value was being computed
+                return
+            if key in self._entries:
+                self._remove(key)
+            tags = frozenset(tags)
+            self._entries[key] = (value, time.time() + (self.ttl if ttl is None else ttl), tags)
+            for tag in tags:
+                self._tag_index.setdefault(tag, set()).add(key)
+            self.stats['stores'] += 1
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.stats['evictions'] += 1
+
+    def _remove(self, key):
+        # Caller holds self.lock
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tag_index[tag]
+
+    def _invalidate_local(self, tags: Iterable) -> int:
+        # Caller holds self.lock
+        self._version += 1
+        keys = set()
+        for tag in tags:
+            keys |= self._tag_index.get(tag, set())
+        for key in keys:
+            self._remove(key)
+        self.stats['invalidated'] += len(keys)
+        return len(keys)
+
+    def _clear_local(self) -> int:
+        # Caller holds self.lock
+        self._version += 1
+        count = len(self._entries)
+        self._entries.clear()
+        self._tag_index.clear()
+        self.stats['invalidated'] += count
+        return count
+
+    def _publish(self, tags: Optional[Iterable]):
+        """Tambahkan invalidasi ke log bersama (tags None = kosongkan semua)"""
+        if self.backend is None:
+            return
+        event_tags = [list(tag) for tag in tags] if tags is not None else None
+
+        def append(log):
+            log = log or {'seq': 0, 'events': []}
+            seq = log['seq'] + 1
+            return {'seq': seq, 'events': (log['events'] + [[seq, event_tags]])[-self.log_size:]}
+
+        try:
+            log = self.backend.update(INVALIDATION_LOG_KEY, append)
+        except Exception as e:
+            logger.warning(f"Report cache: invalidasi tidak terkirim ke worker lain: {e}")
+            with self.lock:
+                self.stats['sync_errors'] += 1
+            return
+        with self.lock:
+            self._own_seqs.add(log['seq'])
+
+    def _sync(self):
+        """Terapkan invalidasi dari worker lain yang belum diterapkan di proses ini"""
+        if self.backend is None:
+            return
+        try:
+            log = self.backend.get(INVALIDATION_LOG_KEY)
+        except Exception as e:
+            logger.warning(f"Report cache: log invalidasi tidak terbaca: {e}")
+            with self.lock:
+                self.stats['sync_errors'] += 1
+            return
+        seq = log['seq'] if log else 0
+        with self.lock:
+            last, self._log_seq = self._log_seq, seq
+            if last is None or seq == last:
+                # First lookup in this process: nothing cached yet that could be stale
+                return
+            events = [event for event in log['events'] if event[0] > last] if log else []
+            if seq < last or not events or events[0][0] != last + 1:
+                # Log was reset or has moved past what this process saw
+                self._clear_local()
+                self._own_seqs.clear()
+                self.stats['remote_invalidations'] += 1
+                return
+            for event_seq, tags in events:
+                if event_seq in self._own_seqs:
+                    continue
+                if tags is None:
+                    self._clear_local()
+                else:
+                    self._invalidate_local(tuple(tag) for tag in tags)
+                self.stats['remote_invalidations'] += 1
+            self._own_seqs = {own for own in self._own_seqs if own > seq}
+
+    def invalidate_tags(self, tags: Iterable) -> int:
+        """Hapus semua entry yang memiliki salah satu tag; mengembalikan jumlah entry"""
+        tags = set(tags)
+        with self.lock:
+            count = self._invalidate_local(tags)
+        self._publish(tags)
+        return count
+
+    def invalidate_attendance(self, employee_id=None, dates: Optional[Iterable] = None) -> int:
+        """Invalidate setelah absensi seorang karyawan berubah pada tanggal tertentu"""
+        if dates is None:
+            return self.clear()
+        tags = {ALL_DATES_TAG}
+        try:
+            for value in dates:
+                tags |= self.date_tags(value)
+        except (TypeError, ValueError):
+            # Unparseable date: drop everything rather than risk a stale report
+            return self.clear()
+        if employee_id is not None:
+            tags.add(('employee', int(employee_id)))
+        return self.invalidate_tags(tags)
+
+    def invalidate_employee(self, employee_id=None) -> int:
+        """Invalidate setelah data karyawan berubah (tambah/update/hapus)"""
+        tags = {EMPLOYEES_TAG}
+        if employee_id is not None:
+            tags.add(('employee', int(employee_id)))
+        return self.invalidate_tags(tags)
+
+    def clear(self) -> int:
+        with self.lock:
+            count = self._clear_local()
+        self._publish(None)
+        return count
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+            stats['tags'] = len(self._tag_index)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        return stats
+
+
+# Instance global report cache
+report_cache = ReportCache(REPORT_CACHE_CONFIG['max_entries'], REPORT_CACHE_CONFIG['ttl'], backend=state_backend)
@@ -0,0 +1,337 @@
+"""
+Report Export - Export laporan absensi secara streaming
+
+- Query laporan membaca rollup harian (attendance_rollup.py) dan baris
+  diambil lewat server-side cursor (DatabaseManager.stream_query)
+- CSV, JSON dan NDJSON dikirim sebagai chunk selagi baris dibaca
+- Excel ditulis dengan openpyxl write-only (memori konstan)
+- Rentang besar dan Excel dirender ke file cache lalu dikirim dengan
+  send_file(conditional=True), sehingga download bisa di-resume (Range)
+"""
+
+import os
+import csv
+import json
+import time
+import hashlib
+import threading
+import logging
+from io import StringIO
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from config import EXPORT_CONFIG
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {
+    'csv': ('csv', 'text/csv; charset=utf-8'),
+    'json': ('json', 'application/json; charset=utf-8'),
+    'ndjson': ('ndjson', 'application/x-ndjson; charset=utf-8'),
+    'excel': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+}
+
+CHUNK_BYTES = 64 * 1024
+
+
+def build_export_query(report_type: str, start_date: Optional[str], end_date: Optional[str]) -> Dict:
+    """
+    Query, parameter dan nama file untuk satu tipe laporan
+
+    Returns:
+        Dict dengan query, params, filename, start_date, end_date dan days
+        (panjang rentang, untuk memilih streaming langsung atau file resumable)
+
+    Raises:
+        ValueError: tipe 'range' tanpa start_date/end_date
+    """
+    today = datetime.now()
+
+    if report_type == 'daily':
+        date_filter = start_date or today.strftime('%Y-%m-%d')
+        query = """
+        SELECT e.name as 'Nama Karyawan', e.bagian as 'Bagian',
+               r.jam_masuk as 'Waktu Masuk', r.jam_pulang as 'Waktu Keluar',
+               r.status as 'Status',
+               r.work_hours as 'Total Jam'
+        FROM employees e
+        LEFT JOIN attendance_daily_employee r ON r.employee_id = e.id AND r.tanggal = %s
+        ORDER BY e.name
+        """
+        return {'query': query, 'params': (date_filter,), 'filename': f"laporan_harian_{date_filter}",
+                'start_date': start_date, 'end_date': end_date, 'days': 1}
+
+    if report_type == 'weekly':
+        if not start_date or not end_date:
+            # Default to current week
+            start_week = today - timedelta(days=today.weekday())
+            start_date = start_week.strftime('%Y-%m-%d')
+            end_date = (start_week + timedelta(days=6)).strftime('%Y-%m-%d')
+        query = """
+        SELECT e.name as 'Nama Karyawan', e.bagian as 'Bagian',
+               COUNT(r.tanggal) as 'Total Hari Kerja',
+               COALESCE(SUM(r.hadir), 0) as 'Hari Hadir',
+               COALESCE(SUM(r.terlambat), 0) as 'Hari Terlambat',
+               ROUND(AVG(r.work_hours), 2) as 'Rata-rata Jam Kerja'
+        FROM employees e
+        LEFT JOIN attendance_daily_employee r ON r.employee_id = e.id
+                                AND r.tanggal BETWEEN %s AND %s
+        GROUP BY e.id, e.name, e.bagian
+        ORDER BY e.name
+        """
+        filename = f"laporan_mingguan_{start_date}_to_{end_date}"
+
+    elif report_type == 'monthly':
+        if not start_date or not end_date:
+            # Default to current month
+            first_day = today.replace(day=1)
+            if today.month == 12:
+                last_day = today.replace(year=today.year + 1, month=1, day=1) - timedelta(days=1)
+            else:
+                last_day = today.replace(month=today.month + 1, day=1) - timedelta(days=1)
+            start_date = first_day.strftime('%Y-%m-%d')
+            end_date = last_day.strftime('%Y-%m-%d')
+        query = """
+        SELECT e.name as 'Nama Karyawan', e.bagian as 'Bagian',
+               COUNT(r.tanggal) as 'Total Hari Kerja',
+               COALESCE(SUM(r.hadir), 0) as 'Hari Hadir',
+               COALESCE(SUM(r.terlambat), 0) as 'Hari Terlambat',
+               ROUND(SUM(r.work_hours), 2) as 'Total Jam Kerja',
+               ROUND(AVG(r.work_hours), 2) as 'Rata-rata Jam Kerja'
+        FROM employees e
+        LEFT JOIN attendance_daily_employee r ON r.employee_id = e.id
+                                AND r.tanggal BETWEEN %s AND %s
+        GROUP BY e.id, e.name, e.bagian
+        ORDER BY e.name
+        """
+        filename = f"laporan_bulanan_{start_date}_to_{end_date}"
+
+    elif report_type == 'performance':
+        if not start_date or not end_date:
+            # Default to last 30 days
+            end_date = today.strftime('%Y-%m-%d')
+            start_date = (today - timedelta(days=30)).strftime('%Y-%m-%d')
+        query = """
+        SELECT e.name as 'Nama Karyawan', e.bagian as 'Bagian',
+               COUNT(r.tanggal) as 'Total Absen',
+               COALESCE(SUM(r.hadir), 0) as 'Total Hadir',
+               COALESCE(SUM(r.tepat_waktu), 0) as 'Tepat Waktu',
+               COALESCE(SUM(r.terlambat), 0) as 'Terlambat',
+               ROUND(AVG(r.work_hours), 2) as 'Rata-rata Jam Kerja',
+               ROUND((COALESCE(SUM(r.hadir), 0) / 30.0) * 100, 1) as 'Persentase Kehadiran'
+        FROM employees e
+        LEFT JOIN attendance_daily_employee r ON r.employee_id = e.id
+                                AND r.tanggal BETWEEN %s AND %s
+        GROUP BY e.id, e.name, e.bagian
+        ORDER BY e.name
+        """
+        filename = f"laporan_kinerja_{start_date}_to_{end_date}"
+
+    else:  # range type
+        if not start_date or not end_date:
+            raise ValueError('Start date and end date required')
+        query = """
+        SELECT e.name as 'Nama Karyawan', e.bagian as 'Bagian',
+               r.tanggal as 'Tanggal',
+               r.jam_masuk as 'Waktu Masuk', r.jam_pulang as 'Waktu Keluar',
+               r.status as 'Status',
+               r.work_hours as 'Total Jam'
+        FROM employees e
+        LEFT JOIN attendance_daily_employee r ON r.employee_id = e.id
+                                AND r.tanggal BETWEEN %s AND %s
+        ORDER BY e.name, r.tanggal
+        """
+        filename = f"laporan_{start_date}_to_{end_date}"
+
+    try:
+        days = (datetime.strptime(end_date, '%Y-%m-%d') - datetime.strptime(start_date, '%Y-%m-%d')).days + 1
+    except ValueError:
+        days = 1
+    return {'query': query, 'params': (start_date, end_date), 'filename': filename,
+            'start_date': start_date, 'end_date': end_date, 'days': days}
+
+
+def _json_default(value):
+    """Serialisasi tipe hasil PyMySQL (DATE, TIME -> timedelta, DECIMAL)"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return str(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+def _chunked(pieces: Iterable[str], chunk_bytes: int = CHUNK_BYTES) -> Iterator[bytes]:
+    """Gabungkan potongan teks kecil menjadi chunk ~chunk_bytes"""
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_bytes:
+            yield ''.join(buffer).encode('utf-8')
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def iter_csv(rows: Iterable[Dict], columns: List[str]) -> Iterator[bytes]:
+    """CSV (header + baris) sebagai chunk bytes"""
+    def lines():
+        line = StringIO()
+        writer = csv.DictWriter(line, fieldnames=columns)
+        writer.writeheader()
+        yield line.getvalue()
+        for row in rows:
+            line.seek(0)
+            line.truncate()
+            writer.writerow(row)
+            yield line.getvalue()
+    return _chunked(lines())
+
+
+def iter_ndjson(rows: Iterable[Dict]) -> Iterator[bytes]:
+    """Satu objek JSON per baris"""
+    return _chunked(json.dumps(row, default=_json_default, ensure_ascii=False) + '\n' for row in rows)
+
+
+def iter_json(rows: Iterable[Dict], meta: Dict) -> Iterator[bytes]:
+    """
+    Objek JSON seperti export lama (metadata + data); total_records ditulis
+    setelah array data karena jumlah baris baru diketahui di akhir
+    """
+    def pieces():
+        head = json.dumps(meta, default=_json_default, ensure_ascii=False)
+        yield head[:-1] + ', "data": ['
+        count = 0
+        for row in rows:
+            yield (', ' if count else '') + json.dumps(row, default=_json_default, ensure_ascii=False)
+            count += 1
+        yield f'], "total_records": {count}}}'
+    return _chunked(pieces())
+
+
+def write_xlsx(path: str, rows: Iterable[Dict], columns: List[str],
+               sheet_name: str = 'Laporan Absensi', sample_rows: int = 200):
+    """
+    Tulis xlsx dengan openpyxl write-only mode (baris langsung di-stream ke disk)
+
+    Lebar kolom diperkirakan dari sample_rows baris pertama, karena di
+    write-only mode lebar harus diset sebelum baris pertama ditulis.
+    """
+    from openpyxl import Workbook
+    from openpyxl.utils import get_column_letter
+
+    rows = iter(rows)
+    sample = []
+    for row in rows:
+        sample.append(row)
+        if len(sample) >= sample_rows:
+            break
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(sheet_name)
+    for index, column in enumerate(columns, start=1):
+        max_length = max([len(str(column))] + [len(str(row.get(column) or '')) for row in sample])
+        worksheet.column_dimensions[get_column_letter(index)].width = min(max_length + 2, 30)
+
+    worksheet.append(columns)
+    for row in sample:
+        worksheet.append([_excel_value(row.get(column)) for column in columns])
+    for row in rows:
+        worksheet.append([_excel_value(row.get(column)) for column in columns])
+    workbook.save(path)
+
+
+def _excel_value(value):
+    # TIME columns come back as timedelta; show them as HH:MM:SS text like the CSV
+    if isinstance(value, timedelta):
+        return str(value)
+    return value
+
+
+class ExportFileCache:
+    """
+    File export yang sudah dirender, dipakai ulang selama cache_ttl detik.
+
+    File baru ditulis ke .tmp lalu di-rename (atomic) dengan lock per file,
+    jadi dua request untuk export yang sama tidak merender dua kali.
+    """
+
+    def __init__(self, cache_dir: str, ttl: int = 600, max_age: int = 86400):
+        # Absolute, because send_file resolves relative paths against the app root
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.ttl = ttl
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.file_locks = {}
+
+    def path_for(self, *key_parts, extension: str) -> str:
+        key = hashlib.sha1('|'.join(str(part) for part in key_parts).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.{extension}")
+
+    def _is_fresh(self, path: str) -> bool:
+        try:
+            return time.time() - os.path.getmtime(path) < self.ttl
+        except OSError:
+            return False
+
+    def get_or_render(self, path: str, render_fn: Callable[[str], bool]) -> Optional[str]:
+        """
+        Path file cache; render_fn(tmp_path) dipanggil jika belum ada/basi
+
+        render_fn mengembalikan False jika tidak ada data (file tidak disimpan).
+        """
+        with self.lock:
+            file_lock = self.file_locks.setdefault(path, threading.Lock())
+        with file_lock:
+            if self._is_fresh(path):
+                return path
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._prune()
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            try:
+                if not render_fn(tmp_path):
+                    return None
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            logger.info(f"Export dirender ke {path} ({os.path.getsize(path)} bytes)")
+            return path
+
+    def _prune(self):
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            file_path = os.path.join(self.cache_dir, name)
+            try:
+                if now - os.path.getmtime(file_path) > self.max_age:
+                    os.remove(file_path)
+            except OSError:
+                pass
+
+
+def peek_rows(rows: Iterator[Dict]) -> Tuple[Optional[Dict], Iterator[Dict]]:
+    """Baris pertama (None jika kosong) dan iterator yang masih berisi baris tersebut"""
+    first = next(rows, None)
+    if first is None:
+        return None, iter(())
+
+    def chained():
+        try:
+            yield first
+            yield from rows
+        finally:
+            # Abandoned download: release the server-side cursor now, not at GC time
+            close = getattr(rows, 'close', None)
+            if close:
+                close()
+    return first, chained()
+
+
+# Instance global cache file export
+export_file_cache = ExportFileCache(EXPORT_CONFIG['cache_dir'], EXPORT_CONFIG['cache_ttl'],
+                                    EXPORT_CONFIG['cache_max_age'])
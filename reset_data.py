@@ -3,6 +3,7 @@
 Script untuk menghapus semua data karyawan dan foto training
 """
 import os
+import glob
 import shutil
 import pymysql
 from config import DATABASE_CONFIG
@@ -19,8 +20,10 @@ def reset_all_data():
     # 2. Hapus file model training
     model_files = [
         "static/face_embeddings.pkl",
+        "static/face_embeddings.json",
+        "static/face_embeddings.ivf.npz",
         "static/employee_photos"
-    ]
+    ] + glob.glob("static/face_embeddings.*.npy")
     
     for file_path in model_files:
         if os.path.exists(file_path):
@@ -49,6 +52,10 @@ def reset_all_data():
             cursor.execute("DELETE FROM attendance")
             deleted_attendance = cursor.rowcount
             
+            # Hapus rollup laporan
+            cursor.execute("DELETE FROM attendance_daily_employee")
+            cursor.execute("DELETE FROM attendance_daily_bagian")
+            
             # Reset auto increment
             cursor.execute("ALTER TABLE employees AUTO_INCREMENT = 1")
             cursor.execute("ALTER TABLE attendance AUTO_INCREMENT = 1")
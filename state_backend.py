@@ -0,0 +1,409 @@
+"""
+State Backend - Penyimpanan state bersama antar worker
+
+Sesi QR, camera lock, status training dan cache QR dulu berupa variabel
+global per proses, sehingga dengan lebih dari satu worker gunicorn scan QR
+di worker A tidak terlihat oleh laptop yang polling ke worker B. Modul ini
+menyediakan satu interface key-value dengan TTL dan compare-and-set atomik:
+
+- memory  dict di dalam proses (default, satu worker)
+- sqlite  file SQLite bersama (beberapa worker di satu mesin)
+- redis   server Redis atau yang kompatibel protokolnya (beberapa mesin);
+          client lain seperti fakeredis bisa dipasang untuk pengujian
+
+Nilai disimpan sebagai JSON, jadi yang dibaca selalu salinan.
+"""
+
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import logging
+from typing import Any, Callable, Dict, Optional
+
+from config import STATE_BACKEND_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+def _encode(value) -> str:
+    # sort_keys: equal values always encode identically, compare_and_set compares encodings
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def _expires_at(ttl: Optional[float]) -> Optional[float]:
+    return time.time() + ttl if ttl else None
+
+
+class StateBackend:
+    """
+    Interface state bersama
+
+    compare_and_set(key, expected, value): expected None = key belum ada,
+    value None = hapus key. Semua operasi lain dibangun di atasnya.
+    """
+
+    name = 'base'
+
+    def __init__(self, prefix: str = '', purge_interval: float = 60):
+        self.prefix = prefix
+        self.purge_interval = purge_interval  # Detik antar purge_expired() otomatis saat write (0 = mati)
+        self._purge_lock = threading.Lock()
+        self._purged_at = time.time()
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    # Implemented by subclasses, on encoded values and prefixed keys
+    def _get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def _set(self, key: str, encoded: str, ttl: Optional[float]):
+        raise NotImplementedError
+
+    def _delete(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def _compare_and_set(self, key: str, expected: Optional[str], encoded: Optional[str],
+                         ttl: Optional[float]) -> bool:
+        raise NotImplementedError
+
+    def purge_expired(self) -> int:
+        """Hapus key yang sudah expired; mengembalikan jumlah key"""
+        return 0
+
+    def _maybe_purge(self):
+        """Expired keys are only filtered on read; drop them from storage every purge_interval"""
+        if not self.purge_interval:
+            return
+        now = time.time()
+        with self._purge_lock:
+            if now - self._purged_at < self.purge_interval:
+                return
+            self._purged_at = now
+        try:
+            purged = self.purge_expired()
+            if purged:
+                logger.debug(f"State backend: {purged} key expired dihapus")
+        except Exception as e:
+            logger.warning(f"State backend: purge key expired gagal: {e}")
+
+    def get(self, key: str, default=None) -> Any:
+        encoded = self._get(self._key(key))
+        return json.loads(encoded) if encoded is not None else default
+
+    def set(self, key: str, value, ttl: Optional[float] = None):
+        """Simpan value; ttl dalam detik (None = tidak expired)"""
+        self._set(self._key(key), _encode(value), ttl)
+        self._maybe_purge()
+
+    def delete(self, key: str) -> bool:
+        return self._delete(self._key(key))
+
+    def compare_and_set(self, key: str, expected, value, ttl: Optional[float] = None) -> bool:
+        """Tulis value hanya jika nilai sekarang sama dengan expected (atomik)"""
+        written = self._compare_and_set(
+            self._key(key),
+            _encode(expected) if expected is not None else None,
+            _encode(value) if value is not None else None,
+            ttl
+        )
+        if written:
+            self._maybe_purge()
+        return written
+
+    def set_if_absent(self, key: str, value, ttl: Optional[float] = None) -> bool:
+        return self.compare_and_set(key, None, value, ttl)
+
+    def update(self, key: str, fn: Callable[[Any], Any], ttl: Optional[float] = None, retries: int = 20):
+        """
+        Read-modify-write dengan retry compare_and_set
+
+        fn(nilai sekarang atau None) mengembalikan nilai baru (None = hapus).
+        Mengembalikan nilai yang tersimpan.
+        """
+        for _ in range(retries):
+            current = self.get(key)
+            value = fn(current)
+            if value == current:
+                return current
+            if self.compare_and_set(key, current, value, ttl):
+                return value
+        raise RuntimeError(f"State backend: update '{key}' gagal setelah {retries} percobaan")
+
+    def get_stats(self) -> Dict:
+        return {'backend': self.name}
+
+
+class MemoryStateBackend(StateBackend):
+    """State di dalam proses; hanya untuk satu worker"""
+
+    name = 'memory'
+
+    def __init__(self, prefix: str = ''):
+        super().__init__(prefix)
+        self.lock = threading.Lock()
+        self._data = {}  # key -> (encoded, expires_at)
+
+    def _live(self, key: str) -> Optional[str]:
+        # Caller holds self.lock
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.time():
+            del self._data[key]
+            return None
+        return entry[0]
+
+    def _get(self, key):
+        with self.lock:
+            return self._live(key)
+
+    def _set(self, key, encoded, ttl):
+        with self.lock:
+            self._data[key] = (encoded, _expires_at(ttl))
+
+    def _delete(self, key):
+        with self.lock:
+            return self._live(key) is not None and self._data.pop(key, None) is not None
+
+    def _compare_and_set(self, key, expected, encoded, ttl):
+        with self.lock:
+            if self._live(key) != expected:
+                return False
+            if encoded is None:
+                self._data.pop(key, None)
+            else:
+                self._data[key] = (encoded, _expires_at(ttl))
+            return True
+
+    def purge_expired(self):
+        now = time.time()
+        with self.lock:
+            expired = [key for key, (_, expires_at) in self._data.items()
+                       if expires_at is not None and expires_at <= now]
+            for key in expired:
+                del self._data[key]
+        return len(expired)
+
+    def get_stats(self):
+        with self.lock:
+            return {'backend': self.name, 'keys': len(self._data)}
+
+
+class SQLiteStateBackend(StateBackend):
+    """State di file SQLite (mode WAL); aman untuk beberapa proses di satu mesin"""
+
+    name = 'sqlite'
+
+    def __init__(self, path: str, prefix: str = ''):
+        super().__init__(prefix)
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            # Autocommit; compare_and_set opens its own BEGIN IMMEDIATE transaction
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def _select(self, conn, key) -> Optional[str]:
+        row = conn.execute("SELECT value, expires_at FROM state WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return row[0]
+
+    def _get(self, key):
+        return self._select(self._conn(), key)
+
+    def _set(self, key, encoded, ttl):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, encoded, _expires_at(ttl))
+        )
+
+    def _delete(self, key):
+        cursor = self._conn().execute(
+            "DELETE FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+        )
+        return cursor.rowcount > 0
+
+    def _compare_and_set(self, key, expected, encoded, ttl):
+        conn = self._conn()
+        # IMMEDIATE takes the write lock up front, so no other process writes between read and write
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self._select(conn, key) != expected:
+                conn.execute("ROLLBACK")
+                return False
+            if encoded is None:
+                conn.execute("DELETE FROM state WHERE key = ?", (key,))
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, encoded, _expires_at(ttl))
+                )
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def purge_expired(self):
+        cursor = self._conn().execute(
+            "DELETE FROM state WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+        )
+        return cursor.rowcount
+
+    def get_stats(self):
+        row = self._conn().execute("SELECT COUNT(*) FROM state").fetchone()
+        return {'backend': self.name, 'path': self.path, 'keys': row[0]}
+
+
+# KEYS[1] key; ARGV: expect_absent, expected, delete, value, ttl_ms
+_REDIS_CAS_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if ARGV[1] == '1' then
+    if current then return 0 end
+elseif current ~= ARGV[2] then
+    return 0
+end
+if ARGV[3] == '1' then
+    redis.call('DEL', KEYS[1])
+elseif tonumber(ARGV[5]) > 0 then
+    redis.call('SET', KEYS[1], ARGV[4], 'PX', ARGV[5])
+else
+    redis.call('SET', KEYS[1], ARGV[4])
+end
+return 1
+"""
+
+
+class RedisStateBackend(StateBackend):
+    """State di Redis (atau server/client yang kompatibel); compare_and_set via script Lua"""
+
+    name = 'redis'
+
+    def __init__(self, url: str = 'redis://localhost:6379/0', prefix: str = '', client=None):
+        super().__init__(prefix)
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self._cas = client.register_script(_REDIS_CAS_SCRIPT)
+
+    @staticmethod
+    def _ttl_ms(ttl) -> int:
+        return max(int(ttl * 1000), 1) if ttl else 0
+
+    def _get(self, key):
+        value = self.client.get(key)
+        return value.decode() if isinstance(value, bytes) else value
+
+    def _set(self, key, encoded, ttl):
+        self.client.set(key, encoded, px=self._ttl_ms(ttl) or None)
+
+    def _delete(self, key):
+        return self.client.delete(key) > 0
+
+    def _compare_and_set(self, key, expected, encoded, ttl):
+        result = self._cas(keys=[key], args=[
+            '1' if expected is None else '0', expected or '',
+            '1' if encoded is None else '0', encoded or '',
+            self._ttl_ms(ttl)
+        ])
+        return int(result) == 1
+
+    def get_stats(self):
+        # Only this app's keys; the Redis database may be shared with other applications
+        if self.prefix:
+            keys = sum(1 for _ in self.client.scan_iter(match=self._escape_pattern(self.prefix) + '*', count=500))
+        else:
+            keys = self.client.dbsize()
+        return {'backend': self.name, 'keys': keys}
+
+    @staticmethod
+    def _escape_pattern(value: str) -> str:
+        for char in '\\*?[]':
+            value = value.replace(char, '\\' + char)
+        return value
+
+
+class SharedVersion:
+    """
+    Token versi data bersama di state backend
+
+    bump() dari worker mana pun mengganti token (acak, bukan counter: backend
+    memory yang di-restart tidak boleh cocok dengan token lama). Cache per
+    proses membandingkan current() dengan token saat cache diisi.
+    check_interval > 0 membatasi round trip ke backend: token dibaca ulang
+    paling sering sekali per interval.
+    """
+
+    def __init__(self, key: str, backend: Optional[StateBackend] = None, check_interval: float = 0):
+        self.key = key
+        self._backend = backend
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self._token = None
+        self._checked_at = 0.0
+
+    @property
+    def backend(self) -> StateBackend:
+        return self._backend or state_backend
+
+    def current(self) -> str:
+        if self.check_interval:
+            with self.lock:
+                if self._token is not None and time.time() - self._checked_at < self.check_interval:
+                    return self._token
+        token = self.backend.get(self.key)
+        if token is None:
+            self.backend.set_if_absent(self.key, secrets.token_hex(8))
+            token = self.backend.get(self.key)
+        with self.lock:
+            self._token = token
+            self._checked_at = time.time()
+        return token
+
+    def bump(self) -> str:
+        token = secrets.token_hex(8)
+        self.backend.set(self.key, token)
+        with self.lock:
+            self._token = token
+            self._checked_at = time.time()
+        return token
+
+
+def create_state_backend(config: Dict) -> StateBackend:
+    """Buat backend sesuai konfigurasi; kembali ke memory jika backend tidak tersedia"""
+    backend = config.get('backend', 'memory').lower()
+    prefix = config.get('prefix', '')
+    try:
+        if backend == 'sqlite':
+            return SQLiteStateBackend(config['sqlite_path'], prefix)
+        if backend == 'redis':
+            return RedisStateBackend(config['redis_url'], prefix)
+    except ImportError:
+        logger.warning("⚠️ Package redis tidak tersedia, state backend memakai memory. Install: pip install redis")
+    except Exception as e:
+        logger.error(f"State backend '{backend}' gagal dibuat, memakai memory: {e}")
+    else:
+        if backend != 'memory':
+            logger.warning(f"State backend '{backend}' tidak dikenal, memakai memory")
+    return MemoryStateBackend(prefix)
+
+
+# Instance global state backend
+state_backend = create_state_backend(STATE_BACKEND_CONFIG)
@@ -85,7 +85,7 @@ print(f"Saved Photos: {saved_count}")
 print("="*50)
 
 # 5. Cek file model
-model_file = "static/face_embeddings.pkl"
+model_file = "static/face_embeddings.json"
 if os.path.exists(model_file):
     stat = os.stat(model_file)
     print(f"✅ Model file exists: {model_file}")
@@ -0,0 +1,208 @@
+"""
+Training Job Manager - Menjalankan training model wajah di background
+
+HTTP request hanya mendaftarkan job dan langsung mendapat job_id; training
+berjalan di executor khusus (satu job sekaligus). Permintaan retrain yang
+masuk selagi masih ada job yang antri digabung ke job tersebut.
+"""
+
+import threading
+import time
+import uuid
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class TrainingJobManager:
+    """
+    Antrian job training dengan progress, ETA dan throughput per job.
+
+    train_fn dipanggil sebagai train_fn(full_rebuild=..., progress_callback=...)
+    dengan progress_callback(done, total, image_name) per foto.
+    on_update(snapshot) dipanggil saat status job berubah dan saat progress
+    bertambah (paling sering sekali per progress_interval detik).
+    """
+
+    def __init__(self, train_fn, history_limit=50, on_update=None, progress_interval=0.5):
+        self.train_fn = train_fn
+        self.history_limit = history_limit
+        self.on_update = on_update
+        self.progress_interval = progress_interval
+        self._last_progress_update = {}  # {job_id: time.time() of the last progress on_update}
+        self.jobs = OrderedDict()  # {job_id: job dict}, oldest first
+        self.lock = threading.Lock()
+        self.pending_job_id = None  # Job yang antri dan belum mulai (target coalescing)
+        self.running_job_id = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='training-job')
+
+    def submit(self, full_rebuild=False, employee_name='', reason=''):
+        """
+        Daftarkan retrain. Jika sudah ada job yang antri, request digabung.
+
+        Returns:
+            Tuple (job snapshot dict, created) - created False jika digabung
+        """
+        with self.lock:
+            pending = self.jobs.get(self.pending_job_id)
+            if pending is not None:
+                pending['full_rebuild'] = pending['full_rebuild'] or full_rebuild
+                pending['request_count'] += 1
+                if employee_name and employee_name not in pending['employee_names']:
+                    pending['employee_names'].append(employee_name)
+                logger.info(f"Training request coalesced into queued job {pending['id']}")
+                return self._snapshot(pending), False
+
+            job_id = uuid.uuid4().hex[:12]
+            job = {
+                'id': job_id,
+                'status': 'queued',
+                'full_rebuild': full_rebuild,
+                'employee_names': [employee_name] if employee_name else [],
+                'reason': reason,
+                'request_count': 1,
+                'images_done': 0,
+                'images_total': None,
+                'current_image': None,
+                'success': None,
+                'error': None,
+                'created_at': time.time(),
+                'started_at': None,
+                'first_image_at': None,
+                'finished_at': None
+            }
+            self.jobs[job_id] = job
+            self.pending_job_id = job_id
+            self._trim_history()
+            snapshot = self._snapshot(job)
+
+        self.executor.submit(self._run, job_id)
+        logger.info(f"Training job {job_id} queued ({reason or 'manual'})")
+        self._notify(snapshot)
+        return snapshot, True
+
+    def _notify(self, snapshot):
+        if self.on_update is None or snapshot is None:
+            return
+        try:
+            self.on_update(snapshot)
+        except Exception as e:
+            logger.error(f"Training job update callback failed: {e}")
+
+    def _trim_history(self):
+        """Buang job lama yang sudah selesai (lock harus dipegang)"""
+        while len(self.jobs) > self.history_limit:
+            oldest_id, oldest = next(iter(self.jobs.items()))
+            if oldest['status'] in ('queued', 'running'):
+                break
+            del self.jobs[oldest_id]
+
+    def _run(self, job_id):
+        with self.lock:
+            job = self.jobs[job_id]
+            if self.pending_job_id == job_id:
+                self.pending_job_id = None
+            self.running_job_id = job_id
+            job['status'] = 'running'
+            job['started_at'] = time.time()
+            full_rebuild = job['full_rebuild']
+            snapshot = self._snapshot(job)
+        self._notify(snapshot)
+
+        try:
+            success = self.train_fn(
+                full_rebuild=full_rebuild,
+                progress_callback=lambda done, total, image: self._update_progress(job_id, done, total, image)
+            )
+            with self.lock:
+                job['success'] = bool(success)
+                job['status'] = 'completed' if success else 'failed'
+                if not success:
+                    job['error'] = 'Training gagal - tidak ada data wajah yang valid'
+        except Exception as e:
+            logger.error(f"Training job {job_id} crashed: {e}")
+            with self.lock:
+                job['success'] = False
+                job['status'] = 'failed'
+                job['error'] = str(e)
+        finally:
+            with self.lock:
+                job['finished_at'] = time.time()
+                if self.running_job_id == job_id:
+                    self.running_job_id = None
+                self._last_progress_update.pop(job_id, None)
+                snapshot = self._snapshot(job)
+            self._notify(snapshot)
+            logger.info(f"Training job {job_id} {job['status']} in {job['finished_at'] - job['started_at']:.1f}s")
+
+    def _update_progress(self, job_id, done, total, image_name):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return
+            if job['first_image_at'] is None:
+                job['first_image_at'] = time.time()
+            job['images_done'] = done
+            job['images_total'] = total
+            job['current_image'] = image_name
+            now = time.time()
+            if self.on_update is None or now - self._last_progress_update.get(job_id, 0) < self.progress_interval:
+                return
+            self._last_progress_update[job_id] = now
+            snapshot = self._snapshot(job)
+        self._notify(snapshot)
+
+    def _snapshot(self, job):
+        """Salinan job + field turunan (progress, throughput, ETA). Lock harus dipegang."""
+        now = time.time()
+        snapshot = {k: v for k, v in job.items() if k not in ('first_image_at',)}
+        snapshot['employee_names'] = list(job['employee_names'])
+
+        total = job['images_total']
+        done = job['images_done']
+        if job['status'] == 'completed':
+            progress = 100
+        elif total:
+            progress = int(100 * done / total)
+        else:
+            progress = 0
+
+        throughput = None
+        eta_seconds = None
+        if job['first_image_at'] is not None and done:
+            end = job['finished_at'] or now
+            elapsed = max(end - job['first_image_at'], 1e-6)
+            throughput = done / elapsed
+            if job['status'] == 'running' and total:
+                eta_seconds = (total - done) / throughput
+
+        started = job['started_at']
+        snapshot.update({
+            'progress': progress,
+            'images_per_second': round(throughput, 2) if throughput is not None else None,
+            'eta_seconds': round(eta_seconds, 1) if eta_seconds is not None else None,
+            'elapsed_seconds': round((job['finished_at'] or now) - started, 1) if started else 0
+        })
+        for key in ('created_at', 'started_at', 'finished_at'):
+            if snapshot[key] is not None:
+                snapshot[key] = datetime.fromtimestamp(snapshot[key]).isoformat()
+        return snapshot
+
+    def get_job(self, job_id):
+        """Snapshot satu job, atau None jika tidak dikenal"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return self._snapshot(job) if job else None
+
+    def get_active_job(self):
+        """Job yang sedang berjalan (atau antri) saat ini"""
+        with self.lock:
+            job = self.jobs.get(self.running_job_id) or self.jobs.get(self.pending_job_id)
+            return self._snapshot(job) if job else None
+
+    def shutdown(self, wait=False):
+        """Hentikan executor (job yang sedang berjalan dibiarkan selesai jika wait=True)"""
+        self.executor.shutdown(wait=wait, cancel_futures=not wait)